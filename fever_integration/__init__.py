@@ -1,20 +1,34 @@
-from .client import FeverClient
-from .endpoints import get_db, router
-from .main import app
-from .models import Base, Plan
-from .session import AsyncSessionLocal
-from .sync import background_sync, sync_events
-from .config import settings
+import importlib
+from typing import Any, List
 
-__all__ = [
-    "FeverClient",
-    "app",
-    "Base",
-    "Plan",
-    "sync_events",
-    "background_sync",
-    "AsyncSessionLocal",
-    "get_db",
-    "router",
-    "settings",
-]
+# Names are imported from their module on first access (PEP 562), so that
+# importing a submodule (e.g. client in parse workers) does not build the app
+_exports = {
+    "FeverClient": "client",
+    "ProviderSources": "providers",
+    "app": "main",
+    "Base": "models",
+    "Plan": "models",
+    "EventSummary": "models",
+    "sync_events": "sync",
+    "SyncScheduler": "scheduler",
+    "AsyncSessionLocal": "session",
+    "get_db": "endpoints",
+    "router": "endpoints",
+    "settings": "config",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str) -> Any:
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,258 @@
+"""Admission control for the database-backed /events handlers.
+
+At most ADMISSION_MAX_CONCURRENCY of them query the database at a time and
+up to ADMISSION_QUEUE_SIZE more wait for a slot, each for at most
+ADMISSION_QUEUE_TIMEOUT seconds. Past that, requests are answered 503 with a
+Retry-After right away instead of queueing for a pooled connection until the
+client gives up. GET /events answers with the last body of the same query
+instead, when one is kept. Optionally, each client gets RATE_LIMIT_PER_SECOND
+requests per second (429 past that).
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncContextManager, AsyncIterator, Deque, Hashable, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from . import metrics
+from .config import settings
+from .http_cache import BodyCache, encoded_response
+from .session import read_engines
+from .snapshot import current_snapshot
+
+# Starting estimate of how long a request holds its slot, in seconds
+INITIAL_HOLD_TIME = 0.05
+# Weight of the latest request in the hold time estimate
+HOLD_TIME_SMOOTHING = 0.1
+
+
+class Overloaded(HTTPException):
+    """Raised instead of waiting when the request cannot be admitted"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float) -> None:
+        seconds = max(1, math.ceil(retry_after))
+        super().__init__(status_code, detail, headers={"Retry-After": str(seconds)})
+
+
+def default_concurrency() -> int:
+    """As many as the read pools hold, so admitted requests do not wait for
+    a connection"""
+    per_pool = settings.DB_READ_POOL_SIZE + settings.DB_READ_MAX_OVERFLOW
+    return per_pool * len(read_engines)
+
+
+class AdmissionLimiter:
+    """At most ``limit`` holders at a time, ``queue_size`` more waiting up to
+    ``timeout`` seconds in arrival order. A limit of 0 admits everything."""
+
+    def __init__(self, limit: int, queue_size: int, timeout: float) -> None:
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.hold_time = INITIAL_HOLD_TIME
+        # Created per wait rather than an asyncio.Semaphore at import, which
+        # Python 3.9 binds to the event loop of the importing thread
+        self._waiters: "Deque[asyncio.Future[None]]" = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def expected_wait(self) -> float:
+        """Seconds the next request would wait for a slot, estimated from how
+        long requests hold one"""
+        return (self.waiting + 1) / self.limit * self.hold_time
+
+    def _reject(self, reason: str) -> Overloaded:
+        metrics.observe_rejection(reason)
+        return Overloaded(503, "Too many requests, retry later.", self.expected_wait())
+
+    async def acquire(self) -> None:
+        if self.limit <= 0:
+            return
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if self.waiting >= self.queue_size:
+            raise self._reject("queue_full")
+        if self.expected_wait() > self.timeout:
+            # It would likely time out in the queue, fail it now
+            raise self._reject("expected_wait")
+
+        started = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            # Unless the slot was handed over just as the wait timed out
+            if waiter.cancelled():
+                raise self._reject("timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(0.0)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        metrics.observe_admission_wait(time.perf_counter() - started)
+
+    def release(self, held: float) -> None:
+        if self.limit <= 0:
+            return
+        self.hold_time += HOLD_TIME_SMOOTHING * (held - self.hold_time)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # Handed over, active stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+
+class RateLimiter:
+    """Token bucket per client: ``rate`` requests per second, bursts of up to
+    ``burst``. The ``max_clients`` most recently seen clients are tracked."""
+
+    def __init__(self, rate: float, burst: int, max_clients: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def retry_after(self, client: Hashable) -> Optional[float]:
+        """Takes a token for the client, or returns the seconds until one is
+        available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(client, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        self._buckets[client] = (tokens - 1 if allowed else tokens, now)
+        self._buckets.move_to_end(client)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return None if allowed else (1 - tokens) / self.rate
+
+
+_limiter = AdmissionLimiter(
+    (
+        default_concurrency()
+        if settings.ADMISSION_MAX_CONCURRENCY is None
+        else settings.ADMISSION_MAX_CONCURRENCY
+    ),
+    settings.ADMISSION_QUEUE_SIZE,
+    settings.ADMISSION_QUEUE_TIMEOUT,
+)
+_rate_limiter = RateLimiter(
+    settings.RATE_LIMIT_PER_SECOND,
+    settings.RATE_LIMIT_BURST,
+    settings.RATE_LIMIT_MAX_CLIENTS,
+)
+# Last body of each GET /events query, kept across syncs for overload
+_stale_bodies = BodyCache(settings.ADMISSION_STALE_CACHE_BYTES)
+
+
+def _uses_database(snapshot_reads: bool) -> bool:
+    return not (
+        snapshot_reads and settings.EVENTS_SNAPSHOT and current_snapshot() is not None
+    )
+
+
+def admitted(snapshot_reads: bool = False) -> AsyncContextManager[None]:
+    """Holds a database slot for the block, Overloaded if none is free in time.
+
+    With snapshot_reads, the block answers from the in-memory snapshot when
+    one is loaded, and needs no slot then.
+    """
+    if not _uses_database(snapshot_reads):
+        return nullcontext()
+    return _limiter.slot()
+
+
+def client_key(request: Request) -> str:
+    """The address the request came from. Behind RATE_LIMIT_TRUSTED_PROXIES
+    proxies, the address the outermost of them received it from"""
+    peer = request.client.host if request.client else "unknown"
+    trusted = settings.RATE_LIMIT_TRUSTED_PROXIES
+    if trusted <= 0:
+        return peer
+    forwarded = [
+        address.strip()
+        for header in request.headers.getlist("X-Forwarded-For")
+        for address in header.split(",")
+        if address.strip()
+    ]
+    # Each proxy appends the address it received the request from, so only
+    # the last entries are trustworthy: the client can send any others
+    if len(forwarded) < trusted:
+        return peer
+    return forwarded[-trusted]
+
+
+async def rate_limit(request: Request) -> None:
+    """Router dependency answering 429 to clients over their rate"""
+    if settings.RATE_LIMIT_PER_SECOND <= 0:
+        return
+    retry_after = _rate_limiter.retry_after(client_key(request))
+    if retry_after is not None:
+        metrics.observe_rejection("rate_limited")
+        raise Overloaded(429, "Rate limit exceeded, retry later.", retry_after)
+
+
+def remember_body(key: Hashable, body: bytes) -> None:
+    if settings.ADMISSION_SERVE_STALE:
+        _stale_bodies.set(repr(key), body)
+
+
+async def stale_response(request: Request, key: Hashable) -> Optional[Response]:
+    """The last body served for the query, marked stale, if one is kept"""
+    if not settings.ADMISSION_SERVE_STALE:
+        return None
+    body = _stale_bodies.get(repr(key))
+    if body is None:
+        return None
+    metrics.observe_stale()
+    response = await encoded_response(request, body)
+    response.headers["Warning"] = '110 - "Response is Stale"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+async def admitted_stream(
+    body: AsyncIterator[bytes], snapshot_reads: bool = False
+) -> StreamingResponse:
+    """A streamed response holding a database slot until it is sent.
+
+    The slot is taken before the response starts, so an overloaded stream
+    is still answered 503, and released by the response itself, which also
+    covers clients that disconnect before the body is read.
+    """
+    if not _uses_database(snapshot_reads):
+        return StreamingResponse(body, media_type="application/json")
+    await _limiter.acquire()
+    return _AdmittedStreamingResponse(body, media_type="application/json")
+
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        started = time.perf_counter()
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _limiter.release(time.perf_counter() - started)
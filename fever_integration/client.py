@@ -1,91 +1,560 @@
+import asyncio
 import logging
+import multiprocessing
+import os
+import random
+import re
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import List
+from functools import lru_cache
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    cast,
+)
 from xml.etree import ElementTree as ET
 
 import httpx
 
+from . import metrics
 from .config import settings
-from .models import Plan
+from .models import PlanRecord, fingerprint_fields
 
 logger = logging.getLogger(__name__)
 
 
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+BASE_PLAN_START = re.compile(r"<base_plan[\s/>]")
+
+
+class ProviderStats:
+    """Counters describing how the provider fetches are going"""
+
+    def __init__(self) -> None:
+        self.fetches = 0
+        self.failures = 0
+        self.retries = 0
+        self.last_fetch_seconds: Optional[float] = None
+        self.last_fetch_retries = 0
+
+
 class FeverClient:
 
-    async def fetch_events(self) -> List[Plan]:
-        """Fetches and parses plans from the external provider"""
-        async with httpx.AsyncClient(timeout=30.0) as client:
+    def __init__(
+        self, http_client: Optional[httpx.AsyncClient] = None, url: Optional[str] = None
+    ) -> None:
+        self._http_client = http_client
+        self.url = url or settings.PROVIDER_URL
+        # Set by share(): the HTTP client and executor belong to another client
+        self._shared = False
+        # Validators of the last feed we fully parsed, for conditional requests
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        # Set when the provider answered 304 Not Modified to the last fetch
+        self.not_modified = False
+        # Why the last fetch failed, None if it did not
+        self.last_error: Optional[Exception] = None
+        self.stats = ProviderStats()
+        self._parse_executor: Optional[Executor] = None
+
+    async def start(self) -> None:
+        """Opens the pooled HTTP client shared by every fetch"""
+        if self._http_client is None:
+            self._http_client = self._create_http_client()
+
+    def share(self, owner: "FeverClient") -> None:
+        """Uses the HTTP connection pool and parse executor of owner, which
+        stays responsible for closing them"""
+        self._http_client = owner.http_client
+        self._parse_executor = owner.parse_executor
+        self._shared = True
+
+    async def aclose(self) -> None:
+        if self._shared:
+            self._http_client = self._parse_executor = None
+            self._shared = False
+            return
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown(wait=False, cancel_futures=True)
+            self._parse_executor = None
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = self._create_http_client()
+        return self._http_client
+
+    def _create_http_client(self) -> httpx.AsyncClient:
+        http2 = settings.PROVIDER_HTTP2
+        if http2:
             try:
-                response = await client.get(
-                    settings.PROVIDER_URL, headers={"Accept": "application/xml"}
-                )
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 needs the h2 package, falling back to HTTP/1.1")
+                http2 = False
+        return httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(
+                settings.PROVIDER_READ_TIMEOUT,
+                connect=settings.PROVIDER_CONNECT_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.PROVIDER_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.PROVIDER_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        ceiling = min(
+            settings.PROVIDER_BACKOFF_MAX, settings.PROVIDER_BACKOFF * 2**attempt
+        )
+        return random.uniform(0, ceiling)
+
+    async def _retry(self, attempt: int, reason: str) -> None:
+        delay = self._backoff(attempt)
+        self.stats.retries += 1
+        self.stats.last_fetch_retries += 1
+        logger.warning(f"Provider fetch failed ({reason}), retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def _send(self, stream: bool = False) -> httpx.Response:
+        """GETs the provider feed, retrying transport errors and transient statuses"""
+        retries = settings.PROVIDER_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                if stream:
+                    request = self.http_client.build_request(
+                        "GET", self.url, headers=self._request_headers()
+                    )
+                    response = await self.http_client.send(request, stream=True)
+                else:
+                    response = await self.http_client.get(
+                        self.url, headers=self._request_headers()
+                    )
+            except httpx.TransportError as e:
+                if attempt == retries:
+                    raise
+                await self._retry(attempt, type(e).__name__)
+                continue
+            if response.status_code in RETRY_STATUS_CODES and attempt < retries:
+                await response.aclose()
+                await self._retry(attempt, f"status {response.status_code}")
+                continue
+            return response
+        raise AssertionError("unreachable")
+
+    def _start_fetch(self) -> float:
+        self.not_modified = False
+        self.last_error = None
+        self.stats.fetches += 1
+        self.stats.last_fetch_retries = 0
+        return time.perf_counter()
+
+    def _end_fetch(self, started: float, failed: bool = False) -> None:
+        self.stats.last_fetch_seconds = time.perf_counter() - started
+        if failed:
+            self.stats.failures += 1
+        metrics.observe_fetch(self.stats.last_fetch_seconds, failed)
+        logger.info(
+            f"Provider fetch took {self.stats.last_fetch_seconds:.2f}s "
+            f"with {self.stats.last_fetch_retries} retries"
+        )
+
+    def _request_headers(self) -> Dict[str, str]:
+        headers = {"Accept": "application/xml"}
+        if settings.PROVIDER_CONDITIONAL_REQUESTS:
+            if self._etag:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified:
+                headers["If-Modified-Since"] = self._last_modified
+        return headers
+
+    def _check_not_modified(self, response: httpx.Response) -> bool:
+        self.not_modified = response.status_code == 304
+        if self.not_modified:
+            logger.info("Provider data not modified since last fetch")
+        return self.not_modified
+
+    def remember_validators(self, response: httpx.Response) -> None:
+        """Sends this response's validators with the next request"""
+        self._etag = response.headers.get("ETag")
+        self._last_modified = response.headers.get("Last-Modified")
+
+    async def download(self) -> Optional[httpx.Response]:
+        """GETs the whole feed. None when not modified or on failure (see
+        last_error); pass the response to remember_validators once parsed"""
+        started = self._start_fetch()
+        try:
+            response = await self._send()
+            if self._check_not_modified(response):
+                self._end_fetch(started)
+                return None
+            response.raise_for_status()
+            metrics.observe_download(len(response.content))
+            self._end_fetch(started)
+            return response
+
+        except httpx.HTTPStatusError as e:
+            self.last_error = e
+            self._end_fetch(started, failed=True)
+            logger.error(f"Provider API error: {e.response.status_code}")
+            return None
+        except Exception as e:
+            self.last_error = e
+            self._end_fetch(started, failed=True)
+            logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+            return None
+
+    def parse_failed(self, error: Exception) -> None:
+        """Records a failure to parse a downloaded feed"""
+        self.last_error = error
+        self.stats.failures += 1
+        if isinstance(error, ET.ParseError):
+            logger.error(f"XML parsing failed: {error}")
+        else:
+            logger.error(f"Unexpected error: {str(error)}", exc_info=True)
+
+    async def fetch_events(self) -> List[PlanRecord]:
+        """Fetches and parses plans from the external provider. A malformed
+        feed counts as a failed fetch and its validators are not kept, so
+        the next fetch downloads it again"""
+        response = await self.download()
+        if response is None:
+            return []
+        try:
+            plans = await self.parse_plans(response.text)
+        except Exception as e:
+            self.parse_failed(e)
+            return []
+        self.remember_validators(response)
+        return plans
+
+    async def stream_events(
+        self, batch_size: Optional[int] = None
+    ) -> AsyncGenerator[List[PlanRecord], None]:
+        """Streams plans from the external provider, yielding batches of
+        STREAM_BATCH_SIZE plans (by default) as base plans close"""
+        batch_size = batch_size or settings.STREAM_BATCH_SIZE
+        started = self._start_fetch()
+        failed = True
+        try:
+            response = await self._send(stream=True)
+            try:
+                if self._check_not_modified(response):
+                    failed = False
+                    return
                 response.raise_for_status()
-                return self._parse_plans(response.text)
+                parser: "ET.XMLPullParser[ET.Element]" = ET.XMLPullParser(
+                    events=("start", "end")
+                )
+                stack: List[ET.Element] = []
+                batch: List[PlanRecord] = []
+                async for chunk in response.aiter_bytes():
+                    metrics.observe_download(len(chunk))
+                    if settings.PARSE_EXECUTOR == "none":
+                        batch.extend(self._feed_chunk(parser, stack, chunk))
+                    else:
+                        # The pull parser keeps state, so this stays serial
+                        batch.extend(
+                            await asyncio.to_thread(
+                                self._feed_chunk, parser, stack, chunk
+                            )
+                        )
+                    while len(batch) >= batch_size:
+                        yield batch[:batch_size]
+                        batch = batch[batch_size:]
+                parser.close()
+                batch.extend(self._read_base_plans(parser, stack))
+                if batch:
+                    yield batch
+                self.remember_validators(response)
+                failed = False
+            finally:
+                await response.aclose()
 
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Provider API error: {e.response.status_code}")
-                return []
-            except Exception as e:
-                logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-                return []
+        except ET.ParseError as e:
+            self.last_error = e
+            logger.error(f"XML parsing failed: {e}")
+        except httpx.HTTPStatusError as e:
+            self.last_error = e
+            logger.error(f"Provider API error: {e.response.status_code}")
+        except Exception as e:
+            self.last_error = e
+            logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        finally:
+            self._end_fetch(started, failed=failed)
 
-    def _parse_plans(self, xml_data: str) -> List[Plan]:
-        """Converts XML to SQLAlchemy Plan objects"""
+    def _feed_chunk(
+        self,
+        parser: "ET.XMLPullParser[ET.Element]",
+        stack: List[ET.Element],
+        chunk: bytes,
+    ) -> List[PlanRecord]:
+        parse_started = time.thread_time()
+        parser.feed(chunk)
+        plans = self._read_base_plans(parser, stack)
+        metrics.observe_parse(time.thread_time() - parse_started)
+        return plans
+
+    def _read_base_plans(
+        self, parser: "ET.XMLPullParser[ET.Element]", stack: List[ET.Element]
+    ) -> List[PlanRecord]:
+        """Parses every base_plan closed so far and drops it from the partial tree"""
         plans = []
+        for event, elem in _element_events(parser):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag == "base_plan":
+                plans.extend(self._parse_base_plan(elem))
+                # Detach the finished subtree so memory stays flat on large feeds
+                if stack:
+                    stack[-1].remove(elem)
+        return plans
+
+    @property
+    def parse_executor(self) -> Executor:
+        if self._parse_executor is None:
+            if settings.PARSE_EXECUTOR == "process":
+                # spawn: forking a process running an event loop is unsafe
+                self._parse_executor = ProcessPoolExecutor(
+                    settings.PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._parse_executor = ThreadPoolExecutor(
+                    settings.PARSE_WORKERS or 1, thread_name_prefix="parse"
+                )
+        return self._parse_executor
+
+    async def parse_plans(self, xml_data: str) -> List[PlanRecord]:
+        """Parses the feed off the event loop, as configured by PARSE_EXECUTOR.
+        Raises ParseError if the feed is malformed"""
+        if settings.PARSE_EXECUTOR == "none":
+            return self._parse_feed(xml_data)
+        loop = asyncio.get_running_loop()
+        if settings.PARSE_EXECUTOR != "process":
+            return await loop.run_in_executor(
+                self.parse_executor, self._parse_feed, xml_data
+            )
+
+        chunks = _split_feed(xml_data, settings.PARSE_CHUNK_SIZE) or [xml_data]
         try:
-            root = ET.fromstring(xml_data)
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(self.parse_executor, _parse_chunk, chunk)
+                    for chunk in chunks
+                )
+            )
+        except ET.ParseError:
+            if len(chunks) == 1:
+                raise
+            # Splitting went wrong (e.g. base_plan text in a comment)
+            results = [
+                await loop.run_in_executor(self.parse_executor, _parse_chunk, xml_data)
+            ]
+        metrics.observe_parse(sum(cpu_seconds for cpu_seconds, _ in results))
+        return [plan for _, plans in results for plan in plans]
+
+    async def parse_batches(self, xml_data: str) -> AsyncIterator[List[PlanRecord]]:
+        """Parses the feed PARSE_CHUNK_SIZE base plans at a time, yielding the
+        plans of each chunk in feed order as soon as it is parsed"""
+        chunks = _split_feed(xml_data, settings.PARSE_CHUNK_SIZE)
+        if chunks is None or settings.PARSE_EXECUTOR == "none":
+            yield await self.parse_plans(xml_data)
+            return
+
+        loop = asyncio.get_running_loop()
+        # Parsed chunks wait for the consumer, keep only a few of them ahead
+        ahead = settings.PARSE_WORKERS or os.cpu_count() or 1
+        pending: "Deque[asyncio.Future[Tuple[float, List[PlanRecord]]]]" = deque()
+        try:
+            for chunk in chunks:
+                pending.append(
+                    loop.run_in_executor(self.parse_executor, _parse_chunk, chunk)
+                )
+                if len(pending) > ahead:
+                    cpu_seconds, plans = await pending.popleft()
+                    metrics.observe_parse(cpu_seconds)
+                    yield plans
+            while pending:
+                cpu_seconds, plans = await pending.popleft()
+                metrics.observe_parse(cpu_seconds)
+                yield plans
+        except ET.ParseError:
+            # Splitting went wrong (e.g. base_plan text in a comment) or the
+            # feed is malformed: the whole feed decides, plans already
+            # yielded are upserted again without changes
+            yield await self.parse_plans(xml_data)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _parse_plans(self, xml_data: str) -> List[PlanRecord]:
+        """Converts XML to plan records, none if the XML is malformed"""
+        try:
+            return self._parse_feed(xml_data)
         except ET.ParseError as e:
             logger.error(f"XML parsing failed: {e}")
             return []
 
+    def _parse_feed(self, xml_data: str) -> List[PlanRecord]:
+        """Converts XML to plan records, ParseError if the XML is malformed"""
+        parse_started = time.thread_time()
+        plans = self._parse_document(xml_data)
+        metrics.observe_parse(time.thread_time() - parse_started)
+        return plans
+
+    def _parse_document(self, xml_data: str) -> List[PlanRecord]:
+        plans = []
+        root = ET.fromstring(xml_data)
         for base_plan in root.findall(".//base_plan"):
-            # Only consider base_plans with sell_mode 'online'
-            if base_plan.get("sell_mode") != "online":
-                continue
+            plans.extend(self._parse_base_plan(base_plan))
+        return plans
 
-            base_plan_id = base_plan.get("base_plan_id")
-            base_plan_title = base_plan.get("title")
-            if base_plan_id is None or base_plan_title is None:
-                logger.warning("Skipping base_plan with missing id or title")
+    def _parse_base_plan(self, base_plan: ET.Element) -> List[PlanRecord]:
+        """Converts a single base_plan element to plan records"""
+        plans: List[PlanRecord] = []
+        # Only consider base_plans with sell_mode 'online'
+        if base_plan.get("sell_mode") != "online":
+            return plans
+
+        base_plan_id = base_plan.get("base_plan_id")
+        base_plan_title = base_plan.get("title")
+        if base_plan_id is None or base_plan_title is None:
+            logger.warning("Skipping base_plan with missing id or title")
+            return plans
+
+        # Shared by every plan of the base plan, like its id and title strings
+        last_seen = datetime.now()
+        for plan in base_plan.findall(".//plan"):
+            plan_start_date = plan.get("plan_start_date")
+            plan_end_date = plan.get("plan_end_date")
+            if plan_start_date is None or plan_end_date is None:
+                logger.warning("Skipping plan with missing start or end date")
                 continue
 
-            for plan in base_plan.findall(".//plan"):
-                plan_start_date = plan.get("plan_start_date")
-                plan_end_date = plan.get("plan_end_date")
-                if plan_start_date is None or plan_end_date is None:
-                    logger.warning("Skipping plan with missing start or end date")
-                    continue
-
-                # Gather prices from zones
-                prices = []
-                for zone in plan.findall("zone"):
-                    price_str = zone.get("price")
-                    if price_str:
-                        try:
-                            prices.append(float(price_str))
-                        except ValueError:
-                            logger.warning(f"Invalid price value: {price_str}")
-
-                if not prices:
-                    min_price = 0.0
-                    max_price = 0.0
-                else:
-                    min_price = min(prices)
-                    max_price = max(prices)
-
-                try:
-                    plan_obj = Plan(
-                        id=f"{base_plan_id}-{plan.get('plan_id')}",  # unique composite id
-                        base_plan_id=base_plan_id,
-                        title=base_plan_title,
-                        start_datetime=datetime.fromisoformat(plan_start_date),
-                        end_datetime=datetime.fromisoformat(plan_end_date),
-                        last_seen=datetime.now(),
-                        min_price=min_price,
-                        max_price=max_price,
+            # Gather prices from zones
+            prices = []
+            for zone in plan.findall("zone"):
+                price_str = zone.get("price")
+                if price_str:
+                    try:
+                        prices.append(float(price_str))
+                    except ValueError:
+                        logger.warning(f"Invalid price value: {price_str}")
+
+            if not prices:
+                min_price = 0.0
+                max_price = 0.0
+            else:
+                min_price = min(prices)
+                max_price = max(prices)
+
+            try:
+                plan_id = f"{base_plan_id}-{plan.get('plan_id')}"  # unique composite id
+                start_datetime, start_iso = _parse_datetime(plan_start_date)
+                end_datetime, end_iso = _parse_datetime(plan_end_date)
+                fingerprint = fingerprint_fields(
+                    plan_id,
+                    base_plan_id,
+                    base_plan_title,
+                    start_iso,
+                    end_iso,
+                    min_price,
+                    max_price,
+                )
+                plans.append(
+                    PlanRecord(
+                        plan_id,
+                        base_plan_id,
+                        base_plan_title,
+                        start_datetime,
+                        end_datetime,
+                        last_seen,
+                        min_price,
+                        max_price,
+                        fingerprint,
                     )
-                    plans.append(plan_obj)
-                except Exception as e:
-                    logger.error(f"Plan parse error: {e}", exc_info=True)
+                )
+            except Exception as e:
+                logger.error(f"Plan parse error: {e}", exc_info=True)
         return plans
+
+
+def _element_events(
+    parser: "ET.XMLPullParser[ET.Element]",
+) -> Iterator[Tuple[str, ET.Element]]:
+    """read_events of a parser listening to start and end events only, which
+    all come with their element"""
+    return cast(Iterator[Tuple[str, ET.Element]], parser.read_events())
+
+
+def _split_feed(xml_data: str, chunk_size: int) -> Optional[List[str]]:
+    """Splits a feed into well-formed documents of chunk_size base plans each.
+
+    Every byte of the feed lands in exactly one chunk, wrapped in the
+    elements enclosing the base plans, so chunk parsing still rejects a
+    malformed feed. Returns None when the feed is too small to split or
+    its layout is not understood.
+    """
+    starts = [match.start() for match in BASE_PLAN_START.finditer(xml_data)]
+    if len(starts) <= chunk_size:
+        return None
+
+    # Elements open at the first base plan, e.g. planList and output
+    parser: "ET.XMLPullParser[ET.Element]" = ET.XMLPullParser(events=("start", "end"))
+    try:
+        parser.feed(xml_data[: starts[0]])
+        tags: List[str] = []
+        for event, elem in _element_events(parser):
+            if event == "start":
+                tags.append(elem.tag)
+            else:
+                tags.pop()
+    except ET.ParseError:
+        return None
+    if any(tag.startswith("{") for tag in tags):
+        return None  # namespaced tags cannot be reopened by name
+    opening = "".join(f"<{tag}>" for tag in tags)
+    closing = "".join(f"</{tag}>" for tag in reversed(tags))
+
+    bounds = [0] + starts[chunk_size::chunk_size] + [len(xml_data)]
+    chunks = []
+    for i in range(len(bounds) - 1):
+        chunk = xml_data[bounds[i] : bounds[i + 1]]
+        if i > 0:
+            chunk = opening + chunk
+        if i < len(bounds) - 2:
+            chunk += closing
+        chunks.append(chunk)
+    return chunks
+
+
+def _parse_chunk(xml_data: str) -> Tuple[float, List[PlanRecord]]:
+    """Runs in a parse worker process, plan records pickle as plain tuples"""
+    parse_started = time.thread_time()
+    plans = FeverClient()._parse_document(xml_data)
+    return time.thread_time() - parse_started, plans
+
+
+@lru_cache(maxsize=16384)
+def _parse_datetime(value: str) -> Tuple[datetime, str]:
+    """Feeds repeat the same date strings a lot, parse each one once"""
+    parsed = datetime.fromisoformat(value)
+    return parsed, parsed.isoformat()
@@ -0,0 +1,106 @@
+"""Shares /events query results between concurrent and recent identical requests"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .admission import admitted
+from .config import settings
+from .models import EventRow
+from .queries import Cursor, data_generation, load_events
+from .session import ReadSessionLocal
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers share its result"""
+
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, "asyncio.Future[Any]"] = {}
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(call())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+        # A cancelled caller must not cancel the query the others wait for
+        return await asyncio.shield(flight)
+
+
+class ResultCache:
+    """Small TTL cache, emptied whenever new data is committed"""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.epoch = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float, epoch: int) -> None:
+        # Results read before the last clear() may predate the new data
+        if epoch != self.epoch:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.epoch += 1
+        self._entries.clear()
+
+
+_flights = SingleFlight()
+_cache = ResultCache(settings.EVENTS_CACHE_MAX_ENTRIES)
+
+
+def clear_events_cache() -> None:
+    _cache.clear()
+
+
+async def _load_events(
+    starts_at: datetime,
+    ends_at: datetime,
+    after: Optional[Cursor],
+    limit: Optional[int],
+) -> Tuple[Optional[int], List[EventRow]]:
+    # Not the request's session: the query may outlive the request that started it
+    async with admitted(snapshot_reads=True), ReadSessionLocal() as db:
+        generation = await data_generation(db)
+        return generation, await load_events(db, starts_at, ends_at, after, limit)
+
+
+async def shared_load_events(
+    starts_at: datetime,
+    ends_at: datetime,
+    after: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+) -> Tuple[Optional[int], List[EventRow]]:
+    """data_generation and load_events, coalesced with identical in-flight
+    queries and cached for EVENTS_CACHE_TTL seconds"""
+    key = (starts_at, ends_at, after, limit)
+    ttl = settings.EVENTS_CACHE_TTL
+    if ttl > 0:
+        cached: Optional[Tuple[Optional[int], List[EventRow]]] = _cache.get(key)
+        if cached is not None:
+            return cached
+
+    epoch = _cache.epoch
+    # Queries started before new data was committed are not joined
+    loaded: Tuple[Optional[int], List[EventRow]] = await _flights.run(
+        (epoch, key), lambda: _load_events(starts_at, ends_at, after, limit)
+    )
+    if ttl > 0:
+        _cache.set(key, loaded, ttl, epoch)
+    return loaded
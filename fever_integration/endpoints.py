@@ -1,17 +1,106 @@
+import json
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select, func
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .models import Plan
-from .session import get_db
+from .admission import (
+    Overloaded,
+    admitted,
+    admitted_stream,
+    rate_limit,
+    remember_body,
+    stale_response,
+)
+from .coalescing import shared_load_events
+from .config import settings
+from .generation import current_generation
+from .http_cache import cached_response, encoded_response, events_etag
+from .models import EventRow
+from .queries import (
+    ChangeToken,
+    Cursor,
+    data_generation,
+    decode_change_token,
+    decode_cursor,
+    encode_change_token,
+    encode_cursor,
+    iter_events,
+    load_changes,
+    load_events,
+    load_events_batch,
+)
+from .serialization import (
+    event_fragment,
+    render_batch,
+    render_changes,
+    render_events,
+)
+from .session import ReadSessionLocal, get_db
+
+router = APIRouter(dependencies=[Depends(rate_limit)])
+
+
+def _event_item(plan: EventRow) -> Dict[str, Any]:
+    return {
+        "id": plan.base_plan_id,
+        "title": plan.title,
+        "start_date": plan.start_datetime.date().isoformat(),
+        "start_time": plan.start_datetime.time().isoformat(),
+        "end_date": plan.end_datetime.date().isoformat(),
+        "end_time": plan.end_datetime.time().isoformat(),
+        "min_price": plan.min_price,
+        "max_price": plan.max_price,
+    }
+
+
+def parse_range(starts_at: str, ends_at: str) -> Tuple[datetime, datetime]:
+    """Parses the ISO8601 bounds of an /events range, 400 if invalid"""
+    try:
+        starts_at_dt = datetime.fromisoformat(starts_at.replace("Z", "+00:00"))
+        ends_at_dt = datetime.fromisoformat(ends_at.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid datetime format. Use ISO8601 with 'Z' timezone.",
+        )
+    return starts_at_dt.replace(tzinfo=None), ends_at_dt.replace(tzinfo=None)
+
+
+async def _stream_events(
+    starts_at: datetime,
+    ends_at: datetime,
+    after: Optional[Cursor],
+    limit: Optional[int],
+) -> AsyncIterator[bytes]:
+    # The request session is closed before a streamed body is sent, use our own
+    async with ReadSessionLocal() as db:
+        yield b'{"data":{"events":['
+        count = 0
+        last: Optional[EventRow] = None
+        has_more = False
+        fetch = None if limit is None else limit + 1
+        async for plan in iter_events(db, starts_at, ends_at, after, fetch):
+            if count == limit:
+                has_more = True
+                break
+            yield (b"," if count else b"") + event_fragment(plan)
+            count += 1
+            last = plan
+
+    yield b"]"
+    if limit is not None:
+        next_cursor = encode_cursor(last) if has_more and last else None
+        yield b',"next_cursor":' + json.dumps(next_cursor).encode()
+    yield b'},"error":null}'
 
-router = APIRouter()
 
 @router.get("/events")
 async def get_events(
+    request: Request,
     starts_at: str = Query(
         ...,
         description="Filter events starting at or after this datetime (ISO8601, e.g. 2021-07-21T17:32:28Z)",
@@ -22,52 +111,163 @@ async def get_events(
         description="Filter events ending at or before this datetime (ISO8601, e.g. 2021-07-21T17:32:28Z)",
         example="2021-07-21T17:32:28Z",
     ),
+    limit: Optional[int] = Query(
+        None,
+        ge=1,
+        le=settings.EVENTS_MAX_PAGE_SIZE,
+        description="Maximum number of events to return, enables pagination",
+    ),
+    after: Optional[str] = Query(
+        None,
+        description="Opaque cursor from the next_cursor of the previous page",
+    ),
+    stream: bool = Query(
+        False,
+        description="Stream events as they are read instead of buffering them",
+    ),
     db: AsyncSession = Depends(get_db),
-) -> Dict[str, Any]:
+) -> Any:
+    starts_at_dt, ends_at_dt = parse_range(starts_at, ends_at)
+
     try:
-        starts_at_dt = datetime.fromisoformat(starts_at.replace("Z", "+00:00"))
-        ends_at_dt = datetime.fromisoformat(ends_at.replace("Z", "+00:00"))
+        cursor = decode_cursor(after) if after is not None else None
     except ValueError:
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid datetime format. Use ISO8601 with 'Z' timezone.",
-        )
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
 
-    starts_at_dt = starts_at_dt.replace(tzinfo=None)
-    ends_at_dt = ends_at_dt.replace(tzinfo=None)
-
-    stmt = (
-        select(
-            Plan.base_plan_id,
-            Plan.title,
-            func.min(Plan.start_datetime).label("start_datetime"),
-            func.max(Plan.end_datetime).label("end_datetime"),
-            func.min(Plan.min_price).label("min_price"),
-            func.max(Plan.max_price).label("max_price"),
-        )
-        .where(
-            Plan.start_datetime >= starts_at_dt,
-            Plan.end_datetime <= ends_at_dt,
+    if stream:
+        return await admitted_stream(
+            _stream_events(starts_at_dt, ends_at_dt, cursor, limit),
+            snapshot_reads=True,
         )
-        .group_by(Plan.base_plan_id, Plan.title)
+
+    query = (starts_at_dt, ends_at_dt, limit, after)
+
+    async def render() -> Tuple[bytes, str]:
+        fetch = None if limit is None else limit + 1
+        if settings.EVENTS_COALESCE:
+            generation, aggregated_plans = await shared_load_events(
+                starts_at_dt, ends_at_dt, cursor, fetch
+            )
+        else:
+            async with admitted(snapshot_reads=True):
+                generation = await data_generation(db)
+                aggregated_plans = await load_events(
+                    db, starts_at_dt, ends_at_dt, cursor, fetch
+                )
+
+        page = aggregated_plans[:limit]
+        next_cursor = None
+        if limit is not None and len(aggregated_plans) > limit:
+            next_cursor = encode_cursor(page[-1])
+
+        if settings.EVENTS_FAST_JSON:
+            body = render_events(page, limit is not None, next_cursor)
+        else:
+            data: Dict[str, Any] = {"events": [_event_item(plan) for plan in page]}
+            if limit is not None:
+                data["next_cursor"] = next_cursor
+            body = bytes(JSONResponse({"data": data, "error": None}).body)
+        remember_body(query, body)
+        # Labelled with what the (possibly lagging) read session saw
+        if generation is None:
+            generation = current_generation()
+        return body, events_etag(generation, query)
+
+    # The body only changes when a sync commits a new generation
+    etag = events_etag(current_generation(), query)
+    try:
+        return await cached_response(request, etag, render)
+    except Overloaded:
+        # Stale data beats no data for a client that would retry anyway
+        response = await stale_response(request, query)
+        if response is None:
+            raise
+        return response
+
+
+class EventRange(BaseModel):
+    starts_at: str = Field(..., examples=["2021-07-21T17:32:28Z"])
+    ends_at: str = Field(..., examples=["2021-07-28T17:32:28Z"])
+
+
+class EventsBatchRequest(BaseModel):
+    ranges: List[EventRange] = Field(
+        ..., min_length=1, max_length=settings.EVENTS_BATCH_MAX_RANGES
     )
 
-    result = await db.execute(stmt)
-    aggregated_plans = result.all()
-
-    response_events = []
-    for plan in aggregated_plans:
-        response_events.append(
-            {
-                "id": plan.base_plan_id,
-                "title": plan.title,
-                "start_date": plan.start_datetime.date().isoformat(),
-                "start_time": plan.start_datetime.time().isoformat(),
-                "end_date": plan.end_datetime.date().isoformat(),
-                "end_time": plan.end_datetime.time().isoformat(),
-                "min_price": plan.min_price,
-                "max_price": plan.max_price,
-            }
+
+@router.post("/events/batch")
+async def get_events_batch(
+    request: Request,
+    batch: EventsBatchRequest,
+    db: AsyncSession = Depends(get_db),
+) -> Any:
+    """The events of several ranges (e.g. the cells of a calendar view) in
+    one request and one database query, a result per range in request order"""
+    bounds = [parse_range(item.starts_at, item.ends_at) for item in batch.ranges]
+    async with admitted(snapshot_reads=True):
+        results = await load_events_batch(db, bounds)
+
+    if settings.EVENTS_FAST_JSON:
+        body = render_batch(
+            (
+                (item.starts_at, item.ends_at, events)
+                for item, events in zip(batch.ranges, results)
+            )
+        )
+    else:
+        data = {
+            "results": [
+                {
+                    "starts_at": item.starts_at,
+                    "ends_at": item.ends_at,
+                    "events": [_event_item(event) for event in events],
+                }
+                for item, events in zip(batch.ranges, results)
+            ]
+        }
+        body = bytes(JSONResponse({"data": data, "error": None}).body)
+    return await encoded_response(request, body)
+
+
+@router.get("/events/changes")
+async def get_event_changes(
+    since: Optional[str] = Query(
+        None,
+        description="next_token of the previous call; omit to read every event once",
+    ),
+    limit: int = Query(
+        settings.EVENTS_MAX_PAGE_SIZE,
+        ge=1,
+        le=settings.EVENTS_MAX_PAGE_SIZE,
+        description="Maximum number of changed events to return",
+    ),
+    db: AsyncSession = Depends(get_db),
+) -> Any:
+    """Events inserted or updated by syncs since the given token"""
+    try:
+        token = decode_change_token(since) if since is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid change token.")
+
+    async with admitted():
+        changes = await load_changes(db, token, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if changes:
+        token = changes[-1][0]
+    next_token = encode_change_token(token or ChangeToken(0, "", ""))
+    events = [event for _, event in changes]
+
+    if settings.EVENTS_FAST_JSON:
+        return Response(
+            content=render_changes(events, next_token, has_more),
+            media_type="application/json",
         )
 
-    return {"data": {"events": response_events}, "error": None}
\ No newline at end of file
+    data = {
+        "events": [_event_item(event) for event in events],
+        "next_token": next_token,
+        "has_more": has_more,
+    }
+    return {"data": data, "error": None}
@@ -0,0 +1,67 @@
+import logging
+from datetime import datetime
+from typing import Any, cast
+
+from sqlalchemy import CursorResult, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .coalescing import clear_events_cache
+from .config import settings
+from .http_cache import clear_compressed_bodies
+from .models import SyncState
+from .queries import read_generation
+from .session import AsyncSessionLocal
+from .snapshot import current_snapshot, refresh_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Generation of the data this process' caches were built from
+_current = 0
+
+
+def current_generation() -> int:
+    return _current
+
+
+async def bump_generation(db: AsyncSession) -> int:
+    """Increments the data generation inside the caller's transaction"""
+    now = datetime.now()
+    # An UPDATE gives a CursorResult, which has the matched row count
+    result = cast(
+        CursorResult[Any],
+        await db.execute(
+            update(SyncState)
+            .where(SyncState.id == 1)
+            .values(generation=SyncState.generation + 1, updated_at=now)
+        ),
+    )
+    if result.rowcount == 0:
+        db.add(SyncState(id=1, generation=1, updated_at=now))
+        await db.flush()
+    return await read_generation(db)
+
+
+async def apply_generation(generation: int) -> None:
+    """Refreshes the in-process caches after new data was committed"""
+    global _current
+    if generation == _current and not (
+        settings.EVENTS_SNAPSHOT and current_snapshot() is None
+    ):
+        return
+    if settings.EVENTS_SNAPSHOT:
+        try:
+            await refresh_snapshot()
+        except Exception as e:
+            # Keep serving the previous snapshot, retried on the next poll
+            logger.error(f"Snapshot refresh failed: {str(e)}", exc_info=True)
+            return
+    clear_events_cache()
+    clear_compressed_bodies()
+    _current = generation
+
+
+async def check_generation() -> None:
+    """Picks up data committed by another process"""
+    async with AsyncSessionLocal() as db:
+        generation = await read_generation(db)
+    await apply_generation(generation)
@@ -0,0 +1,195 @@
+"""ETags, conditional requests and compression for /events responses"""
+
+import asyncio
+import gzip
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from .config import settings
+
+try:
+    import brotli
+except ImportError:  # optional, installed with the brotli extra
+    brotli = None
+
+# Bodies larger than this are compressed in a thread, off the event loop
+COMPRESS_IN_THREAD_ABOVE = 256 * 1024
+
+
+def events_etag(generation: int, params: Tuple[Any, ...]) -> str:
+    """Strong ETag of a response: same data generation and query, same body"""
+    digest = hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()
+    return f'"{generation}-{digest}"'
+
+
+def _encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    # Each encoding is a different representation, with its own ETag
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> Optional[str]:
+    """Weak comparison of If-None-Match with the ETag of any encoding.
+
+    Returns the matching ETag, to send back with the 304.
+    """
+    if not if_none_match:
+        return None
+    candidates = {_encoded_etag(etag, encoding) for encoding in ("gzip", "br")}
+    candidates.add(etag)
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value == "*":
+            return etag
+        if value.startswith("W/"):
+            value = value[2:]
+        if value in candidates:
+            return value
+    return None
+
+
+def available_encodings() -> Tuple[str, ...]:
+    return tuple(
+        encoding
+        for encoding in settings.EVENTS_COMPRESSION
+        if encoding == "gzip" or (encoding == "br" and brotli is not None)
+    )
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Our most preferred encoding the client accepts, if any"""
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return bytes(brotli.compress(body, quality=settings.EVENTS_BROTLI_QUALITY))
+    return gzip.compress(body, compresslevel=settings.EVENTS_GZIP_LEVEL, mtime=0)
+
+
+class BodyCache:
+    """LRU of compressed bodies by ETag, bounded by their total size"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._bodies: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        body = self._bodies.get(key)
+        if body is not None:
+            self._bodies.move_to_end(key)
+        return body
+
+    def set(self, key: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        replaced = self._bodies.pop(key, None)
+        if replaced is not None:
+            self.size -= len(replaced)
+        self._bodies[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self) -> None:
+        self._bodies.clear()
+        self.size = 0
+
+
+_compressed_bodies = BodyCache(settings.EVENTS_COMPRESSED_CACHE_BYTES)
+
+
+def clear_compressed_bodies() -> None:
+    _compressed_bodies.clear()
+
+
+def _cache_headers(etag: str, encoding: Optional[str]) -> Dict[str, str]:
+    headers = {}
+    if settings.EVENTS_HTTP_CACHE:
+        max_age = settings.EVENTS_MAX_AGE
+        if max_age is None:
+            max_age = settings.REFRESH_TIMEOUT
+        headers["ETag"] = _encoded_etag(etag, encoding)
+        headers["Cache-Control"] = f"public, max-age={max_age}"
+    if settings.EVENTS_COMPRESSION:
+        headers["Vary"] = "Accept-Encoding"
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+async def encoded_response(request: Request, body: bytes) -> Response:
+    """A JSON response compressed if the client accepts it, for bodies with
+    no ETag (e.g. answers to POST requests)"""
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    headers = {"Vary": "Accept-Encoding"} if settings.EVENTS_COMPRESSION else {}
+    if encoding is not None and len(body) >= settings.EVENTS_COMPRESSION_MIN_SIZE:
+        if len(body) > COMPRESS_IN_THREAD_ABOVE:
+            body = await asyncio.to_thread(compress, body, encoding)
+        else:
+            body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def cached_response(
+    request: Request, etag: str, render: Callable[[], Awaitable[Tuple[bytes, str]]]
+) -> Response:
+    """Answers 304 or a cached compressed body when possible, otherwise
+    renders the body and compresses it if the client accepts it.
+
+    ``render`` returns the body with the ETag of the data it was read from,
+    which may differ from ``etag`` when it was read from a replica.
+    """
+    if settings.EVENTS_HTTP_CACHE:
+        matched = etag_matches(request.headers.get("If-None-Match"), etag)
+        if matched is not None:
+            headers = _cache_headers(etag, None)
+            headers["ETag"] = matched
+            return Response(status_code=304, headers=headers)
+
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is not None and settings.EVENTS_COMPRESSED_CACHE:
+        body = _compressed_bodies.get(_encoded_etag(etag, encoding))
+        if body is not None:
+            return Response(
+                body,
+                media_type="application/json",
+                headers=_cache_headers(etag, encoding),
+            )
+
+    body, etag = await render()
+    if encoding is None or len(body) < settings.EVENTS_COMPRESSION_MIN_SIZE:
+        return Response(
+            body, media_type="application/json", headers=_cache_headers(etag, None)
+        )
+
+    if len(body) > COMPRESS_IN_THREAD_ABOVE:
+        body = await asyncio.to_thread(compress, body, encoding)
+    else:
+        body = compress(body, encoding)
+    if settings.EVENTS_COMPRESSED_CACHE:
+        _compressed_bodies.set(_encoded_etag(etag, encoding), body)
+    return Response(
+        body, media_type="application/json", headers=_cache_headers(etag, encoding)
+    )
@@ -0,0 +1,80 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from .config import settings
+from .session import engine
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """Elects the single process allowed to run syncs.
+
+    On PostgreSQL this is a session-level advisory lock held on a dedicated
+    connection: if the leader dies its connection closes, the lock is
+    released and the next process calling acquire() takes over. Other
+    databases have no shared lock, so every process leads.
+    """
+
+    def __init__(self, engine: AsyncEngine, key: int) -> None:
+        self._engine = engine
+        self._key = key
+        self._conn: Optional[AsyncConnection] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._conn is not None
+
+    async def acquire(self) -> bool:
+        """Returns whether this process holds the lock, trying to take it if not"""
+        if self._engine.dialect.name != "postgresql":
+            return True
+
+        if self._conn is not None:
+            try:
+                await self._conn.execute(text("SELECT 1"))
+                return True
+            except Exception as e:
+                logger.warning(f"Lost the sync leader connection: {e}")
+                await self._discard()
+
+        conn = await self._engine.connect()
+        try:
+            # Autocommit, so the connection does not sit idle in a transaction
+            await conn.execution_options(isolation_level="AUTOCOMMIT")
+            acquired = await conn.scalar(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": self._key}
+            )
+        except Exception:
+            await conn.close()
+            raise
+        if not acquired:
+            await conn.close()
+            return False
+        self._conn = conn
+        logger.info("This process is now the sync leader.")
+        return True
+
+    async def release(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            await self._conn.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": self._key}
+            )
+        finally:
+            await self._discard()
+
+    async def _discard(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                await conn.close()
+            except Exception:
+                await conn.invalidate()
+
+
+leader = LeaderLock(engine, settings.LEADER_LOCK_KEY)
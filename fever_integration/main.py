@@ -1,36 +1,62 @@
 import asyncio
+import logging
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
 
-import uvicorn
 from fastapi import FastAPI
 
 from .config import settings
 from .endpoints import router
-from .models import Base
+from .generation import check_generation
+from .leader import leader
+from .ops import MetricsMiddleware
+from .ops import router as ops_router
+from .partitions import create_tables
+from .scheduler import SyncScheduler
 from .session import engine
-from .sync import background_sync, sync_events
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from .sync import sources as provider_sources
+from .sync import watch_generation
 
-
-async def create_tables(engine: AsyncEngine) -> None:
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
-    # create tables asynchronously
-    await create_tables(engine)
+    tasks = []
+    if settings.INGESTION_ENABLED:
+        # open the pooled provider HTTP client shared by every sync and feed
+        await provider_sources.start()
+
+        # create tables asynchronously
+        await create_tables(engine)
+        await check_generation()
 
-    # run initial sync (ensure sync_events is async and awaited)
-    await sync_events()
+        # serve existing data right away: the initial sync, only in the process
+        # elected as sync leader, runs in the background like the later ones
+        app.state.sync_scheduler = SyncScheduler(settings.REFRESH_TIMEOUT)
+        tasks.append(asyncio.create_task(app.state.sync_scheduler.run(run_first=True)))
+    else:
+        # read-only: the worker owns the schema and the data, which may not
+        # be there yet, so the generation watcher picks it up later
+        try:
+            await check_generation()
+        except Exception as e:
+            logger.warning(f"No data to serve yet: {str(e)}")
 
-    # launch background sync task
-    asyncio.create_task(background_sync(settings.REFRESH_TIMEOUT))
+    # cache refreshes for syncs committed by other processes
+    tasks.append(
+        asyncio.create_task(watch_generation(settings.GENERATION_POLL_INTERVAL))
+    )
 
     yield
 
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if settings.INGESTION_ENABLED:
+        await leader.release()
+        await provider_sources.aclose()
+
 
 app = FastAPI(
     title="Fever Events API",
@@ -42,8 +68,11 @@ app = FastAPI(
 )
 
 app.include_router(router)
+app.include_router(ops_router)
+app.add_middleware(MetricsMiddleware)
 
 if __name__ == "__main__":
+    import uvicorn
 
     uvicorn.run(
         "fever_integration.main:app",
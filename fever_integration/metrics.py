@@ -0,0 +1,196 @@
+"""Prometheus metrics for the API, the sync job, the provider and the database.
+
+Every part can be switched off from Settings; a disabled part costs one
+attribute lookup on its hot path. The HTTP side (/metrics and the request
+middleware) lives in ops.py so that importing this module stays cheap.
+"""
+
+import time
+from typing import TYPE_CHECKING, Any
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+
+from .config import settings
+
+if TYPE_CHECKING:  # the asyncio extension is slow to import
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Buckets tuned for sub-millisecond statements up to multi-second requests
+FAST_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SLOW_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to serve a request, including the response body",
+    ["method", "route", "status"],
+    buckets=FAST_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests currently being served",
+    ["method", "route"],
+)
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests answered 503 or 429 by admission control",
+    ["reason"],
+)
+ADMISSION_STALE = Counter(
+    "admission_stale_responses_total",
+    "Rejected requests answered with a stale body instead",
+)
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds",
+    "Time queued requests waited for a database slot",
+    buckets=FAST_BUCKETS,
+)
+
+SYNC_DURATION = Histogram(
+    "sync_duration_seconds",
+    "Duration of sync_events runs",
+    ["status"],
+    buckets=SLOW_BUCKETS,
+)
+SYNC_PLANS_PARSED = Counter("sync_plans_parsed_total", "Plans parsed by syncs")
+SYNC_PLANS_WRITTEN = Counter(
+    "sync_plans_written_total", "Plans inserted or updated by syncs"
+)
+SYNC_PLANS_UNCHANGED = Counter(
+    "sync_plans_unchanged_total", "Plans skipped by syncs because they did not change"
+)
+SYNC_LAST_SUCCESS = Gauge(
+    "sync_last_success_timestamp_seconds",
+    "Unix time of the last sync that did not fail",
+)
+SYNC_NEXT_RUN_DELAY = Gauge(
+    "sync_next_run_delay_seconds", "Delay the scheduler chose before the next sync"
+)
+SYNC_CONSECUTIVE_FAILURES = Gauge(
+    "sync_consecutive_failures", "Syncs that failed in a row, 0 after a good one"
+)
+
+PROVIDER_FETCH_DURATION = Histogram(
+    "provider_fetch_duration_seconds",
+    "Duration of provider fetches, retries included",
+    ["outcome"],
+    buckets=SLOW_BUCKETS,
+)
+PROVIDER_RESPONSE_BYTES = Counter(
+    "provider_response_bytes_total", "Bytes downloaded from the provider"
+)
+PROVIDER_PARSE_CPU = Counter(
+    "provider_parse_cpu_seconds_total", "CPU time spent parsing provider XML"
+)
+
+DB_STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds",
+    "Duration of database statements",
+    ["engine", "operation"],
+    buckets=FAST_BUCKETS,
+)
+DB_OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def observe_rejection(reason: str) -> None:
+    if settings.METRICS_HTTP:
+        ADMISSION_REJECTED.labels(reason).inc()
+
+
+def observe_stale() -> None:
+    if settings.METRICS_HTTP:
+        ADMISSION_STALE.inc()
+
+
+def observe_admission_wait(seconds: float) -> None:
+    if settings.METRICS_HTTP:
+        ADMISSION_WAIT.observe(seconds)
+
+
+def observe_sync(
+    status: str, seconds: float, parsed: int, written: int, unchanged: int
+) -> None:
+    if not settings.METRICS_SYNC:
+        return
+    SYNC_DURATION.labels(status).observe(seconds)
+    SYNC_PLANS_PARSED.inc(parsed)
+    SYNC_PLANS_WRITTEN.inc(written)
+    SYNC_PLANS_UNCHANGED.inc(unchanged)
+    if status != "failed":
+        SYNC_LAST_SUCCESS.set_to_current_time()
+
+
+def observe_schedule(delay: float, failures: int) -> None:
+    if settings.METRICS_SYNC:
+        SYNC_NEXT_RUN_DELAY.set(delay)
+        SYNC_CONSECUTIVE_FAILURES.set(failures)
+
+
+def observe_fetch(seconds: float, failed: bool) -> None:
+    if settings.METRICS_PROVIDER:
+        PROVIDER_FETCH_DURATION.labels("failed" if failed else "ok").observe(seconds)
+
+
+def observe_download(size: int) -> None:
+    if settings.METRICS_PROVIDER:
+        PROVIDER_RESPONSE_BYTES.inc(size)
+
+
+def observe_parse(cpu_seconds: float) -> None:
+    if settings.METRICS_PROVIDER:
+        PROVIDER_PARSE_CPU.inc(cpu_seconds)
+
+
+def _operation(statement: str) -> str:
+    words = statement.split(None, 1)
+    operation = words[0].upper() if words else ""
+    return operation if operation in DB_OPERATIONS else "OTHER"
+
+
+def instrument_engine(engine: "AsyncEngine", name: str) -> None:
+    """Times every statement run on the engine through cursor execute events"""
+    if not settings.METRICS_DB:
+        return
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ) -> None:
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ) -> None:
+        started = getattr(context, "_metrics_started", None)
+        if started is not None:
+            DB_STATEMENT_DURATION.labels(name, _operation(statement)).observe(
+                time.perf_counter() - started
+            )
@@ -1,19 +1,161 @@
-from sqlalchemy import Column, DateTime, Float, String
-from sqlalchemy.orm import DeclarativeBase
+import hashlib
+from datetime import datetime
+from typing import ClassVar, NamedTuple, Optional, Union
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    String,
+    Table,
+)
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+from .config import settings
 
 
 class Base(DeclarativeBase):
-    pass
+    # Every model is mapped to a Table, not just any FROM clause
+    __table__: ClassVar[Table]
 
 
 class Plan(Base):
     __tablename__ = "plans"
+    # Range partitioned by month of start_datetime on PostgreSQL if enabled
+    __table_args__ = (
+        # Covers the /events aggregation: range filter, group keys and
+        # prices are all read from the index, never from the table
+        Index(
+            "ix_plans_events_covering",
+            "start_datetime",
+            "end_datetime",
+            "base_plan_id",
+            "title",
+            "min_price",
+            "max_price",
+        ),
+        (
+            {"postgresql_partition_by": "RANGE (start_datetime)"}
+            if settings.PLANS_PARTITIONED
+            else {}
+        ),
+    )
+
+    # unique plan id (composite string)
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    base_plan_id: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    title: Mapped[str] = mapped_column(String, nullable=False)
+    # The partition key has to be part of the primary key
+    start_datetime: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, index=True, primary_key=settings.PLANS_PARTITIONED
+    )
+    end_datetime: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+    last_seen: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    min_price: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    max_price: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    # Hash of the provider fields, used to skip rewriting unchanged plans
+    fingerprint: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+
+
+class EventSummary(Base):
+    """Per-event aggregates of the plans table, maintained by the sync job.
+
+    Start and end datetimes are kept as both min and max so that a range
+    query can tell events fully inside the range (answered from this row)
+    from events only partially inside it (re-aggregated from their plans).
+    """
+
+    __tablename__ = "event_summaries"
+
+    # Keyed like the /events GROUP BY so results match the plans table
+    base_plan_id = Column(String, primary_key=True)
+    title = Column(String, primary_key=True)
+    min_start_datetime = Column(DateTime, nullable=False)
+    max_start_datetime = Column(DateTime, nullable=False)
+    min_end_datetime = Column(DateTime, nullable=False)
+    max_end_datetime = Column(DateTime, nullable=False)
+    min_price = Column(Float, nullable=False)
+    max_price = Column(Float, nullable=False)
+    # Data generation of the sync that last wrote this row, for the change feed
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_event_summaries_contained", "min_start_datetime", "max_end_datetime"),
+        Index("ix_event_summaries_overlap", "max_start_datetime", "min_end_datetime"),
+        Index("ix_event_summaries_version", "version", "base_plan_id", "title"),
+    )
+
+
+class SyncState(Base):
+    """Single-row table with a counter bumped by every sync that wrote data"""
+
+    __tablename__ = "sync_state"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class EventRow(NamedTuple):
+    """Aggregates of one event as returned by /events"""
+
+    base_plan_id: str
+    title: str
+    start_datetime: datetime
+    end_datetime: datetime
+    min_price: float
+    max_price: float
+
+
+class PlanRecord(NamedTuple):
+    """A parsed provider plan: what ingestion needs, without ORM state tracking"""
+
+    id: str
+    base_plan_id: str
+    title: str
+    start_datetime: datetime
+    end_datetime: datetime
+    last_seen: datetime
+    min_price: float
+    max_price: float
+    fingerprint: Optional[str] = None
+
+
+def plan_fingerprint(plan: Union[Plan, PlanRecord]) -> str:
+    """Content hash of the provider fields of a plan (last_seen excluded)"""
+    return fingerprint_fields(
+        plan.id,
+        plan.base_plan_id,
+        plan.title,
+        plan.start_datetime.isoformat(),
+        plan.end_datetime.isoformat(),
+        plan.min_price,
+        plan.max_price,
+    )
+
 
-    id = Column(String, primary_key=True)  # unique plan id (composite string)
-    base_plan_id = Column(String, index=True, nullable=False)
-    title = Column(String, nullable=False)
-    start_datetime = Column(DateTime, nullable=False, index=True)
-    end_datetime = Column(DateTime, nullable=False, index=True)
-    last_seen = Column(DateTime, nullable=False)
-    min_price = Column(Float, nullable=False, default=0.0)
-    max_price = Column(Float, nullable=False, default=0.0)
+def fingerprint_fields(
+    id: str,
+    base_plan_id: str,
+    title: str,
+    start_iso: str,
+    end_iso: str,
+    min_price: float,
+    max_price: float,
+) -> str:
+    """plan_fingerprint from raw fields, for callers with the ISO dates at hand"""
+    content = "\x1f".join(
+        (
+            str(id),
+            str(base_plan_id),
+            str(title),
+            start_iso,
+            end_iso,
+            repr(float(min_price)),
+            repr(float(max_price)),
+        )
+    )
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
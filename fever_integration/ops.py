@@ -0,0 +1,189 @@
+"""Operational endpoints: Prometheus metrics, liveness/readiness probes and
+the manual sync trigger"""
+
+import asyncio
+import math
+import secrets
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import select
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import sync
+from .config import settings
+from .metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_PROGRESS
+from .models import Plan, SyncState
+from .session import ReadSessionLocal
+from .snapshot import current_snapshot
+
+router = APIRouter()
+
+
+async def metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+if settings.METRICS_ENABLED:
+    router.add_api_route("/metrics", metrics, include_in_schema=False)
+
+
+@router.get("/healthz", include_in_schema=False)
+async def healthz() -> Dict[str, str]:
+    """Liveness: the process is up and its event loop is serving requests"""
+    return {"status": "ok"}
+
+
+async def _database_state() -> Dict[str, Any]:
+    async with ReadSessionLocal() as db:
+        has_plans = await db.scalar(select(Plan.id).limit(1)) is not None
+        updated_at = await db.scalar(
+            select(SyncState.updated_at).where(SyncState.id == 1)
+        )
+    return {"has_plans": has_plans, "updated_at": updated_at}
+
+
+def _last_sync_age(updated_at: Optional[datetime]) -> Optional[float]:
+    """Seconds since this process' last good sync, or the last committed one"""
+    if sync.last_sync_success is not None:
+        return time.time() - sync.last_sync_success
+    if updated_at is not None:
+        return (datetime.now() - updated_at).total_seconds()
+    return None
+
+
+@router.get("/readyz", include_in_schema=False)
+async def readyz() -> JSONResponse:
+    """Readiness: the database answers and there is data to serve, or a
+    recent sync found the provider empty"""
+    try:
+        state = await asyncio.wait_for(_database_state(), settings.READY_DB_TIMEOUT)
+        database = True
+    except Exception:
+        state = {"has_plans": False, "updated_at": None}
+        database = False
+
+    data_loaded = state["has_plans"]
+    if settings.EVENTS_SNAPSHOT:
+        data_loaded = data_loaded and current_snapshot() is not None
+    max_age = settings.READY_MAX_SYNC_AGE
+    if max_age is None:
+        max_age = 2 * settings.REFRESH_TIMEOUT
+    age = _last_sync_age(state["updated_at"])
+    ready = database and (data_loaded or (age is not None and age <= max_age))
+
+    return JSONResponse(
+        {
+            "status": "ready" if ready else "not_ready",
+            "checks": {
+                "database": database,
+                "data_loaded": data_loaded,
+                "last_sync_age": age,
+            },
+        },
+        status_code=200 if ready else 503,
+    )
+
+
+def _scheduler_response(request: Request, status: str) -> JSONResponse:
+    scheduler = getattr(request.app.state, "sync_scheduler", None)
+    if scheduler is None:
+        return JSONResponse({"status": "not_started"}, status_code=503)
+    return JSONResponse(
+        {"status": status, "scheduler": scheduler.status()}, status_code=200
+    )
+
+
+@router.get("/sync", include_in_schema=False)
+async def sync_status(request: Request) -> JSONResponse:
+    """Where the sync scheduler stands: interval, failures, next run"""
+    return _scheduler_response(request, "ok")
+
+
+def _operator(request: Request) -> bool:
+    token = settings.SYNC_TRIGGER_TOKEN
+    if not token:
+        return False
+    scheme, _, value = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and secrets.compare_digest(
+        value.strip().encode(), token.encode()
+    )
+
+
+async def trigger_sync(request: Request) -> JSONResponse:
+    """Starts a sync now, unless one is already running or the last
+    triggered one started less than SYNC_TRIGGER_MIN_INTERVAL seconds ago"""
+    if not _operator(request):
+        return JSONResponse(
+            {"status": "unauthorized"},
+            status_code=401,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    scheduler = getattr(request.app.state, "sync_scheduler", None)
+    if scheduler is None:
+        return _scheduler_response(request, "not_started")
+    if scheduler.triggered_at is not None:
+        wait = scheduler.triggered_at + settings.SYNC_TRIGGER_MIN_INTERVAL
+        wait -= time.monotonic()
+        if wait > 0:
+            response = _scheduler_response(request, "too_soon")
+            response.status_code = 429
+            response.headers["Retry-After"] = str(math.ceil(wait))
+            return response
+    response = _scheduler_response(
+        request, "scheduled" if scheduler.trigger() else "running"
+    )
+    response.status_code = 202
+    return response
+
+
+if settings.SYNC_TRIGGER_ENABLED:
+    router.add_api_route(
+        "/sync", trigger_sync, methods=["POST"], include_in_schema=False
+    )
+
+
+class MetricsMiddleware:
+    """Times every HTTP request by route template, streamed bodies included"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    def _route(self, scope: Scope) -> str:
+        # Label by template, not raw path, to keep the label set bounded
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return str(route.path)
+        return "unmatched"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.METRICS_HTTP:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        status = "500"
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.labels(method, route, status).observe(
+                time.perf_counter() - started
+            )
+            in_progress.dec()
@@ -0,0 +1,295 @@
+"""Monthly range partitioning of the plans table on PostgreSQL.
+
+With PLANS_PARTITIONED enabled, ``plans`` is partitioned by start_datetime
+so the /events range filter only scans the months it covers. The sync job
+creates the monthly partitions it needs ahead of time, and with
+PLANS_ARCHIVE_AFTER_MONTHS set it detaches partitions older than that and
+attaches them to ``plans_archive``, which reads query alongside ``plans``.
+"""
+
+import logging
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Set, Tuple, Union
+
+from sqlalchemy import (
+    Connection,
+    FromClause,
+    MetaData,
+    Table,
+    inspect,
+    make_url,
+    select,
+    text,
+    union_all,
+)
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateColumn
+
+from .config import settings
+from .models import Base, Plan
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "plans"
+ARCHIVE_TABLE = "plans_archive"
+DEFAULT_PARTITION = "plans_default"
+
+# Kept out of Base.metadata: the archive only exists once partitions move there
+archive_table = Table(
+    ARCHIVE_TABLE,
+    MetaData(),
+    *(column._copy() for column in Plan.__table__.columns),
+)
+
+
+def month_start(value: Union[date, datetime]) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_bounds(month: date) -> Tuple[str, str]:
+    return month.isoformat(), add_months(month, 1).isoformat()
+
+
+def partition_window(today: date) -> List[date]:
+    """Months that should always exist: last month up to the look-ahead"""
+    first = add_months(month_start(today), -1)
+    return [
+        add_months(first, i) for i in range(settings.PLANS_PARTITION_MONTHS_AHEAD + 2)
+    ]
+
+
+def is_enabled() -> bool:
+    """Partitioning is a PostgreSQL feature, other databases keep a plain table"""
+    return (
+        settings.PLANS_PARTITIONED
+        and make_url(settings.DB_URL).get_backend_name() == "postgresql"
+    )
+
+
+def archive_enabled() -> bool:
+    return is_enabled() and settings.PLANS_ARCHIVE_AFTER_MONTHS is not None
+
+
+def archive_cutoff(today: Optional[date] = None) -> Optional[datetime]:
+    """Plans starting before this are in archived months, None without archive"""
+    months = settings.PLANS_ARCHIVE_AFTER_MONTHS
+    if not archive_enabled() or months is None:
+        return None
+    month = add_months(month_start(today or date.today()), -months)
+    return datetime(month.year, month.month, 1)
+
+
+async def _create_archive_table(conn: AsyncConnection) -> None:
+    await conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} "
+            f"(LIKE {PARENT_TABLE} INCLUDING ALL) PARTITION BY RANGE (start_datetime)"
+        )
+    )
+
+
+def plans_source() -> FromClause:
+    """The plans to read from: the plans table, plus the archive if enabled"""
+    if not archive_enabled():
+        return Plan.__table__
+    plans = Plan.__table__
+    return union_all(select(*plans.columns), select(*archive_table.columns)).subquery(
+        "all_plans"
+    )
+
+
+async def _existing_partitions(conn: AsyncConnection, parent: str) -> Set[str]:
+    result = await conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = :parent"
+        ),
+        {"parent": parent},
+    )
+    return set(result.scalars())
+
+
+async def _create_partition(conn: AsyncConnection, month: date) -> None:
+    """Creates a month partition, moving any of its rows out of the default one"""
+    name = partition_name(month)
+    lower, upper = partition_bounds(month)
+    in_month = f"start_datetime >= '{lower}' AND start_datetime < '{upper}'"
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING ALL)"))
+    await conn.execute(
+        text(f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_month}")
+    )
+    await conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_month}"))
+    await conn.execute(
+        text(
+            f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        )
+    )
+    logger.info(f"Created partition {name}.")
+
+
+async def _return_to_archive(conn: AsyncConnection, month: date) -> None:
+    """Moves rows of an archived month out of the default partition into its
+    archived one, where they replace older copies of the same plans"""
+    name = partition_name(month)
+    lower, upper = partition_bounds(month)
+    in_month = f"start_datetime >= '{lower}' AND start_datetime < '{upper}'"
+    await conn.execute(
+        text(
+            f"DELETE FROM {name} WHERE id IN "
+            f"(SELECT id FROM {DEFAULT_PARTITION} WHERE {in_month})"
+        )
+    )
+    await conn.execute(
+        text(f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_month}")
+    )
+    await conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_month}"))
+    logger.info(f"Moved plans of archived {name} out of {DEFAULT_PARTITION}.")
+
+
+async def ensure_partitions(
+    engine: AsyncEngine, months: Iterable[Union[date, datetime]] = ()
+) -> None:
+    """Creates the missing monthly partitions for the window and given months.
+
+    Runs in its own short transactions: attaching a partition locks the
+    parent table, so this must not happen inside the sync transaction.
+    """
+    if not is_enabled():
+        return
+    async with engine.begin() as conn:
+        if archive_enabled():
+            # plans_source() reads the archive, so it has to exist from the start
+            await _create_archive_table(conn)
+        await conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} "
+                f"PARTITION OF {PARENT_TABLE} DEFAULT"
+            )
+        )
+        existing = await _existing_partitions(conn, PARENT_TABLE)
+        # Rows that landed in the default partition get a proper one
+        result = await conn.execute(
+            text(
+                f"SELECT DISTINCT date_trunc('month', start_datetime) "
+                f"FROM {DEFAULT_PARTITION}"
+            )
+        )
+        stray = [month_start(value) for value in result.scalars()]
+        archived: Set[str] = set()
+        if archive_enabled():
+            archived = await _existing_partitions(conn, ARCHIVE_TABLE)
+
+    for month in stray:
+        if partition_name(month) in archived:
+            # Written before syncs skipped archived months, the month's
+            # partition cannot be created in plans again
+            async with engine.begin() as conn:
+                await _return_to_archive(conn, month)
+
+    wanted = set(partition_window(date.today()))
+    wanted.update(month_start(month) for month in months)
+    wanted.update(stray)
+    for month in sorted(wanted):
+        if partition_name(month) in existing | archived:
+            continue
+        try:
+            async with engine.begin() as conn:
+                await _create_partition(conn, month)
+        except Exception as e:
+            # Rows for this month keep going to the default partition
+            logger.error(f"Creating partition {partition_name(month)} failed: {e}")
+
+
+async def archive_partitions(engine: AsyncEngine) -> None:
+    """Moves partitions older than PLANS_ARCHIVE_AFTER_MONTHS to the archive.
+
+    Detaching and attaching are catalog-only operations, the rows are not
+    copied and stay queryable through plans_source().
+    """
+    cutoff = archive_cutoff()
+    if cutoff is None:
+        return
+    async with engine.begin() as conn:
+        await _create_archive_table(conn)
+        existing = await _existing_partitions(conn, PARENT_TABLE)
+
+    for name in sorted(existing):
+        if name == DEFAULT_PARTITION:
+            continue
+        year, month = name.rsplit("_p", 1)[1].split("_")
+        partition_month = date(int(year), int(month), 1)
+        if add_months(partition_month, 1) > cutoff.date():
+            continue
+        lower, upper = partition_bounds(partition_month)
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}")
+            )
+            await conn.execute(
+                text(
+                    f"ALTER TABLE {ARCHIVE_TABLE} ATTACH PARTITION {name} "
+                    f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+                )
+            )
+        logger.info(f"Archived partition {name}.")
+
+
+def _add_missing_columns(conn: Connection) -> None:
+    """Adds the model columns that tables created by an older version lack.
+
+    create_all skips existing tables, so e.g. plans.fingerprint has to be
+    added here. Such columns are nullable or have a server default.
+    """
+    inspector = inspect(conn)
+    tables = list(Base.metadata.sorted_tables)
+    if archive_enabled():
+        tables.append(archive_table)
+    preparer = conn.dialect.identifier_preparer
+    for table in tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            spec = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(
+                text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {spec}")
+            )
+            logger.info(f"Added column {table.name}.{column.name}.")
+
+
+def _add_missing_indexes(conn: Connection) -> None:
+    """Creates the model indexes that tables created by an older version lack,
+    e.g. the one the change feed reads event_summaries.version through"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+                logger.info(f"Created index {index.name}.")
+
+
+async def create_tables(engine: AsyncEngine) -> None:
+    """Creates missing tables, columns and indexes, and the plans partitions
+    when enabled"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_add_missing_indexes)
+    await ensure_partitions(engine)
@@ -0,0 +1,265 @@
+"""Fetches every configured provider feed concurrently, each isolated from the others"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, List, Optional, Sequence, Tuple
+
+import httpx
+
+from .client import FeverClient
+from .config import settings
+from .models import PlanRecord
+
+logger = logging.getLogger(__name__)
+
+
+def configured_urls() -> List[str]:
+    return list(settings.PROVIDER_URLS) or [settings.PROVIDER_URL]
+
+
+@dataclass
+class SourceResult:
+    url: str
+    plans: int = 0
+    not_modified: bool = False
+    error: Optional[BaseException] = None
+    seconds: float = 0.0
+
+
+# A batch of plans with the result of the feed it was parsed from
+SourceBatch = Tuple[SourceResult, List[PlanRecord]]
+
+
+@dataclass
+class _Fetch:
+    client: FeverClient
+    result: SourceResult
+    failures: int = field(init=False)
+    started: float = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.failures = self.client.stats.failures
+        self.started = time.perf_counter()
+
+    def finish(self, plans: int, error: Optional[BaseException] = None) -> None:
+        result = self.result
+        result.seconds = time.perf_counter() - self.started
+        result.plans = plans
+        if error is None and self.client.stats.failures != self.failures:
+            error = self.client.last_error or RuntimeError("Provider fetch failed")
+        result.error = error
+        result.not_modified = error is None and self.client.not_modified
+        if error is not None:
+            logger.error(f"Provider {result.url} failed: {error!r}")
+        else:
+            logger.info(
+                f"Provider {result.url}: {plans} plans in {result.seconds:.2f}s"
+            )
+
+
+class ProviderSources:
+    """One FeverClient per provider URL, sharing one HTTP pool and parse executor.
+
+    At most PROVIDER_CONCURRENCY feeds are fetched at a time, each parsed as
+    soon as it is downloaded while the others download. A feed that fails or
+    exceeds PROVIDER_SOURCE_TIMEOUT is left out of the run without holding
+    back the others; ``results`` describes each feed of the last run.
+    """
+
+    def __init__(
+        self, urls: Sequence[str], http_client: Optional[httpx.AsyncClient] = None
+    ) -> None:
+        if not urls:
+            raise ValueError("At least one provider URL is required")
+        self.clients = [FeverClient(http_client, urls[0])]
+        self.clients += [FeverClient(url=url) for url in urls[1:]]
+        self.results: List[SourceResult] = []
+
+    async def start(self) -> None:
+        await self.clients[0].start()
+        self._share()
+
+    def _share(self) -> None:
+        for client in self.clients[1:]:
+            if not client._shared:
+                client.share(self.clients[0])
+
+    async def aclose(self) -> None:
+        # Borrowers first, the owner closes the shared pool and executor
+        for client in reversed(self.clients):
+            await client.aclose()
+
+    @property
+    def failed(self) -> List[SourceResult]:
+        return [result for result in self.results if result.error is not None]
+
+    @property
+    def not_modified(self) -> bool:
+        """No feed of the last run had anything new (failed ones aside)"""
+        succeeded = [result for result in self.results if result.error is None]
+        return bool(succeeded) and all(result.not_modified for result in succeeded)
+
+    def _begin(self) -> List[_Fetch]:
+        self._share()
+        self.results = [SourceResult(client.url) for client in self.clients]
+        return [
+            _Fetch(client, result) for client, result in zip(self.clients, self.results)
+        ]
+
+    async def fetch_events(self) -> List[PlanRecord]:
+        """Plans of every feed that did not fail, merged"""
+        semaphore = asyncio.Semaphore(settings.PROVIDER_CONCURRENCY)
+
+        async def fetch(job: _Fetch) -> List[PlanRecord]:
+            async with semaphore:
+                job.started = time.perf_counter()
+                try:
+                    plans = await asyncio.wait_for(
+                        job.client.fetch_events(), settings.PROVIDER_SOURCE_TIMEOUT
+                    )
+                except asyncio.TimeoutError as e:
+                    job.finish(0, e)
+                    return []
+            job.finish(len(plans))
+            return plans if job.result.error is None else []
+
+        batches = await asyncio.gather(*(fetch(job) for job in self._begin()))
+        return [plan for plans in batches for plan in plans]
+
+    async def stream_events(self) -> AsyncGenerator[SourceBatch, None]:
+        """Batches of every feed as they are parsed, feeds streamed concurrently.
+
+        The batches of a feed are handed out back to back, and its result is
+        final before the next feed's first batch, so the caller can roll a
+        feed that fails halfway back as a whole. Feeds whose batches wait
+        for another feed to be handed out still count that toward their
+        PROVIDER_SOURCE_TIMEOUT.
+        """
+        semaphore = asyncio.Semaphore(settings.PROVIDER_CONCURRENCY)
+        handing_out = asyncio.Lock()
+        # Bounded, so feeds wait for the writer instead of piling up in memory
+        queue: "asyncio.Queue[Optional[SourceBatch]]" = asyncio.Queue(
+            settings.PROVIDER_CONCURRENCY
+        )
+
+        async def stream(job: _Fetch) -> None:
+            plans = 0
+            holding = False
+
+            async def produce() -> None:
+                nonlocal plans, holding
+                batches = job.client.stream_events()
+                try:
+                    async for batch in batches:
+                        if not holding:
+                            await handing_out.acquire()
+                            holding = True
+                        plans += len(batch)
+                        await queue.put((job.result, batch))
+                finally:
+                    # Closes the response right away when the feed times out
+                    await batches.aclose()
+
+            async with semaphore:
+                job.started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(produce(), settings.PROVIDER_SOURCE_TIMEOUT)
+                except Exception as e:
+                    job.finish(plans, e)
+                else:
+                    job.finish(plans)
+                finally:
+                    # Only once the feed's result is final
+                    if holding:
+                        handing_out.release()
+            # Not when cancelled: then nobody reads the queue anymore
+            await queue.put(None)
+
+        jobs = self._begin()
+        tasks = [asyncio.ensure_future(stream(job)) for job in jobs]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                batch = await queue.get()
+                if batch is None:
+                    remaining -= 1
+                else:
+                    yield batch
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def pipeline_events(self) -> AsyncGenerator[SourceBatch, None]:
+        """Batches of every feed, through download -> parse -> write stages.
+
+        Whole feeds are downloaded concurrently, parsed chunk by chunk one
+        feed at a time, and each chunk's plans handed to the caller, which
+        writes them while the next chunk is parsed. Both hand-offs are
+        bounded queues, so a slow writer holds back parsing and a slow
+        parser holds back downloads instead of buffering whole feeds. As
+        with stream_events, a feed's batches come back to back.
+        """
+        semaphore = asyncio.Semaphore(settings.PROVIDER_CONCURRENCY)
+        documents: "asyncio.Queue[Optional[Tuple[_Fetch, httpx.Response]]]" = (
+            asyncio.Queue(settings.PROVIDER_CONCURRENCY)
+        )
+        batches: "asyncio.Queue[Optional[SourceBatch]]" = asyncio.Queue(
+            settings.INGESTION_QUEUE_SIZE
+        )
+
+        async def download(job: _Fetch) -> None:
+            async with semaphore:
+                job.started = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(
+                        job.client.download(), settings.PROVIDER_SOURCE_TIMEOUT
+                    )
+                except Exception as e:
+                    job.finish(0, e)
+                    return
+                if response is None:
+                    job.finish(0)
+                else:
+                    # Still holding the slot: downloads wait for the parser
+                    await documents.put((job, response))
+
+        async def download_all(jobs: List[_Fetch]) -> None:
+            await asyncio.gather(*(download(job) for job in jobs))
+            await documents.put(None)
+
+        async def parse() -> None:
+            while True:
+                item = await documents.get()
+                if item is None:
+                    break
+                job, response = item
+                plans = 0
+                try:
+                    async for batch in job.client.parse_batches(response.text):
+                        plans += len(batch)
+                        await batches.put((job.result, batch))
+                except Exception as e:
+                    job.client.parse_failed(e)
+                    job.finish(plans, e)
+                else:
+                    job.client.remember_validators(response)
+                    job.finish(plans)
+            await batches.put(None)
+
+        tasks = [
+            asyncio.ensure_future(download_all(self._begin())),
+            asyncio.ensure_future(parse()),
+        ]
+        try:
+            while True:
+                batch = await batches.get()
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,331 @@
+import base64
+import json
+from datetime import datetime
+from typing import (
+    AsyncIterator,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from sqlalchemy import (
+    CompoundSelect,
+    Select,
+    and_,
+    func,
+    literal,
+    not_,
+    select,
+    tuple_,
+    union_all,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .models import EventRow, EventSummary, SyncState
+from .partitions import plans_source
+from .snapshot import current_snapshot
+
+
+class Cursor(NamedTuple):
+    """Position after the last event of a page, in (start, id, title) order"""
+
+    start_datetime: datetime
+    base_plan_id: str
+    title: str
+
+
+def encode_cursor(event: EventRow) -> str:
+    payload = json.dumps(
+        [event.start_datetime.isoformat(), event.base_plan_id, event.title]
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(value: str) -> Cursor:
+    """Parses an opaque cursor, raising ValueError if it is malformed"""
+    try:
+        start, base_plan_id, title = json.loads(base64.urlsafe_b64decode(value))
+        return Cursor(datetime.fromisoformat(start), str(base_plan_id), str(title))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {value}") from e
+
+
+class ChangeToken(NamedTuple):
+    """Position in the change feed, in (version, id, title) order"""
+
+    version: int
+    base_plan_id: str
+    title: str
+
+
+def encode_change_token(token: ChangeToken) -> str:
+    payload = json.dumps(list(token))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_change_token(value: str) -> ChangeToken:
+    """Parses an opaque change feed token, raising ValueError if it is malformed"""
+    try:
+        version, base_plan_id, title = json.loads(base64.urlsafe_b64decode(value))
+        return ChangeToken(int(version), str(base_plan_id), str(title))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid change token: {value}") from e
+
+
+def _sort_key(event: EventRow) -> Cursor:
+    return Cursor(event.start_datetime, event.base_plan_id, event.title)
+
+
+def _page(
+    events: List[EventRow], after: Optional[Cursor], limit: Optional[int]
+) -> List[EventRow]:
+    events = sorted(events, key=_sort_key)
+    if after is not None:
+        events = [event for event in events if _sort_key(event) > after]
+    return events if limit is None else events[:limit]
+
+
+# Rows of plans_aggregate_stmt, in the order of the EventRow fields
+EventSelect = Select[Tuple[str, str, datetime, datetime, float, float]]
+
+
+def plans_aggregate_stmt(
+    starts_at: datetime,
+    ends_at: datetime,
+    base_plan_ids: Optional[Iterable[str]] = None,
+) -> EventSelect:
+    """Aggregates the plans inside the range per event"""
+    plans = plans_source()
+    stmt = (
+        select(
+            plans.c.base_plan_id,
+            plans.c.title,
+            func.min(plans.c.start_datetime).label("start_datetime"),
+            func.max(plans.c.end_datetime).label("end_datetime"),
+            func.min(plans.c.min_price).label("min_price"),
+            func.max(plans.c.max_price).label("max_price"),
+        )
+        .where(
+            plans.c.start_datetime >= starts_at,
+            plans.c.end_datetime <= ends_at,
+        )
+        .group_by(plans.c.base_plan_id, plans.c.title)
+    )
+    if base_plan_ids is not None:
+        stmt = stmt.where(plans.c.base_plan_id.in_(base_plan_ids))
+    return stmt
+
+
+def _ordered_plans_stmt(starts_at: datetime, ends_at: datetime) -> EventSelect:
+    stmt = plans_aggregate_stmt(starts_at, ends_at)
+    columns = stmt.selected_columns
+    return stmt.order_by(columns.start_datetime, columns.base_plan_id, columns.title)
+
+
+async def _load_from_summaries(
+    db: AsyncSession,
+    starts_at: datetime,
+    ends_at: datetime,
+    after: Optional[Cursor],
+    limit: Optional[int],
+) -> List[EventRow]:
+    """The events of the range from event_summaries, re-aggregating only the
+    plans of events partially inside it.
+
+    Pages are keyset reads on the indexed min_start_datetime, so one costs
+    about its size rather than the size of the range.
+    """
+    contained = and_(
+        EventSummary.min_start_datetime >= starts_at,
+        EventSummary.max_end_datetime <= ends_at,
+    )
+    # Every plan of these events is inside the range, the summary is the answer
+    stmt = (
+        select(
+            EventSummary.base_plan_id,
+            EventSummary.title,
+            EventSummary.min_start_datetime,
+            EventSummary.max_end_datetime,
+            EventSummary.min_price,
+            EventSummary.max_price,
+        )
+        .where(contained)
+        .order_by(
+            EventSummary.min_start_datetime,
+            EventSummary.base_plan_id,
+            EventSummary.title,
+        )
+    )
+    if after is not None:
+        stmt = stmt.where(
+            EventSummary.min_start_datetime >= after.start_datetime,
+            tuple_(
+                EventSummary.min_start_datetime,
+                EventSummary.base_plan_id,
+                EventSummary.title,
+            )
+            > tuple_(*map(literal, after)),
+        )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    result = await db.execute(stmt)
+    events = [EventRow(*row) for row in result.all()]
+
+    # These events may have only some plans inside the range, which start
+    # between their first and last plans
+    stmt = select(EventSummary.base_plan_id, EventSummary.title).where(
+        EventSummary.max_start_datetime >= starts_at,
+        EventSummary.min_end_datetime <= ends_at,
+        not_(contained),
+    )
+    if after is not None:
+        stmt = stmt.where(EventSummary.max_start_datetime >= after.start_datetime)
+    if limit is not None and len(events) == limit:
+        # Starting after the last event of a full page, they belong to a later one
+        stmt = stmt.where(EventSummary.min_start_datetime <= events[-1].start_datetime)
+    result = await db.execute(stmt)
+    partial = {(row.base_plan_id, row.title) for row in result.all()}
+    if partial:
+        result = await db.execute(
+            plans_aggregate_stmt(
+                starts_at, ends_at, {base_plan_id for base_plan_id, _ in partial}
+            )
+        )
+        events.extend(
+            EventRow(*row)
+            for row in result.all()
+            if (row.base_plan_id, row.title) in partial
+        )
+    return _page(events, after, limit)
+
+
+async def read_generation(db: AsyncSession) -> int:
+    generation = await db.scalar(select(SyncState.generation).where(SyncState.id == 1))
+    return generation or 0
+
+
+async def data_generation(db: AsyncSession) -> Optional[int]:
+    """Generation of the data load_events will read through the session, read
+    before it so a body is never labelled newer than it is. None when the
+    snapshot answers, which holds the process' current generation."""
+    if settings.EVENTS_SNAPSHOT and current_snapshot() is not None:
+        return None
+    return await read_generation(db)
+
+
+async def load_events(
+    db: AsyncSession,
+    starts_at: datetime,
+    ends_at: datetime,
+    after: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+) -> List[EventRow]:
+    """Returns the per-event aggregates of the plans inside the range.
+
+    Events are ordered by start datetime, id and title; ``after`` and
+    ``limit`` select a page of that order.
+    """
+    if settings.EVENTS_SNAPSHOT:
+        snapshot = current_snapshot()
+        if snapshot is not None:
+            return _page(snapshot.query(starts_at, ends_at), after, limit)
+    if settings.EVENTS_FROM_SUMMARY or after is not None or limit is not None:
+        # Pages are read through the summaries, which every sync maintains
+        return await _load_from_summaries(db, starts_at, ends_at, after, limit)
+    result = await db.execute(_ordered_plans_stmt(starts_at, ends_at))
+    return [EventRow(*row) for row in result.all()]
+
+
+async def iter_events(
+    db: AsyncSession,
+    starts_at: datetime,
+    ends_at: datetime,
+    after: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+) -> AsyncIterator[EventRow]:
+    """Like load_events, but streams rows from a server-side cursor when
+    reading the whole range from the plans table so it is never buffered"""
+    if (
+        settings.EVENTS_SNAPSHOT
+        or settings.EVENTS_FROM_SUMMARY
+        or after is not None
+        or limit is not None
+    ):
+        for event in await load_events(db, starts_at, ends_at, after, limit):
+            yield event
+        return
+    result = await db.stream(
+        _ordered_plans_stmt(starts_at, ends_at).execution_options(
+            yield_per=settings.EVENTS_STREAM_BATCH_SIZE
+        )
+    )
+    async for row in result:
+        yield EventRow(*row)
+
+
+def _batch_stmt(
+    ranges: Sequence[Tuple[datetime, datetime]],
+) -> CompoundSelect[Tuple[str, str, datetime, datetime, float, float, int]]:
+    # The aggregate of each range tagged with its position. Each one filters
+    # the plans on its own range, unlike a join with a table of the ranges
+    # which the planner may run as one scan of the plans per range
+    return union_all(
+        *(
+            plans_aggregate_stmt(starts_at, ends_at).add_columns(
+                literal(index).label("range_index")
+            )
+            for index, (starts_at, ends_at) in enumerate(ranges)
+        )
+    )
+
+
+async def load_events_batch(
+    db: AsyncSession, ranges: Sequence[Tuple[datetime, datetime]]
+) -> List[List[EventRow]]:
+    """load_events for several ranges at once, in a single query (or a
+    single pass per range over the snapshot), one result per range"""
+    unique = list(dict.fromkeys(ranges))
+    snapshot = current_snapshot() if settings.EVENTS_SNAPSHOT else None
+    if snapshot is not None:
+        results = [_page(snapshot.query(*bounds), None, None) for bounds in unique]
+    elif not unique:
+        results = []
+    else:
+        results = [[] for _ in unique]
+        result = await db.execute(_batch_stmt(unique))
+        for *event, index in result.all():
+            results[index].append(EventRow(*event))
+        # The order of each range does not survive UNION ALL
+        results = [_page(events, None, None) for events in results]
+    by_range = dict(zip(unique, results))
+    return [by_range[bounds] for bounds in ranges]
+
+
+async def load_changes(
+    db: AsyncSession, since: Optional[ChangeToken], limit: int
+) -> List[Tuple[ChangeToken, EventRow]]:
+    """Returns the events written after ``since``, oldest change first.
+
+    Each event comes with its position in the feed. The version index makes
+    this cost proportional to the changes read, not to the table.
+    """
+    position = (EventSummary.version, EventSummary.base_plan_id, EventSummary.title)
+    stmt = (
+        select(
+            *position,
+            EventSummary.min_start_datetime,
+            EventSummary.max_end_datetime,
+            EventSummary.min_price,
+            EventSummary.max_price,
+        )
+        .order_by(*position)
+        .limit(limit)
+    )
+    if since is not None:
+        stmt = stmt.where(tuple_(*position) > tuple_(*map(literal, since)))
+    result = await db.execute(stmt)
+    return [(ChangeToken(*row[:3]), EventRow(*row[1:])) for row in result.all()]
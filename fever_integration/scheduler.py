@@ -0,0 +1,149 @@
+"""Schedules the periodic sync: one run at a time, with deadlines, jitter and backoff"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from sqlalchemy.exc import OperationalError
+
+from . import metrics
+from .config import settings
+from .sync import SyncResult, ensure_event_summaries, sync_if_leader
+
+logger = logging.getLogger(__name__)
+
+# Failures worth retrying soon: the next attempt will likely get through
+TRANSIENT_ERRORS = (
+    httpx.TransportError,
+    asyncio.TimeoutError,
+    ConnectionError,
+    OperationalError,
+)
+
+
+def is_transient(error: Optional[BaseException]) -> bool:
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class SyncScheduler:
+    """Runs sync_if_leader every interval until cancelled.
+
+    Transient failures (timeouts, connection errors) are retried after
+    SYNC_RETRY_DELAY seconds, doubled per consecutive failure up to the
+    interval, while provider errors double the interval up to
+    SYNC_BACKOFF_MAX. With SYNC_ADAPTIVE the interval shrinks after syncs
+    that wrote data and grows after syncs that found nothing new.
+    """
+
+    def __init__(self, interval: float, **sync_options: bool) -> None:
+        self.interval = float(interval)
+        # Passed to sync_events, e.g. pipeline=True in the ingestion worker
+        self.sync_options = sync_options
+        self.failures = 0
+        self.last_result: Optional[SyncResult] = None
+        self.next_run_at: Optional[float] = None
+        # When trigger() last woke the scheduler, in time.monotonic()
+        self.triggered_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def trigger(self) -> bool:
+        """Wakes the scheduler for a sync now. False if one is already running"""
+        if self.running:
+            return False
+        self.triggered_at = time.monotonic()
+        self._wake.set()
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        result = self.last_result
+        next_run_in = None
+        if self.next_run_at is not None and not self.running:
+            next_run_in = max(0.0, self.next_run_at - time.monotonic())
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "consecutive_failures": self.failures,
+            "next_run_in": next_run_in,
+            "last_status": result.status if result is not None else None,
+        }
+
+    async def run_once(self) -> Optional[SyncResult]:
+        """One sync within the deadline, None if skipped (running or not leader)"""
+        if self.running:
+            return None
+        async with self._lock:
+            deadline = settings.SYNC_DEADLINE or settings.REFRESH_TIMEOUT
+            try:
+                result = await asyncio.wait_for(
+                    sync_if_leader(**self.sync_options), deadline
+                )
+            except asyncio.TimeoutError as e:
+                logger.error(f"Sync cancelled after its {deadline}s deadline.")
+                result = SyncResult("failed", error=e)
+            except Exception as e:
+                logger.error(f"Sync failed: {str(e)}", exc_info=True)
+                result = SyncResult("failed", error=e)
+        if result is not None:
+            self.last_result = result
+        return result
+
+    def next_delay(self, result: Optional[SyncResult]) -> float:
+        """Seconds until the next run after the given result, with jitter"""
+        if result is not None and result.status == "failed":
+            self.failures += 1
+            # Capped exponent, only the cap matters after that many failures
+            factor = 2 ** min(self.failures - 1, 16)
+            if is_transient(result.error):
+                delay = min(settings.SYNC_RETRY_DELAY * factor, self.interval)
+            else:
+                ceiling = max(settings.SYNC_BACKOFF_MAX, self.interval)
+                delay = min(self.interval * 2 * factor, ceiling)
+        else:
+            if result is not None:
+                self.failures = 0
+                if settings.SYNC_ADAPTIVE:
+                    self._adapt(result)
+            delay = self.interval
+        jitter = settings.SYNC_JITTER
+        return float(delay * random.uniform(1 - jitter, 1 + jitter))
+
+    def _adapt(self, result: SyncResult) -> None:
+        if result.written:
+            interval = self.interval / 2
+        else:
+            interval = self.interval * 1.5
+        self.interval = min(
+            max(interval, settings.SYNC_MIN_INTERVAL), settings.SYNC_MAX_INTERVAL
+        )
+
+    async def _sleep(self, delay: float) -> None:
+        self.next_run_at = time.monotonic() + delay
+        metrics.observe_schedule(delay, self.failures)
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def run(self, run_first: bool = False) -> None:
+        """Schedules syncs until cancelled, starting right away if run_first"""
+        delay = self.next_delay(None)
+        if run_first:
+            try:
+                await ensure_event_summaries()
+            except Exception as e:
+                logger.error(
+                    f"Building event summaries failed: {str(e)}", exc_info=True
+                )
+            delay = self.next_delay(await self.run_once())
+        while True:
+            await self._sleep(delay)
+            delay = self.next_delay(await self.run_once())
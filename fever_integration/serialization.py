@@ -0,0 +1,75 @@
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple
+
+from .config import settings
+from .models import EventRow
+
+# Same options as FastAPI's JSONResponse, so the output is byte-for-byte equal
+_encoder = json.JSONEncoder(
+    ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+)
+
+
+def _date_and_time(value: datetime) -> Tuple[str, str]:
+    if value.tzinfo is None:
+        date, _, time = value.isoformat().partition("T")
+        return date, time
+    return value.date().isoformat(), value.time().isoformat()
+
+
+@lru_cache(maxsize=settings.EVENTS_FRAGMENT_CACHE_SIZE)
+def event_fragment(event: EventRow) -> bytes:
+    """JSON encoding of one event, cached since most events survive a sync"""
+    start_date, start_time = _date_and_time(event.start_datetime)
+    end_date, end_time = _date_and_time(event.end_datetime)
+    return _encoder.encode(
+        {
+            "id": event.base_plan_id,
+            "title": event.title,
+            "start_date": start_date,
+            "start_time": start_time,
+            "end_date": end_date,
+            "end_time": end_time,
+            "min_price": event.min_price,
+            "max_price": event.max_price,
+        }
+    ).encode("utf-8")
+
+
+def render_events(
+    events: Iterable[EventRow],
+    paginated: bool = False,
+    next_cursor: Optional[str] = None,
+) -> bytes:
+    """Encodes the /events envelope from cached event fragments"""
+    body = b'{"data":{"events":[' + b",".join(map(event_fragment, events)) + b"]"
+    if paginated:
+        body += b',"next_cursor":' + _encoder.encode(next_cursor).encode("utf-8")
+    return body + b'},"error":null}'
+
+
+def render_changes(
+    events: Iterable[EventRow], next_token: str, has_more: bool
+) -> bytes:
+    """Encodes the /events/changes envelope from cached event fragments"""
+    body = b'{"data":{"events":[' + b",".join(map(event_fragment, events)) + b"]"
+    body += b',"next_token":' + _encoder.encode(next_token).encode("utf-8")
+    body += b',"has_more":' + (b"true" if has_more else b"false")
+    return body + b'},"error":null}'
+
+
+def render_batch(results: Iterable[Tuple[str, str, Iterable[EventRow]]]) -> bytes:
+    """Encodes the /events/batch envelope from (starts_at, ends_at, events)"""
+    items = [
+        b'{"starts_at":'
+        + _encoder.encode(starts_at).encode("utf-8")
+        + b',"ends_at":'
+        + _encoder.encode(ends_at).encode("utf-8")
+        + b',"events":['
+        + b",".join(map(event_fragment, events))
+        + b"]}"
+        for starts_at, ends_at, events in results
+    ]
+    return b'{"data":{"results":[' + b",".join(items) + b']},"error":null}'
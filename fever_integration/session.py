@@ -1,21 +1,129 @@
-from typing import AsyncGenerator
+import itertools
+from typing import Any, AsyncGenerator, Dict, Iterator, List
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 
 from .config import settings
+from .metrics import instrument_engine
+
+
+def _sqlite_pragmas() -> List[str]:
+    pragmas = [
+        f"PRAGMA busy_timeout = {settings.SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size = {settings.SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size = -{settings.SQLITE_CACHE_SIZE_KB}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if settings.SQLITE_READ_ONLY:
+        # Switching to WAL would write to the file
+        pragmas.append("PRAGMA query_only = ON")
+    elif settings.SQLITE_WAL:
+        # NORMAL is durable across application crashes in WAL mode
+        pragmas += ["PRAGMA journal_mode = WAL", "PRAGMA synchronous = NORMAL"]
+    return pragmas
+
+
+def _configure_sqlite(engine: AsyncEngine) -> None:
+    pragmas = _sqlite_pragmas()
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def _engine_options(url: str, pool_size: int, max_overflow: int) -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "echo": settings.DB_ECHO,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+    # SQLite does not use a sized connection pool
+    if not url.startswith("sqlite"):
+        options["pool_size"] = pool_size
+        options["max_overflow"] = max_overflow
+    return options
+
+
+def _in_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def _create_engine(url: str, pool_size: int, max_overflow: int) -> AsyncEngine:
+    engine = create_async_engine(url, **_engine_options(url, pool_size, max_overflow))
+    if engine.dialect.name == "sqlite":
+        _configure_sqlite(engine)
+    return engine
 
-# Async engine with asyncpg driver
-engine = create_async_engine(settings.DB_URL, echo=True)
 
-# Async session factory
-AsyncSessionLocal = sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
+# Async engine on the primary, used by the sync job and every write
+engine = _create_engine(
+    settings.DB_URL, settings.DB_WRITE_POOL_SIZE, settings.DB_WRITE_MAX_OVERFLOW
 )
 
+
+def _create_read_engines(
+    urls: List[str], write_engine: AsyncEngine
+) -> List[AsyncEngine]:
+    """An engine per read URL. An in-memory SQLite database only exists in
+    the engine that opened it, so reads of one go through the write engine."""
+    return [
+        (
+            write_engine
+            if _in_memory_sqlite(url)
+            else _create_engine(
+                url, settings.DB_READ_POOL_SIZE, settings.DB_READ_MAX_OVERFLOW
+            )
+        )
+        for url in urls
+    ]
+
+
+def _round_robin(
+    engines: List[AsyncEngine],
+) -> Iterator[async_sessionmaker[AsyncSession]]:
+    return itertools.cycle(
+        [
+            async_sessionmaker(read_engine, expire_on_commit=False)
+            for read_engine in engines
+        ]
+    )
+
+
+# Read engines with their own pools, so API reads never wait behind a long
+# sync transaction; spread across replicas when DB_READ_URLS is set
+read_engines = _create_read_engines(settings.DB_READ_URLS or [settings.DB_URL], engine)
+
+instrument_engine(engine, "write")
+for read_engine in read_engines:
+    if read_engine is not engine:
+        instrument_engine(read_engine, "read")
+
+# Async session factory for the primary
+AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+_read_session_factories = _round_robin(read_engines)
+
+
+def ReadSessionLocal() -> AsyncSession:
+    """Opens a session on the next read engine, round robin"""
+    return next(_read_session_factories)()
+
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
-    """Async dependency for getting a SQLAlchemy async session"""
-    async with AsyncSessionLocal() as session:
+    """Async dependency for getting a SQLAlchemy async session for reads"""
+    async with ReadSessionLocal() as session:
         yield session
@@ -0,0 +1,153 @@
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import EventRow
+from .partitions import plans_source
+from .session import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_micros(value: datetime) -> int:
+    return (value.replace(tzinfo=None) - EPOCH) // MICROSECOND
+
+
+def _from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+class EventSnapshot:
+    """Read-only, array-backed copy of the plans sorted by start datetime.
+
+    A range query is a binary search on the start times plus a scan of the
+    slice it delimits; plans are then aggregated per event exactly like the
+    /events GROUP BY.
+    """
+
+    def __init__(self) -> None:
+        self._events: List[Tuple[str, str]] = []
+        self._event_index: Dict[Tuple[str, str], int] = {}
+        self._starts = array("q")
+        self._ends = array("q")
+        self._events_of = array("l")
+        self._min_prices = array("d")
+        self._max_prices = array("d")
+        # Upper bound of start - end, so plans ending before ``ends_at`` are
+        # known to start before ``ends_at + skew`` even with inverted dates
+        self._skew = 0
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def append(
+        self,
+        base_plan_id: str,
+        title: str,
+        start_datetime: datetime,
+        end_datetime: datetime,
+        min_price: float,
+        max_price: float,
+    ) -> None:
+        """Adds a plan; plans must be appended in start datetime order"""
+        start, end = _to_micros(start_datetime), _to_micros(end_datetime)
+        if self._starts and start < self._starts[-1]:
+            raise ValueError("Plans must be appended sorted by start datetime")
+        key = (base_plan_id, title)
+        event = self._event_index.get(key)
+        if event is None:
+            event = self._event_index[key] = len(self._events)
+            self._events.append(key)
+        self._starts.append(start)
+        self._ends.append(end)
+        self._events_of.append(event)
+        self._min_prices.append(min_price)
+        self._max_prices.append(max_price)
+        self._skew = max(self._skew, start - end)
+
+    def query(self, starts_at: datetime, ends_at: datetime) -> List[EventRow]:
+        """Aggregates the plans inside the range per event"""
+        since, until = _to_micros(starts_at), _to_micros(ends_at)
+        lo = bisect_left(self._starts, since)
+        hi = bisect_right(self._starts, until + self._skew, lo)
+
+        # [start, end, min_price, max_price] per event, updated in place
+        aggregates: Dict[int, List[Any]] = {}
+        starts, ends = self._starts, self._ends
+        for i in range(lo, hi):
+            end = ends[i]
+            if end > until:
+                continue
+            event = self._events_of[i]
+            aggregate = aggregates.get(event)
+            if aggregate is None:
+                aggregates[event] = [
+                    starts[i],
+                    end,
+                    self._min_prices[i],
+                    self._max_prices[i],
+                ]
+                continue
+            # Starts are visited in ascending order, the first one is the min
+            if end > aggregate[1]:
+                aggregate[1] = end
+            if self._min_prices[i] < aggregate[2]:
+                aggregate[2] = self._min_prices[i]
+            if self._max_prices[i] > aggregate[3]:
+                aggregate[3] = self._max_prices[i]
+
+        return [
+            EventRow(
+                *self._events[event],
+                _from_micros(start),
+                _from_micros(end),
+                min_price,
+                max_price,
+            )
+            for event, (start, end, min_price, max_price) in aggregates.items()
+        ]
+
+
+async def build_snapshot(db: AsyncSession) -> EventSnapshot:
+    """Loads every plan from the database into a new snapshot"""
+    snapshot = EventSnapshot()
+    plans = plans_source()
+    result = await db.stream(
+        select(
+            plans.c.base_plan_id,
+            plans.c.title,
+            plans.c.start_datetime,
+            plans.c.end_datetime,
+            plans.c.min_price,
+            plans.c.max_price,
+        )
+        .order_by(plans.c.start_datetime)
+        .execution_options(yield_per=10_000)
+    )
+    async for row in result:
+        snapshot.append(*row)
+    return snapshot
+
+
+_current: Optional[EventSnapshot] = None
+
+
+def current_snapshot() -> Optional[EventSnapshot]:
+    return _current
+
+
+async def refresh_snapshot() -> None:
+    """Rebuilds the snapshot from the database and swaps it in atomically"""
+    global _current
+    async with AsyncSessionLocal() as db:
+        snapshot = await build_snapshot(db)
+    _current = snapshot
+    logger.info(f"Loaded events snapshot with {len(snapshot)} plans.")
@@ -0,0 +1,152 @@
+"""What differs between the PostgreSQL and SQLite storage of the plans.
+
+PostgreSQL is the shared primary. SQLite serves from a local file with no
+network hop per query, either as the whole database or as a snapshot file
+exported by the syncing process (SNAPSHOT_EXPORT_PATH) and shipped to
+read-only nodes (SQLITE_READ_ONLY), which reopen it when it is replaced.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import FromClause, Table, insert, make_url, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+
+from .config import settings
+from .models import Base, EventSummary, Plan, SyncState
+from .partitions import plans_source
+from .session import engine, read_engines
+
+logger = logging.getLogger(__name__)
+
+# Rows copied per statement when exporting from PostgreSQL
+EXPORT_BATCH_SIZE = 5000
+
+
+def is_sqlite(target: AsyncEngine = engine) -> bool:
+    return target.dialect.name == "sqlite"
+
+
+def upsert(table: Any, target: AsyncEngine = engine) -> Any:
+    """INSERT supporting on_conflict_do_update in the dialect of the database"""
+    if is_sqlite(target):
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+async def begin_write(db: AsyncSession) -> None:
+    """Opens the write transaction of db ahead of its first SAVEPOINT.
+
+    pysqlite only begins a transaction before an INSERT, UPDATE or DELETE,
+    so a SAVEPOINT issued earlier would start its own, committed on release.
+    """
+    if is_sqlite():
+        await db.execute(text("BEGIN IMMEDIATE"))
+
+
+def sqlite_path(url: Optional[str] = None) -> Optional[str]:
+    """File of a SQLite database URL (DB_URL by default), None for other
+    databases or in-memory ones"""
+    parsed = make_url(url or settings.DB_URL)
+    if parsed.get_backend_name() != "sqlite":
+        return None
+    if parsed.database in (None, "", ":memory:"):
+        return None
+    return parsed.database
+
+
+async def refresh_statistics() -> None:
+    """Keeps the SQLite query planner statistics current after a sync.
+
+    Without them SQLite ignores the covering index of /events. PostgreSQL's
+    autovacuum does this on its own.
+    """
+    if not is_sqlite():
+        return
+    async with engine.connect() as conn:
+        # Sampled, so this stays cheap on large tables
+        await conn.exec_driver_sql("PRAGMA analysis_limit = 1000")
+        await conn.exec_driver_sql("ANALYZE")
+        await conn.commit()
+
+
+async def export_snapshot(path: str) -> None:
+    """Writes the served tables to a standalone SQLite file at path.
+
+    The file is built next to path and renamed over it, so readers only
+    ever open a complete snapshot.
+    """
+    building = f"{path}.building"
+    if os.path.exists(building):
+        os.remove(building)
+    if is_sqlite():
+        # A consistent, defragmented copy in one statement
+        async with engine.connect() as conn:
+            escaped = building.replace("'", "''")
+            await conn.exec_driver_sql(f"VACUUM INTO '{escaped}'")
+    else:
+        await _copy_to_sqlite(building)
+    await asyncio.to_thread(_finish_snapshot, building)
+    os.replace(building, path)
+    logger.info(f"Exported a database snapshot to {path}.")
+
+
+async def _copy_to_sqlite(path: str) -> None:
+    target = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    try:
+        async with target.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        tables: Tuple[Tuple[Table, FromClause], ...] = (
+            (Plan.__table__, plans_source()),
+            (EventSummary.__table__, EventSummary.__table__),
+            (SyncState.__table__, SyncState.__table__),
+        )
+        # One read transaction, so the tables are copied as of the same sync
+        async with engine.connect() as source, target.begin() as conn:
+            for table, rows in tables:
+                result = await source.stream(
+                    select(rows).execution_options(yield_per=EXPORT_BATCH_SIZE)
+                )
+                async for partition in result.mappings().partitions():
+                    await conn.execute(insert(table), [dict(row) for row in partition])
+    finally:
+        await target.dispose()
+
+
+def _finish_snapshot(path: str) -> None:
+    conn = sqlite3.connect(path)
+    try:
+        # Single file to ship, with statistics for the query planner
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+_snapshot_file: Optional[Tuple[int, int]] = None
+
+
+async def reopen_if_replaced() -> bool:
+    """On read-only nodes, drops pooled connections to a SQLite file that was
+    replaced by a newly shipped snapshot, so the next queries open it"""
+    global _snapshot_file
+    path = sqlite_path()
+    if path is None or not settings.SQLITE_READ_ONLY:
+        return False
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    # Snapshots are renamed into place, so a new file is a new inode
+    file_id = (stat.st_dev, stat.st_ino)
+    replaced = _snapshot_file is not None and file_id != _snapshot_file
+    _snapshot_file = file_id
+    if replaced:
+        logger.info(f"{path} was replaced, reopening it.")
+        for target in {engine, *read_engines}:
+            await target.dispose()
+    return replaced
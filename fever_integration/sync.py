@@ -1,54 +1,415 @@
 import asyncio
 import logging
-from typing import List
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncGenerator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    BigInteger,
+    Table,
+    delete,
+    func,
+    literal,
+    select,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncSessionTransaction
 
-from .client import FeverClient
-from .models import Plan
-from .session import AsyncSessionLocal
+from . import metrics
+from .config import settings
+from .generation import apply_generation, bump_generation, check_generation
+from .leader import leader
+from .models import EventSummary, Plan, PlanRecord, plan_fingerprint
+from .partitions import (
+    archive_cutoff,
+    archive_partitions,
+    archive_table,
+    ensure_partitions,
+    plans_source,
+)
+from .providers import ProviderSources, SourceBatch, SourceResult, configured_urls
+from .queries import read_generation
+from .session import AsyncSessionLocal, engine
+from .storage import (
+    begin_write,
+    export_snapshot,
+    refresh_statistics,
+    reopen_if_replaced,
+    upsert,
+)
 
 logger = logging.getLogger(__name__)
 
+UPSERT_COLUMNS = (
+    "base_plan_id",
+    "title",
+    "start_datetime",
+    "end_datetime",
+    "last_seen",
+    "min_price",
+    "max_price",
+    "fingerprint",
+)
 
-async def sync_events() -> None:
-    client = FeverClient()
-    async with AsyncSessionLocal() as db:
-        try:
-            plans: List[Plan] = await client.fetch_events()
-            for plan in plans:
-                stmt = insert(Plan).values(
-                    id=plan.id,
-                    base_plan_id=plan.base_plan_id,
-                    title=plan.title,
-                    start_datetime=plan.start_datetime,
-                    end_datetime=plan.end_datetime,
-                    last_seen=plan.last_seen,
-                    min_price=plan.min_price,
-                    max_price=plan.max_price,
+# Shared across syncs so conditional request validators survive between runs
+sources = ProviderSources(configured_urls())
+
+# Unix time of the last sync of this process that did not fail
+last_sync_success: Optional[float] = None
+
+
+@dataclass
+class SyncResult:
+    status: str  # "ok", "not_modified" or "failed"
+    parsed: int = 0
+    written: int = 0
+    unchanged: int = 0
+    error: Optional[BaseException] = None
+    failed_sources: int = 0
+
+
+def _plan_values(plan: Union[Plan, PlanRecord]) -> Dict[str, Any]:
+    if isinstance(plan, PlanRecord):
+        values = plan._asdict()
+    else:
+        values = {"id": plan.id}
+        for column in UPSERT_COLUMNS:
+            values[column] = getattr(plan, column)
+    if values["fingerprint"] is None:
+        values["fingerprint"] = plan_fingerprint(plan)
+    return values
+
+
+def _upsert_stmt(table: Table) -> Any:
+    stmt = upsert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={column: stmt.excluded[column] for column in UPSERT_COLUMNS},
+        # Guards against a concurrent writer having stored the same content already
+        where=table.c.fingerprint.is_distinct_from(stmt.excluded.fingerprint),
+    )
+
+
+async def _upsert_plans(
+    db: AsyncSession,
+    plans: Sequence[Union[Plan, PlanRecord]],
+    batch_size: Optional[int] = None,
+    seen_at: Optional[datetime] = None,
+    touched: Optional[Set[str]] = None,
+) -> Tuple[int, int]:
+    """Writes new or changed plans in batches and only bumps last_seen for the rest.
+
+    Returns the number of written and unchanged plans. The base plan ids of
+    written plans are added to ``touched``. Plans of archived months are
+    only updated in place in the archive, never added to it.
+    """
+    batch_size = batch_size or settings.SYNC_BATCH_SIZE
+    seen_at = seen_at or datetime.now()
+    # A single statement cannot update the same row twice, keep the last version
+    rows = [_plan_values(plan) for plan in {plan.id: plan for plan in plans}.values()]
+    cutoff = archive_cutoff()
+    tables: List[Table] = [Plan.__table__]
+    if cutoff is not None:
+        tables.append(archive_table)
+
+    written = unchanged = skipped = 0
+    for offset in range(0, len(rows), batch_size):
+        batch = rows[offset : offset + batch_size]
+        ids = [row["id"] for row in batch]
+        stored: Dict[str, Tuple[Table, datetime, Optional[str]]] = {}
+        for table in tables:
+            result = await db.execute(
+                select(table.c.id, table.c.start_datetime, table.c.fingerprint).where(
+                    table.c.id.in_(ids)
                 )
-                stmt = stmt.on_conflict_do_update(
-                    index_elements=["id"],
-                    set_={
-                        "base_plan_id": plan.base_plan_id,
-                        "title": plan.title,
-                        "start_datetime": plan.start_datetime,
-                        "end_datetime": plan.end_datetime,
-                        "last_seen": plan.last_seen,
-                        "min_price": plan.min_price,
-                        "max_price": plan.max_price,
-                    },
+            )
+            for id, start, fingerprint in result.all():
+                stored[id] = (table, start, fingerprint)
+
+        changed: Dict[Table, List[Dict[str, Any]]] = {t: [] for t in tables}
+        unchanged_ids: Dict[Table, List[str]] = {t: [] for t in tables}
+        moved: Dict[Table, List[str]] = {t: [] for t in tables}
+        for row in batch:
+            stored_in, start, fingerprint = stored.get(row["id"], (None, None, None))
+            if cutoff is not None and row["start_datetime"] < cutoff:
+                # The archive has no partition for new rows, and plans must
+                # not get one for an archived month
+                if stored_in is not archive_table or start != row["start_datetime"]:
+                    skipped += 1
+                    continue
+            target = Plan.__table__
+            if stored_in is not None and start == row["start_datetime"]:
+                target = stored_in
+            if fingerprint == row["fingerprint"]:
+                unchanged_ids[target].append(row["id"])
+                continue
+            changed[target].append(row)
+            if stored_in is not None and stored_in is not target:
+                moved[stored_in].append(row["id"])
+            elif settings.PLANS_PARTITIONED and stored_in is not None:
+                # start_datetime is part of the key, a rescheduled plan is a new row
+                if start != row["start_datetime"]:
+                    moved[stored_in].append(row["id"])
+
+        for table in tables:
+            if moved[table]:
+                await db.execute(delete(table).where(table.c.id.in_(moved[table])))
+            if changed[table]:
+                # executemany lets the driver batch rows into multi-row VALUES
+                await db.execute(_upsert_stmt(table), changed[table])
+            if unchanged_ids[table]:
+                await db.execute(
+                    update(table)
+                    .where(table.c.id.in_(unchanged_ids[table]))
+                    .values(last_seen=seen_at)
                 )
-                await db.execute(stmt)
+            written += len(changed[table])
+            unchanged += len(unchanged_ids[table])
+            if touched is not None:
+                touched.update(row["base_plan_id"] for row in changed[table])
+    if skipped:
+        logger.warning(
+            f"Skipped {skipped} new or rescheduled plans of archived months."
+        )
+    return written, unchanged
+
+
+@dataclass
+class _FeedWrite:
+    """What one streamed feed wrote so far, inside its own SAVEPOINT"""
+
+    result: SourceResult
+    savepoint: AsyncSessionTransaction
+    parsed: int = 0
+    written: int = 0
+    unchanged: int = 0
+    touched: Set[str] = field(default_factory=set)
+
+    async def end(self) -> None:
+        # A feed's result is final once its last batch is handed out
+        if self.result.error is None:
+            await self.savepoint.commit()
+        else:
+            await self.savepoint.rollback()
+
+
+async def _write_feeds(
+    db: AsyncSession,
+    batches: AsyncGenerator[SourceBatch, None],
+    touched: Set[str],
+) -> Tuple[int, int, int]:
+    """Writes streamed batches, rolling back a feed that fails partway, so
+    only complete feeds are committed.
+
+    Returns the number of parsed, written and unchanged plans of those feeds.
+    """
+    feeds: List[_FeedWrite] = []
+    try:
+        async for result, batch in batches:
+            if not feeds or feeds[-1].result is not result:
+                if feeds:
+                    await feeds[-1].end()
+                else:
+                    await begin_write(db)
+                feeds.append(_FeedWrite(result, await db.begin_nested()))
+            feed = feeds[-1]
+            written, unchanged = await _upsert_plans(db, batch, touched=feed.touched)
+            feed.parsed += len(batch)
+            feed.written += written
+            feed.unchanged += unchanged
+        if feeds:
+            await feeds[-1].end()
+    finally:
+        await batches.aclose()
+    kept = [feed for feed in feeds if feed.result.error is None]
+    for feed in kept:
+        touched.update(feed.touched)
+    return (
+        sum(feed.parsed for feed in kept),
+        sum(feed.written for feed in kept),
+        sum(feed.unchanged for feed in kept),
+    )
+
+
+async def refresh_event_summaries(
+    db: AsyncSession, base_plan_ids: Optional[Iterable[str]] = None, version: int = 0
+) -> None:
+    """Recomputes the event summaries of the given base plans (all if None),
+    stamping them with the given data generation"""
+    columns = [
+        "base_plan_id",
+        "title",
+        "min_start_datetime",
+        "max_start_datetime",
+        "min_end_datetime",
+        "max_end_datetime",
+        "min_price",
+        "max_price",
+        "version",
+    ]
+    plans = plans_source().c
+    aggregate = select(
+        plans.base_plan_id,
+        plans.title,
+        func.min(plans.start_datetime),
+        func.max(plans.start_datetime),
+        func.min(plans.end_datetime),
+        func.max(plans.end_datetime),
+        func.min(plans.min_price),
+        func.max(plans.max_price),
+        literal(version, BigInteger),
+    ).group_by(plans.base_plan_id, plans.title)
+
+    if base_plan_ids is None:
+        await db.execute(delete(EventSummary))
+        await db.execute(upsert(EventSummary).from_select(columns, aggregate))
+        return
+
+    ids = list(base_plan_ids)
+    for offset in range(0, len(ids), settings.SYNC_BATCH_SIZE):
+        chunk = ids[offset : offset + settings.SYNC_BATCH_SIZE]
+        # Recompute every title of the base plan in case a plan was renamed
+        await db.execute(
+            delete(EventSummary).where(EventSummary.base_plan_id.in_(chunk))
+        )
+        await db.execute(
+            upsert(EventSummary).from_select(
+                columns, aggregate.where(plans.base_plan_id.in_(chunk))
+            )
+        )
+
+
+async def ensure_event_summaries() -> None:
+    """Builds the event summaries from scratch if the table is still empty"""
+    async with AsyncSessionLocal() as db:
+        if await db.scalar(select(EventSummary.base_plan_id).limit(1)) is not None:
+            return
+        if await db.scalar(select(Plan.id).limit(1)) is None:
+            return
+        logger.info("Building event summaries from existing plans.")
+        await refresh_event_summaries(db, version=await read_generation(db))
+        await db.commit()
+
+
+async def sync_events(
+    pipeline: bool = False, refresh_caches: bool = True
+) -> SyncResult:
+    """Ingests the provider feeds. With pipeline, downloads, parsing and
+    writes overlap (see ProviderSources.pipeline_events); refresh_caches
+    refreshes this process' /events caches after new data is committed."""
+    global last_sync_success
+    started = time.perf_counter()
+    result = await _sync_events(pipeline, refresh_caches)
+    if result.status != "failed":
+        last_sync_success = time.time()
+    metrics.observe_sync(
+        result.status,
+        time.perf_counter() - started,
+        result.parsed,
+        result.written,
+        result.unchanged,
+    )
+    return result
+
+
+async def _sync_events(pipeline: bool, refresh_caches: bool) -> SyncResult:
+    async with AsyncSessionLocal() as db:
+        try:
+            written = unchanged = parsed = 0
+            touched: Set[str] = set()
+            if settings.PROVIDER_STREAMING or pipeline:
+                await ensure_partitions(engine)
+                # Write each batch as soon as its base plans are parsed
+                if settings.PROVIDER_STREAMING:
+                    batches = sources.stream_events()
+                else:
+                    batches = sources.pipeline_events()
+                parsed, written, unchanged = await _write_feeds(db, batches, touched)
+            else:
+                plans = await sources.fetch_events()
+                if plans:
+                    # Before the first write, the session holds no connection yet
+                    await ensure_partitions(
+                        engine, {plan.start_datetime for plan in plans}
+                    )
+                    written, unchanged = await _upsert_plans(db, plans, touched=touched)
+                    parsed = len(plans)
+            failed = sources.failed
+            if len(failed) == len(sources.results):
+                error = failed[0].error
+                assert error is not None
+                raise error
+            if sources.not_modified:
+                logger.info("Provider data unchanged, skipping sync.")
+                return SyncResult("not_modified", failed_sources=len(failed))
+            generation = await bump_generation(db) if written else None
+            if generation is not None:
+                # The generation row lock orders syncs, so versions commit in order
+                await refresh_event_summaries(db, touched, generation)
             await db.commit()
-            logger.info(f"Synced {len(plans)} plans successfully.")
+            logger.info(
+                f"Synced {parsed} plans successfully "
+                f"({written} written, {unchanged} unchanged)."
+            )
+            if failed:
+                logger.warning(
+                    f"{len(failed)} of {len(sources.results)} provider feeds failed: "
+                    + ", ".join(result.url for result in failed)
+                )
         except Exception as e:
             await db.rollback()
             logger.error(f"Sync failed: {str(e)}", exc_info=True)
+            return SyncResult("failed", error=e)
 
+    try:
+        await archive_partitions(engine)
+    except Exception as e:
+        logger.error(f"Archiving partitions failed: {str(e)}", exc_info=True)
+    if generation is not None:
+        try:
+            await refresh_statistics()
+        except Exception as e:
+            logger.error(f"Refreshing statistics failed: {str(e)}", exc_info=True)
+    if generation is not None and settings.SNAPSHOT_EXPORT_PATH:
+        try:
+            await export_snapshot(settings.SNAPSHOT_EXPORT_PATH)
+        except Exception as e:
+            logger.error(f"Snapshot export failed: {str(e)}", exc_info=True)
+    if generation is not None and refresh_caches:
+        await apply_generation(generation)
+    return SyncResult("ok", parsed, written, unchanged, failed_sources=len(failed))
 
-async def background_sync(refresh_timeout: int) -> None:
+
+async def sync_if_leader(**options: bool) -> Optional[SyncResult]:
+    """Runs a sync, with sync_events options, only in the process holding
+    the leader lock"""
+    try:
+        if not await leader.acquire():
+            return None
+    except Exception as e:
+        logger.error(f"Leader election failed: {str(e)}", exc_info=True)
+        return None
+    return await sync_events(**options)
+
+
+async def watch_generation(poll_interval: float) -> None:
+    """Refreshes in-process caches when any process commits new data"""
     while True:
-        await asyncio.sleep(refresh_timeout)
-        await sync_events()
+        await asyncio.sleep(poll_interval)
+        try:
+            await reopen_if_replaced()
+            await check_generation()
+        except Exception as e:
+            logger.error(f"Generation check failed: {str(e)}", exc_info=True)
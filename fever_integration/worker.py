@@ -0,0 +1,70 @@
+"""Standalone ingestion process: ``python -m fever_integration.worker``.
+
+Runs the sync scheduler without the API, so parsing and bulk writes do not
+compete with request handling. Run the API with INGESTION_ENABLED=false
+next to it; several workers can run, the sync leader lock lets only one
+of them sync at a time. Syncs use the download -> parse -> write pipeline.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+
+from prometheus_client import start_http_server
+
+from .config import settings
+from .leader import leader
+from .partitions import create_tables
+from .scheduler import SyncScheduler
+from .session import engine
+from .storage import export_snapshot
+from .sync import sources
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker() -> None:
+    """Syncs every REFRESH_TIMEOUT seconds until cancelled"""
+    await sources.start()
+    try:
+        await create_tables(engine)
+        path = settings.SNAPSHOT_EXPORT_PATH
+        if path and not os.path.exists(path):
+            # Later exports follow the syncs that write data
+            await export_snapshot(path)
+        # No /events caches to refresh here, API processes poll the generation
+        scheduler = SyncScheduler(
+            settings.REFRESH_TIMEOUT, pipeline=True, refresh_caches=False
+        )
+        logger.info("Ingestion worker started.")
+        await scheduler.run(run_first=True)
+    finally:
+        await leader.release()
+        await sources.aclose()
+        logger.info("Ingestion worker stopped.")
+
+
+async def _main() -> None:
+    task = asyncio.ensure_future(run_worker())
+    loop = asyncio.get_running_loop()
+    # Finish cleanly on docker stop / Ctrl-C: the running sync rolls back
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    if settings.WORKER_METRICS_PORT is not None and settings.METRICS_ENABLED:
+        start_http_server(settings.WORKER_METRICS_PORT)
+    asyncio.run(_main())
+
+
+if __name__ == "__main__":
+    main()
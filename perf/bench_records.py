@@ -0,0 +1,88 @@
+"""Compares parsing the feed into ORM Plan instances with plan records.
+
+Reports time, peak traced memory, and memory and allocated blocks kept per
+plan for the parsed result, e.g.:
+
+    PYTHONPATH=. python perf/bench_records.py --sizes 10000 100000
+"""
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, List
+from xml.etree import ElementTree as ET
+
+from common import generate_xml
+
+from fever_integration import FeverClient, Plan
+from fever_integration.models import plan_fingerprint
+
+
+def parse_orm(xml: str) -> List[Plan]:
+    """The previous parser: one ORM Plan per plan, dates parsed every time"""
+    plans = []
+    for base_plan in ET.fromstring(xml).findall(".//base_plan"):
+        if base_plan.get("sell_mode") != "online":
+            continue
+        for plan in base_plan.findall(".//plan"):
+            prices = [float(zone.get("price")) for zone in plan.findall("zone")]
+            plan_obj = Plan(
+                id=f"{base_plan.get('base_plan_id')}-{plan.get('plan_id')}",
+                base_plan_id=base_plan.get("base_plan_id"),
+                title=base_plan.get("title"),
+                start_datetime=datetime.fromisoformat(plan.get("plan_start_date")),
+                end_datetime=datetime.fromisoformat(plan.get("plan_end_date")),
+                last_seen=datetime.now(),
+                min_price=min(prices),
+                max_price=max(prices),
+            )
+            plan_obj.fingerprint = plan_fingerprint(plan_obj)
+            plans.append(plan_obj)
+    return plans
+
+
+def parse_records(xml: str) -> list:
+    return FeverClient()._parse_plans(xml)
+
+
+def measure(parse: Callable[[str], list], xml: str, size: int) -> None:
+    gc.collect()
+    started = time.perf_counter()
+    plans = parse(xml)
+    elapsed = time.perf_counter() - started
+    assert len(plans) == size
+    del plans
+
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    plans = parse(xml)
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    kept_blocks = sys.getallocatedblocks() - blocks
+    del plans
+    print(
+        f"{size:>9} {parse.__name__:>14} {elapsed:>9.2f} {peak / 2**20:>10.1f} "
+        f"{kept / size:>10.0f} {kept_blocks / size:>12.1f}"
+    )
+
+
+def main(sizes: List[int]) -> None:
+    print(
+        f"{'plans':>9} {'strategy':>14} {'time (s)':>9} {'peak (MB)':>10} "
+        f"{'bytes/plan':>10} {'blocks/plan':>12}"
+    )
+    for size in sizes:
+        xml = generate_xml(size).decode()
+        for parse in (parse_orm, parse_records):
+            measure(parse, xml, size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+    main(args.sizes)
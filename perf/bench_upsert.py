@@ -0,0 +1,129 @@
+"""Compares the per-plan upsert loop with batched multi-row upserts.
+
+Runs against DB_URL, a local SQLite file through aiosqlite by default:
+
+    PYTHONPATH=. python perf/bench_upsert.py --sizes 10000 100000 1000000
+
+Each strategy inserts the plans, then writes the same plans again
+(unchanged) and plans with new prices (changed). The batched path skips
+unchanged plans by fingerprint and only bumps their last_seen.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+DEFAULT_DB_URL = "sqlite+aiosqlite:///" + os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "bench.db"
+)
+# Settings are read at import time, so this has to come first
+os.environ.setdefault("DB_URL", DEFAULT_DB_URL)
+
+from fever_integration import AsyncSessionLocal, Base, Plan  # noqa: E402
+from fever_integration.session import engine  # noqa: E402
+from fever_integration.storage import upsert  # noqa: E402
+from fever_integration.sync import _upsert_plans  # noqa: E402
+
+
+def make_plans(total_plans: int, price_offset: float = 0.0) -> List[Plan]:
+    base_datetime = datetime(2025, 1, 1)
+    now = datetime.now()
+    return [
+        Plan(
+            id=f"perf_{i}",
+            base_plan_id=f"bp_perf_{i // 10}",
+            title=f"Performance Event {i // 10}",
+            start_datetime=base_datetime + timedelta(minutes=i),
+            end_datetime=base_datetime + timedelta(minutes=i + 30),
+            last_seen=now,
+            min_price=10.0 + (i % 50) + price_offset,
+            max_price=20.0 + (i % 50) + price_offset,
+        )
+        for i in range(total_plans)
+    ]
+
+
+async def upsert_loop(db, plans: List[Plan]) -> None:
+    """The previous ingestion path: one INSERT ... ON CONFLICT per plan"""
+    for plan in plans:
+        stmt = upsert(Plan).values(
+            id=plan.id,
+            base_plan_id=plan.base_plan_id,
+            title=plan.title,
+            start_datetime=plan.start_datetime,
+            end_datetime=plan.end_datetime,
+            last_seen=plan.last_seen,
+            min_price=plan.min_price,
+            max_price=plan.max_price,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={
+                "base_plan_id": plan.base_plan_id,
+                "title": plan.title,
+                "start_datetime": plan.start_datetime,
+                "end_datetime": plan.end_datetime,
+                "last_seen": plan.last_seen,
+                "min_price": plan.min_price,
+                "max_price": plan.max_price,
+            },
+        )
+        await db.execute(stmt)
+
+
+async def timed(strategy, plans: List[Plan]) -> float:
+    async with AsyncSessionLocal() as db:
+        start_time = time.perf_counter()
+        await strategy(db, plans)
+        await db.commit()
+        return time.perf_counter() - start_time
+
+
+async def main(sizes: List[int], skip_loop_above: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    strategies = {"loop": upsert_loop, "batched": _upsert_plans}
+    columns = ("insert (s)", "unchanged (s)", "changed (s)")
+    print(f"{'plans':>10} {'strategy':>10} " + " ".join(f"{c:>14}" for c in columns))
+    for size in sizes:
+        plans = make_plans(size)
+        changed = make_plans(size, price_offset=1.0)
+        for name, strategy in strategies.items():
+            if name == "loop" and size > skip_loop_above:
+                skipped = " ".join(f"{'skipped':>14}" for _ in columns)
+                print(f"{size:>10} {name:>10} {skipped}")
+                continue
+            async with engine.begin() as conn:
+                await conn.execute(Plan.__table__.delete())
+            timings = [
+                await timed(strategy, plans),
+                await timed(strategy, plans),
+                await timed(strategy, changed),
+            ]
+            print(
+                f"{size:>10} {name:>10} "
+                + " ".join(f"{timing:>14.2f}" for timing in timings)
+            )
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--skip-loop-above",
+        type=int,
+        default=1_000_000,
+        help="Skip the per-plan loop for sizes above this (it can take very long)",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.skip_loop_above))
@@ -0,0 +1,198 @@
+"""Shared helpers for the benchmark suite: data generation, stats and baselines"""
+
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BASE_DATETIME = datetime(2025, 1, 1)
+PLANS_PER_BASE_PLAN = 10
+
+
+def plan_start(index: int) -> datetime:
+    """Plans start one minute apart, so 1M plans cover about two years"""
+    return BASE_DATETIME + timedelta(minutes=index)
+
+
+def generate_xml(total_plans: int) -> bytes:
+    """Builds a provider feed with total_plans online plans of two zones each"""
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<planList version="1.0"><output>']
+    for first in range(0, total_plans, PLANS_PER_BASE_PLAN):
+        base_plan = first // PLANS_PER_BASE_PLAN
+        parts.append(
+            f'<base_plan base_plan_id="bp{base_plan}" sell_mode="online" '
+            f'title="Event {base_plan}">'
+        )
+        for i in range(first, min(first + PLANS_PER_BASE_PLAN, total_plans)):
+            start = plan_start(i)
+            end = start + timedelta(minutes=30)
+            parts.append(
+                f'<plan plan_start_date="{start.isoformat()}" '
+                f'plan_end_date="{end.isoformat()}" plan_id="{i}" '
+                f'sell_from="2024-01-01T00:00:00" sell_to="{start.isoformat()}" '
+                f'sold_out="false">'
+                f'<zone zone_id="1" capacity="100" price="{10 + i % 50}.00" '
+                f'name="Zone A" numbered="true" />'
+                f'<zone zone_id="2" capacity="200" price="{20 + i % 50}.00" '
+                f'name="Zone B" numbered="false" />'
+                f"</plan>"
+            )
+        parts.append("</base_plan>")
+    parts.append("</output></planList>")
+    return "".join(parts).encode()
+
+
+def provider_stub(xml: bytes) -> httpx.AsyncClient:
+    """An HTTP client that answers every request with the given feed, offline"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200, content=xml, headers={"Content-Type": "application/xml"}
+        )
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@dataclass
+class Result:
+    stage: str
+    case: str
+    size: int
+    runs: int
+    p50: float
+    p95: float
+    p99: float
+    mean: float
+    peak_bytes: int
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def key(self) -> Tuple[str, str, int]:
+        return self.stage, self.case, self.size
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Linear interpolation between closest ranks, like numpy's default"""
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(
+    stage: str,
+    case: str,
+    size: int,
+    samples: List[float],
+    peak_bytes: int,
+    **extra: Any,
+) -> Result:
+    return Result(
+        stage=stage,
+        case=case,
+        size=size,
+        runs=len(samples),
+        p50=percentile(samples, 50),
+        p95=percentile(samples, 95),
+        p99=percentile(samples, 99),
+        mean=statistics.fmean(samples),
+        peak_bytes=peak_bytes,
+        extra=extra,
+    )
+
+
+async def timed(action: Callable[[], Awaitable[Any]]) -> float:
+    started = time.perf_counter()
+    await action()
+    return time.perf_counter() - started
+
+
+async def peak_memory(action: Callable[[], Awaitable[Any]]) -> int:
+    """Peak bytes allocated by Python while running action.
+
+    Measured in a separate run: tracemalloc slows allocations down too much
+    to be enabled while timing.
+    """
+    tracemalloc.start()
+    try:
+        await action()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def print_results(results: List[Result]) -> None:
+    print(
+        f"{'stage':>6} {'case':>10} {'plans':>9} {'runs':>5} "
+        f"{'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'peak (MB)':>10}"
+    )
+    for r in results:
+        print(
+            f"{r.stage:>6} {r.case:>10} {r.size:>9} {r.runs:>5} "
+            f"{r.p50 * 1000:>10.2f} {r.p95 * 1000:>10.2f} {r.p99 * 1000:>10.2f} "
+            f"{r.peak_bytes / 2**20:>10.1f}"
+        )
+
+
+def save_baseline(path: str, results: List[Result], db_url: str) -> None:
+    data = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "database": db_url.split(":", 1)[0],
+        },
+        "results": [asdict(result) for result in results],
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"Saved baseline to {path}")
+
+
+def load_baseline(path: str) -> Dict[Tuple[str, str, int], Result]:
+    with open(path) as f:
+        data = json.load(f)
+    results = [Result(**result) for result in data["results"]]
+    return {result.key: result for result in results}
+
+
+def compare(
+    results: List[Result],
+    baseline: Dict[Tuple[str, str, int], Result],
+    threshold: float,
+    memory_threshold: Optional[float] = None,
+) -> List[str]:
+    """Returns a line per measurement that got slower or bigger than allowed"""
+    memory_threshold = threshold if memory_threshold is None else memory_threshold
+    regressions = []
+    print(f"{'stage':>6} {'case':>10} {'plans':>9} {'p50':>9} {'p95':>9} {'peak':>9}")
+    for r in results:
+        base = baseline.get(r.key)
+        if base is None:
+            print(f"{r.stage:>6} {r.case:>10} {r.size:>9} {'(no baseline)':>29}")
+            continue
+        changes = {
+            "p50": r.p50 / base.p50 - 1 if base.p50 else 0.0,
+            "p95": r.p95 / base.p95 - 1 if base.p95 else 0.0,
+            "peak": r.peak_bytes / base.peak_bytes - 1 if base.peak_bytes else 0.0,
+        }
+        print(
+            f"{r.stage:>6} {r.case:>10} {r.size:>9} "
+            + " ".join(f"{change:>+9.1%}" for change in changes.values())
+        )
+        for metric, change in changes.items():
+            limit = memory_threshold if metric == "peak" else threshold
+            if change > limit:
+                regressions.append(
+                    f"{r.stage}/{r.case}/{r.size}: {metric} {change:+.1%} "
+                    f"(limit {limit:+.0%})"
+                )
+    return regressions
@@ -0,0 +1,130 @@
+import asyncio
+
+import httpx
+import pytest
+
+from fever_integration import admission, app, coalescing
+from fever_integration.admission import AdmissionLimiter, Overloaded, RateLimiter
+
+
+@pytest.mark.asyncio
+async def test_limiter_queues_then_sheds():
+    limiter = AdmissionLimiter(limit=1, queue_size=1, timeout=0.05)
+    await limiter.acquire()
+
+    queued = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.waiting == 1
+
+    # The queue is full: rejected right away with a Retry-After
+    with pytest.raises(Overloaded) as rejected:
+        await limiter.acquire()
+    assert rejected.value.status_code == 503
+    assert int(rejected.value.headers["Retry-After"]) >= 1
+
+    # The queued request gets the slot when it is released
+    limiter.release(0.01)
+    await queued
+    assert limiter.active == 1 and limiter.waiting == 0
+
+    # No slot within the deadline
+    with pytest.raises(Overloaded):
+        await limiter.acquire()
+    limiter.release(0.01)
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_rejects_requests_that_would_time_out_in_the_queue():
+    limiter = AdmissionLimiter(limit=1, queue_size=100, timeout=1.0)
+    limiter.hold_time = 0.6
+    await limiter.acquire()
+    queued = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+
+    # Two holders ahead of it at 0.6s each is more than the deadline
+    with pytest.raises(Overloaded):
+        await limiter.acquire()
+    limiter.release(0.6)
+    await queued
+    limiter.release(0.6)
+
+
+def test_rate_limiter_allows_bursts_per_client():
+    limiter = RateLimiter(rate=1.0, burst=2, max_clients=10)
+    assert limiter.retry_after("a") is None
+    assert limiter.retry_after("a") is None
+    retry_after = limiter.retry_after("a")
+    assert retry_after is not None and 0 < retry_after <= 1
+    assert limiter.retry_after("b") is None
+
+
+@pytest.mark.asyncio
+async def test_overloaded_events_are_shed_or_served_stale(monkeypatch, asgi_client):
+    limiter = AdmissionLimiter(limit=1, queue_size=0, timeout=0.05)
+    monkeypatch.setattr(admission, "_limiter", limiter)
+    monkeypatch.setattr(coalescing.settings, "EVENTS_CACHE_TTL", 0.0)
+    admission._stale_bodies.clear()
+
+    url = "/events?starts_at=2030-01-01T00:00:00Z&ends_at=2030-02-01T00:00:00Z"
+    headers = {"Accept-Encoding": "identity"}
+    await limiter.acquire()
+    response = await asgi_client.get(url, headers=headers)
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+    limiter.release(0.01)
+    fresh = await asgi_client.get(url, headers=headers)
+    assert fresh.status_code == 200 and "Warning" not in fresh.headers
+
+    await limiter.acquire()
+    stale = await asgi_client.get(url, headers=headers)
+    assert stale.status_code == 200
+    assert stale.headers["Warning"].startswith("110")
+    assert stale.content == fresh.content
+
+    batch = await asgi_client.post(
+        "/events/batch",
+        json={"ranges": [{"starts_at": "2030-01-01", "ends_at": "2030-02-01"}]},
+    )
+    assert batch.status_code == 503
+    limiter.release(0.01)
+
+
+@pytest.mark.asyncio
+async def test_clients_over_their_rate_get_429(monkeypatch):
+    monkeypatch.setattr(admission.settings, "RATE_LIMIT_PER_SECOND", 0.5)
+    monkeypatch.setattr(admission, "_rate_limiter", RateLimiter(0.5, 1, 10))
+
+    url = "/events?starts_at=bad&ends_at=bad"
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app, client=("203.0.113.1", 1234)),
+        base_url="http://test",
+    ) as client:
+        assert (await client.get(url)).status_code == 400
+        # Forwarded addresses are the client's own claim without trusted proxies
+        forged = {"X-Forwarded-For": "198.51.100.7"}
+        response = await client.get(url, headers=forged)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) == 2
+
+
+def test_client_key_trusts_only_the_configured_proxies(monkeypatch):
+    from starlette.requests import Request
+
+    def key(*forwarded):
+        headers = [(b"x-forwarded-for", value.encode()) for value in forwarded]
+        scope = {"type": "http", "headers": headers, "client": ("10.0.0.2", 1)}
+        return admission.client_key(Request(scope))
+
+    assert key("198.51.100.7") == "10.0.0.2"
+
+    monkeypatch.setattr(admission.settings, "RATE_LIMIT_TRUSTED_PROXIES", 1)
+    # The proxy appended the real client after whatever the client sent
+    assert key("198.51.100.7, 203.0.113.1") == "203.0.113.1"
+    assert key("198.51.100.7", "203.0.113.1") == "203.0.113.1"
+
+    monkeypatch.setattr(admission.settings, "RATE_LIMIT_TRUSTED_PROXIES", 2)
+    assert key("198.51.100.7, 203.0.113.1, 10.0.0.1") == "203.0.113.1"
+    # Fewer entries than proxies: the header did not come through them
+    assert key("203.0.113.1") == "10.0.0.2"
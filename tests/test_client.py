@@ -1,6 +1,8 @@
-import pytest
+import xml.etree.ElementTree as ET
 from unittest.mock import AsyncMock, patch
 
+import pytest
+
 from fever_integration import FeverClient
 
 VALID_XML_TWO_ONLINE = """
@@ -88,4 +90,196 @@ async def test_fetch_events_parses_xml():
         plans = await client.fetch_events()
 
     assert len(plans) == 2
-    assert any(p.title == "Event One" for p in plans)
\ No newline at end of file
+    assert any(p.title == "Event One" for p in plans)
+
+
+@pytest.mark.asyncio
+async def test_stream_events_yields_batches(respx_mock):
+    from fever_integration import settings
+
+    respx_mock.get(settings.PROVIDER_URL).respond(200, text=VALID_XML_TWO_ONLINE)
+    client = FeverClient()
+
+    batches = [batch async for batch in client.stream_events(batch_size=1)]
+
+    assert [len(batch) for batch in batches] == [1, 1]
+    assert [p.id for batch in batches for p in batch] == ["bp1-1", "bp2-2"]
+    assert batches[0][0].min_price == 10.0
+    assert batches[0][0].max_price == 20.0
+
+
+@pytest.mark.asyncio
+async def test_stream_events_reads_the_batch_size_setting_per_call(
+    respx_mock, monkeypatch
+):
+    from fever_integration import settings
+
+    monkeypatch.setattr(settings, "STREAM_BATCH_SIZE", 1)
+    respx_mock.get(settings.PROVIDER_URL).respond(200, text=VALID_XML_TWO_ONLINE)
+    client = FeverClient()
+
+    batches = [batch async for batch in client.stream_events()]
+
+    assert [len(batch) for batch in batches] == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_stream_events_skips_offline_base_plans(respx_mock):
+    from fever_integration import settings
+
+    xml = VALID_XML_TWO_ONLINE.replace(
+        'base_plan_id="bp2" sell_mode="online"',
+        'base_plan_id="bp2" sell_mode="offline"',
+    )
+    respx_mock.get(settings.PROVIDER_URL).respond(200, text=xml)
+    client = FeverClient()
+
+    plans = [p async for batch in client.stream_events() for p in batch]
+
+    assert [p.id for p in plans] == ["bp1-1"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_events_sends_conditional_request(respx_mock):
+    import httpx
+
+    from fever_integration import settings
+
+    route = respx_mock.get(settings.PROVIDER_URL)
+    route.side_effect = [
+        httpx.Response(200, text=VALID_XML_TWO_ONLINE, headers={"ETag": '"v1"'}),
+        httpx.Response(304),
+    ]
+    client = FeverClient()
+
+    plans = await client.fetch_events()
+    assert len(plans) == 2
+    assert client.not_modified is False
+
+    plans = await client.fetch_events()
+    assert plans == []
+    assert client.not_modified is True
+    assert route.calls[1].request.headers["If-None-Match"] == '"v1"'
+
+
+@pytest.mark.asyncio
+async def test_fetch_events_retries_transient_errors(respx_mock, monkeypatch):
+    import httpx
+
+    from fever_integration import settings
+
+    monkeypatch.setattr(settings, "PROVIDER_BACKOFF", 0.0)
+    route = respx_mock.get(settings.PROVIDER_URL)
+    route.side_effect = [
+        httpx.ConnectError("connection refused"),
+        httpx.Response(503),
+        httpx.Response(200, text=VALID_XML_TWO_ONLINE),
+    ]
+    client = FeverClient()
+    await client.start()
+    http_client = client.http_client
+
+    plans = await client.fetch_events()
+    await client.aclose()
+
+    assert len(plans) == 2
+    assert route.call_count == 3
+    assert client.stats.retries == 2
+    assert client.stats.last_fetch_retries == 2
+    assert client.stats.failures == 0
+    assert client.stats.last_fetch_seconds is not None
+    assert http_client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_fetch_events_gives_up_after_retries(respx_mock, monkeypatch):
+    from fever_integration import settings
+
+    monkeypatch.setattr(settings, "PROVIDER_BACKOFF", 0.0)
+    monkeypatch.setattr(settings, "PROVIDER_RETRIES", 1)
+    route = respx_mock.get(settings.PROVIDER_URL).respond(503)
+    client = FeverClient()
+
+    plans = await client.fetch_events()
+
+    assert plans == []
+    assert route.call_count == 2
+    assert client.stats.failures == 1
+
+
+def _feed(base_plans, comment=""):
+    items = "".join(
+        f'<base_plan base_plan_id="bp{b}" '
+        f'sell_mode="{"offline" if b == 3 else "online"}" title="Event {b}">'
+        + "".join(
+            f'<plan plan_start_date="2025-01-0{p + 1}T10:00:00" '
+            f'plan_end_date="2025-01-0{p + 1}T12:00:00" plan_id="{p}">'
+            f'<zone zone_id="1" price="{b + p}.5" />'
+            f'<zone zone_id="2" price="{b * 2}.0" /></plan>'
+            for p in range(3)
+        )
+        + "</base_plan>"
+        for b in range(base_plans)
+    )
+    return (
+        '<?xml version="1.0"?>\n'
+        f'<planList version="1.0"><output>{comment}{items}</output></planList>'
+    )
+
+
+def _fields(plans):
+    return [
+        (p.id, p.title, p.start_datetime, p.end_datetime, p.min_price, p.fingerprint)
+        for p in plans
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("comment", ["", "<!-- <base_plan ignored> -->"])
+async def test_parse_executors_match_serial_parsing(monkeypatch, comment):
+    from fever_integration import settings
+    from fever_integration.client import _split_feed
+
+    xml = _feed(9, comment)
+    serial = _fields(FeverClient()._parse_plans(xml))
+    assert len(serial) == 8 * 3
+    if not comment:
+        assert len(_split_feed(xml, 2)) == 5
+
+    monkeypatch.setattr(settings, "PARSE_CHUNK_SIZE", 2)
+    monkeypatch.setattr(settings, "PARSE_WORKERS", 2)
+    for executor in ("none", "thread", "process"):
+        monkeypatch.setattr(settings, "PARSE_EXECUTOR", executor)
+        client = FeverClient()
+        try:
+            assert _fields(await client.parse_plans(xml)) == serial
+        finally:
+            await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_process_parsing_rejects_malformed_feed(monkeypatch):
+    from fever_integration import settings
+
+    monkeypatch.setattr(settings, "PARSE_EXECUTOR", "process")
+    monkeypatch.setattr(settings, "PARSE_CHUNK_SIZE", 2)
+    client = FeverClient()
+    try:
+        with pytest.raises(ET.ParseError):
+            await client.parse_plans(_feed(9).replace("</planList>", ""))
+    finally:
+        await client.aclose()
+
+
+def test_parse_emits_plan_records_with_shared_values():
+    from fever_integration import Plan
+    from fever_integration.models import PlanRecord, plan_fingerprint
+
+    plans = FeverClient()._parse_plans(_feed(2))
+
+    assert all(isinstance(plan, PlanRecord) for plan in plans)
+    # Equal date strings across base plans resolve to the same datetime object
+    assert plans[0].start_datetime is plans[3].start_datetime
+    assert plans[0].last_seen is plans[1].last_seen
+    orm_plan = Plan(**plans[0]._asdict())
+    assert plans[0].fingerprint == plan_fingerprint(orm_plan)
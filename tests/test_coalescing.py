@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from fever_integration import coalescing
+from fever_integration.coalescing import ResultCache, SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_call():
+    calls = 0
+
+    async def query():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return ["result"]
+
+    flights = SingleFlight()
+    results = await asyncio.gather(*(flights.run("key", query) for _ in range(20)))
+
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    # Once finished, the next caller runs a new query
+    await flights.run("key", query)
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_call():
+    flights = SingleFlight()
+
+    async def query():
+        await asyncio.sleep(0.01)
+        return 42
+
+    first = asyncio.ensure_future(flights.run("key", query))
+    second = asyncio.ensure_future(flights.run("key", query))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == 42
+
+
+def test_result_cache_expires_and_ignores_results_from_before_clear():
+    cache = ResultCache(max_entries=2)
+    cache.set("a", 1, ttl=60, epoch=cache.epoch)
+    assert cache.get("a") == 1
+
+    stale_epoch = cache.epoch
+    cache.clear()
+    cache.set("b", 2, ttl=60, epoch=stale_epoch)
+    assert cache.get("a") is None and cache.get("b") is None
+
+    cache.set("c", 3, ttl=-1, epoch=cache.epoch)
+    assert cache.get("c") is None
+
+    for key in "xyz":
+        cache.set(key, key, ttl=60, epoch=cache.epoch)
+    assert cache.get("x") is None and cache.get("z") == "z"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_requests_share_one_query(monkeypatch):
+    calls = 0
+
+    async def slow_load_events(db, starts_at, ends_at, after, limit):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return []
+
+    monkeypatch.setattr(coalescing, "load_events", slow_load_events)
+    monkeypatch.setattr(coalescing.settings, "EVENTS_CACHE_TTL", 30.0)
+    coalescing.clear_events_cache()
+
+    start, end = datetime(2025, 1, 1), datetime(2025, 2, 1)
+    await asyncio.gather(
+        *(coalescing.shared_load_events(start, end) for _ in range(50))
+    )
+    assert calls == 1
+
+    await coalescing.shared_load_events(start, end)
+    assert calls == 1  # served from the cache
+
+    coalescing.clear_events_cache()
+    await coalescing.shared_load_events(start, end)
+    assert calls == 2
+    coalescing.clear_events_cache()
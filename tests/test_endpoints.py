@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta, timezone
+
 import pytest
 
 from fever_integration import Plan
@@ -45,4 +46,303 @@ async def test_get_events_returns_filtered_events(client, db_session):
 
     assert events is not None and len(events) >= 2
     assert any(e["id"] == "bp1" for e in events)
-    assert any(e["id"] == "bp2" for e in events)
\ No newline at end of file
+    assert any(e["id"] == "bp2" for e in events)
+
+
+async def _seed_plans(make_plan, count):
+    from fever_integration import AsyncSessionLocal
+    from fever_integration.session import engine
+    from fever_integration.sync import _upsert_plans, refresh_event_summaries
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+    start = datetime(2025, 1, 1, 10, 0)
+    async with AsyncSessionLocal() as session:
+        touched = set()
+        await _upsert_plans(
+            session,
+            [
+                make_plan(
+                    f"page{i}",
+                    start + timedelta(hours=i),
+                    float(i),
+                    end=start + timedelta(hours=i + 1),
+                    max_price=float(i + 1),
+                )
+                for i in range(count)
+            ],
+            touched=touched,
+        )
+        await refresh_event_summaries(session, touched)
+        await session.commit()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", ["false", "true"])
+async def test_get_events_keyset_pagination(asgi_client, make_plan, stream):
+    await _seed_plans(make_plan, 5)
+    query = "/events?starts_at=2025-01-01T00:00:00Z&ends_at=2025-01-02T00:00:00Z"
+
+    full = (await asgi_client.get(f"{query}&stream={stream}")).json()
+    ids, after = [], None
+    while True:
+        url = f"{query}&limit=2&stream={stream}"
+        if after:
+            url += f"&after={after}"
+        body = (await asgi_client.get(url)).json()
+        ids.extend(event["id"] for event in body["data"]["events"])
+        after = body["data"]["next_cursor"]
+        if after is None:
+            break
+
+    assert full["error"] is None
+    assert "next_cursor" not in full["data"]
+    assert ids == [f"bp_page{i}" for i in range(5)]
+    assert ids == [event["id"] for event in full["data"]["events"]]
+
+
+@pytest.mark.asyncio
+async def test_get_events_rejects_invalid_cursor(asgi_client):
+    response = await asgi_client.get(
+        "/events?starts_at=2025-01-01T00:00:00Z&ends_at=2025-01-02T00:00:00Z"
+        "&limit=2&after=not-a-cursor"
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("paginated", [False, True])
+def test_render_events_matches_fastapi_encoding(paginated):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from fever_integration.endpoints import _event_item
+    from fever_integration.models import EventRow
+    from fever_integration.serialization import render_events
+
+    events = [
+        EventRow(
+            "bp1",
+            "Évènement",
+            datetime(2025, 1, 1, 10),
+            datetime(2025, 1, 1, 12),
+            10.0,
+            20.5,
+        ),
+        EventRow(
+            "bp2",
+            'Quote "two"',
+            datetime(2025, 1, 2, 9, 30, 15, 123),
+            datetime(2025, 1, 3),
+            0.0,
+            1e21,
+        ),
+        EventRow(
+            "bp3", "Ints", datetime(2025, 1, 4), datetime(2025, 1, 4, 23, 59, 59), 7, 8
+        ),
+    ]
+    data = {"events": [_event_item(event) for event in events]}
+    if paginated:
+        data["next_cursor"] = "abc"
+
+    expected = JSONResponse(jsonable_encoder({"data": data, "error": None})).body
+
+    assert render_events(events, paginated, "abc") == expected
+
+
+@pytest.mark.asyncio
+async def test_change_feed_returns_only_changed_events(
+    monkeypatch, asgi_client, make_plan
+):
+    from fever_integration import EventSummary, FeverClient, sync_events
+    from fever_integration.session import engine
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+        await conn.execute(EventSummary.__table__.delete())
+
+    start = datetime(2025, 3, 1, 10, 0)
+    plans = [make_plan(f"change{i}", start + timedelta(days=i), 10.0) for i in range(3)]
+
+    async def mock_fetch_events(self):
+        return plans
+
+    monkeypatch.setattr(FeverClient, "fetch_events", mock_fetch_events)
+    await sync_events()
+
+    first = (await asgi_client.get("/events/changes?limit=2")).json()["data"]
+    assert [e["id"] for e in first["events"]] == ["bp_change0", "bp_change1"]
+    assert first["has_more"] is True
+    url = f"/events/changes?since={first['next_token']}"
+    rest = (await asgi_client.get(url)).json()["data"]
+    assert [e["id"] for e in rest["events"]] == ["bp_change2"]
+    assert rest["has_more"] is False
+
+    token = rest["next_token"]
+    idle = (await asgi_client.get(f"/events/changes?since={token}")).json()["data"]
+    assert idle["events"] == [] and idle["next_token"] == token
+
+    plans[1] = make_plan("change1", start + timedelta(days=1), 15.0)
+    await sync_events()
+    delta = (await asgi_client.get(f"/events/changes?since={token}")).json()["data"]
+    assert [(e["id"], e["min_price"]) for e in delta["events"]] == [
+        ("bp_change1", 15.0)
+    ]
+
+    invalid = await asgi_client.get("/events/changes?since=nope")
+    assert invalid.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_events_etag_and_compression(monkeypatch, asgi_client, make_plan):
+    from fever_integration import queries, settings
+    from fever_integration.http_cache import clear_compressed_bodies
+
+    await _seed_plans(make_plan, 40)
+    clear_compressed_bodies()
+    monkeypatch.setattr(settings, "EVENTS_COMPRESSION", ["gzip"])
+    query = "/events?starts_at=2025-01-01T00:00:00Z&ends_at=2025-01-03T00:00:00Z"
+
+    plain = await asgi_client.get(query, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["Cache-Control"] == (
+        f"public, max-age={settings.REFRESH_TIMEOUT}"
+    )
+    etag = plain.headers["ETag"]
+
+    compressed = await asgi_client.get(query, headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"] != etag
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert compressed.content == plain.content  # decoded by httpx
+    other = await asgi_client.get(
+        query.replace("03T", "02T"), headers={"If-None-Match": etag}
+    )
+    assert other.status_code == 200 and other.headers["ETag"] != etag
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the database must not be queried")
+
+    # 304s and cached compressed bodies never reach the database
+    monkeypatch.setattr(queries, "_ordered_plans_stmt", fail)
+    for tag in (etag, compressed.headers["ETag"], f"W/{etag}"):
+        response = await asgi_client.get(query, headers={"If-None-Match": tag})
+        assert response.status_code == 304
+        assert response.content == b""
+    cached = await asgi_client.get(query, headers={"Accept-Encoding": "gzip"})
+    assert cached.content == plain.content
+
+    # Without the body cache every request renders its body
+    monkeypatch.setattr(settings, "EVENTS_COMPRESSED_CACHE", False)
+    with pytest.raises(AssertionError, match="must not be queried"):
+        await asgi_client.get(query, headers={"Accept-Encoding": "gzip"})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("coalesce", [True, False])
+async def test_get_events_etag_is_the_generation_the_body_was_read_at(
+    monkeypatch, asgi_client, make_plan, coalesce
+):
+    from fever_integration import generation, settings
+    from fever_integration.http_cache import clear_compressed_bodies
+    from fever_integration.session import AsyncSessionLocal
+
+    await _seed_plans(make_plan, 40)
+    clear_compressed_bodies()
+    monkeypatch.setattr(settings, "EVENTS_COMPRESSION", ["gzip"])
+    monkeypatch.setattr(settings, "EVENTS_COALESCE", coalesce)
+    async with AsyncSessionLocal() as session:
+        read_at = await generation.read_generation(session)
+    # The primary is a generation ahead of what the read session sees
+    monkeypatch.setattr(generation, "_current", read_at + 1)
+    query = "/events?starts_at=2025-01-01T00:00:00Z&ends_at=2025-01-03T00:00:00Z"
+
+    lagging = await asgi_client.get(query, headers={"Accept-Encoding": "gzip"})
+    assert lagging.headers["ETag"].startswith(f'"{read_at}-')
+    # Not served as, nor revalidated against, the current generation
+    again = await asgi_client.get(
+        query,
+        headers={
+            "Accept-Encoding": "gzip",
+            "If-None-Match": lagging.headers["ETag"],
+        },
+    )
+    assert again.status_code == 200
+    clear_compressed_bodies()
+
+
+def test_choose_encoding_follows_preferences_and_quality(monkeypatch):
+    from fever_integration import settings
+    from fever_integration.http_cache import choose_encoding
+
+    monkeypatch.setattr(settings, "EVENTS_COMPRESSION", ["gzip"])
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, br") is None
+    assert choose_encoding("*") == "gzip"
+    assert choose_encoding(None) is None
+    monkeypatch.setattr(settings, "EVENTS_COMPRESSION", [])
+    assert choose_encoding("gzip") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("source", ["plans", "snapshot", "slow_json"])
+async def test_events_batch_answers_every_range_in_one_query(
+    monkeypatch, asgi_client, make_plan, source
+):
+    from sqlalchemy import event
+
+    from fever_integration import settings
+    from fever_integration.session import read_engines
+    from fever_integration.snapshot import refresh_snapshot
+
+    await _seed_plans(make_plan, 40)
+    monkeypatch.setattr(settings, "EVENTS_COALESCE", False)
+    if source == "snapshot":
+        await refresh_snapshot()
+        monkeypatch.setattr(settings, "EVENTS_SNAPSHOT", True)
+    if source == "slow_json":
+        monkeypatch.setattr(settings, "EVENTS_FAST_JSON", False)
+    ranges = [
+        ("2025-01-01T00:00:00Z", "2025-01-01T18:00:00Z"),
+        ("2025-01-01T15:00:00Z", "2025-01-02T06:00:00Z"),
+        ("2025-03-01T00:00:00Z", "2025-03-02T00:00:00Z"),
+        ("2025-01-01T00:00:00Z", "2025-01-01T18:00:00Z"),
+    ]
+
+    expected = []
+    for starts_at, ends_at in ranges:
+        response = await asgi_client.get(
+            f"/events?starts_at={starts_at}&ends_at={ends_at}"
+        )
+        expected.append(response.json()["data"]["events"])
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    for read_engine in read_engines:
+        event.listen(read_engine.sync_engine, "before_cursor_execute", count)
+    try:
+        response = await asgi_client.post(
+            "/events/batch",
+            json={"ranges": [{"starts_at": s, "ends_at": e} for s, e in ranges]},
+        )
+    finally:
+        for read_engine in read_engines:
+            event.remove(read_engine.sync_engine, "before_cursor_execute", count)
+
+    assert response.status_code == 200
+    results = response.json()["data"]["results"]
+    assert [r["events"] for r in results] == expected
+    assert [(r["starts_at"], r["ends_at"]) for r in results] == ranges
+    assert len(expected[0]) == 8 and expected[2] == []
+    assert len(statements) == (0 if source == "snapshot" else 1)
+
+    invalid = {"ranges": [{"starts_at": "nope", "ends_at": ranges[0][1]}]}
+    assert (await asgi_client.post("/events/batch", json=invalid)).status_code == 400
+    empty = await asgi_client.post("/events/batch", json={"ranges": []})
+    assert empty.status_code == 422
+    item = {"starts_at": ranges[0][0], "ends_at": ranges[0][1]}
+    too_many = {"ranges": [item] * (settings.EVENTS_BATCH_MAX_RANGES + 1)}
+    assert (await asgi_client.post("/events/batch", json=too_many)).status_code == 422
@@ -0,0 +1,33 @@
+import pytest
+
+from fever_integration.metrics import _operation, observe_sync
+
+
+@pytest.mark.asyncio
+async def test_metrics_expose_requests_sync_and_db_timings(asgi_client):
+    observe_sync("ok", 1.5, parsed=10, written=4, unchanged=6)
+
+    response = await asgi_client.get(
+        "/events?starts_at=2025-01-01T00:00:00Z&ends_at=2025-01-02T00:00:00Z"
+    )
+    assert response.status_code == 200
+    await asgi_client.get("/no-such-route")
+    metrics = (await asgi_client.get("/metrics")).text
+
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/events",status="200"}'
+        in metrics
+    )
+    assert 'route="unmatched",status="404"' in metrics
+    assert "sync_plans_written_total" in metrics
+    assert "sync_last_success_timestamp_seconds" in metrics
+    assert 'db_statement_duration_seconds_count{engine="read",operation="SELECT"}' in (
+        metrics
+    )
+
+
+def test_statement_operation_labels_are_bounded():
+    assert _operation("  select 1") == "SELECT"
+    assert _operation("WITH x AS (SELECT 1) SELECT * FROM x") == "WITH"
+    assert _operation("PRAGMA journal_mode") == "OTHER"
+    assert _operation("") == "OTHER"
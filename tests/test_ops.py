@@ -0,0 +1,132 @@
+import asyncio
+import subprocess
+import sys
+
+import httpx
+import pytest
+
+from fever_integration import app
+
+
+@pytest.mark.asyncio
+async def test_readyz_reports_database_and_data(monkeypatch, asgi_client):
+    from fever_integration import ops, sync
+
+    assert (await asgi_client.get("/healthz")).json() == {"status": "ok"}
+
+    monkeypatch.setattr(sync, "last_sync_success", None)
+
+    async def state(has_plans):
+        return {"has_plans": has_plans, "updated_at": None}
+
+    monkeypatch.setattr(ops, "_database_state", lambda: state(False))
+    response = await asgi_client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["checks"]["database"] is True
+
+    # A recent sync that found nothing to load still counts as ready
+    monkeypatch.setattr(sync, "last_sync_success", 1e12)
+    assert (await asgi_client.get("/readyz")).status_code == 200
+
+    monkeypatch.setattr(sync, "last_sync_success", None)
+    monkeypatch.setattr(ops, "_database_state", lambda: state(True))
+    assert (await asgi_client.get("/readyz")).status_code == 200
+
+    async def unreachable():
+        raise ConnectionError("database down")
+
+    monkeypatch.setattr(ops, "_database_state", unreachable)
+    response = await asgi_client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["checks"]["database"] is False
+
+
+@pytest.mark.asyncio
+async def test_startup_does_not_wait_for_initial_sync(monkeypatch):
+    from fever_integration import main
+
+    synced = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def slow_sync(self, run_first=False):
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        synced.set()
+
+    async def noop(*args):
+        pass
+
+    monkeypatch.setattr(main.SyncScheduler, "run", slow_sync)
+    monkeypatch.setattr(main, "watch_generation", noop)
+
+    async def serve():
+        async with main.lifespan(app):
+            await asyncio.sleep(0.01)
+            assert not synced.is_set()
+
+    await asyncio.wait_for(serve(), timeout=5)
+    # The scheduler is cancelled on shutdown
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_sync_trigger_wakes_the_scheduler(monkeypatch):
+    from fastapi import FastAPI
+
+    from fever_integration import ops
+    from fever_integration.scheduler import SyncScheduler
+
+    monkeypatch.setattr(ops.settings, "SYNC_TRIGGER_TOKEN", "secret")
+    monkeypatch.setattr(ops.settings, "SYNC_TRIGGER_MIN_INTERVAL", 60.0)
+    # Off by default, so mounted on an app of its own
+    admin = FastAPI()
+    admin.include_router(ops.router)
+    admin.add_api_route("/sync", ops.trigger_sync, methods=["POST"])
+    scheduler = SyncScheduler(300)
+    admin.state.sync_scheduler = scheduler
+    operator = {"Authorization": "Bearer secret"}
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=admin), base_url="http://test"
+    ) as client:
+        assert (await client.post("/sync")).status_code == 401
+        wrong = {"Authorization": "Bearer guess"}
+        assert (await client.post("/sync", headers=wrong)).status_code == 401
+        assert not scheduler._wake.is_set()
+
+        response = await client.post("/sync", headers=operator)
+        assert response.status_code == 202
+        assert response.json()["status"] == "scheduled"
+        assert scheduler._wake.is_set()
+
+        # Back-to-back triggers are refused until the gap has passed
+        response = await client.post("/sync", headers=operator)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) == 60
+
+        scheduler.triggered_at = None
+        async with scheduler._lock:
+            response = await client.post("/sync", headers=operator)
+        assert response.json()["status"] == "running"
+
+        status = (await client.get("/sync")).json()["scheduler"]
+    assert status["interval"] == 300 and status["consecutive_failures"] == 0
+
+
+def test_sync_trigger_is_off_by_default():
+    routes = {(route.path, tuple(sorted(route.methods))) for route in app.routes}
+    assert ("/sync", ("POST",)) not in routes
+
+
+def test_package_import_is_lazy():
+    code = (
+        "import sys, fever_integration; "
+        "assert 'fever_integration.main' not in sys.modules; "
+        "assert 'uvicorn' not in sys.modules; "
+        "from fever_integration import FeverClient; "
+        "assert 'fever_integration.main' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,108 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from fever_integration import Plan, settings
+from fever_integration.partitions import (
+    add_months,
+    archive_cutoff,
+    create_tables,
+    is_enabled,
+    month_start,
+    partition_bounds,
+    partition_name,
+    partition_window,
+    plans_source,
+)
+
+
+def test_month_helpers():
+    assert month_start(datetime(2025, 3, 17, 10, 30)) == date(2025, 3, 1)
+    assert add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+    assert add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+    assert partition_name(date(2025, 3, 1)) == "plans_p2025_03"
+    assert partition_bounds(date(2025, 12, 1)) == ("2025-12-01", "2026-01-01")
+
+
+def test_partition_window_covers_previous_and_upcoming_months(monkeypatch):
+    monkeypatch.setattr(settings, "PLANS_PARTITION_MONTHS_AHEAD", 2)
+    assert partition_window(date(2025, 12, 15)) == [
+        date(2025, 11, 1),
+        date(2025, 12, 1),
+        date(2026, 1, 1),
+        date(2026, 2, 1),
+    ]
+
+
+def test_partitioning_is_postgres_only(monkeypatch):
+    monkeypatch.setattr(settings, "PLANS_PARTITIONED", True)
+    monkeypatch.setattr(settings, "PLANS_ARCHIVE_AFTER_MONTHS", 12)
+    monkeypatch.setattr(settings, "DB_URL", "sqlite+aiosqlite:///./test.db")
+    assert not is_enabled()
+    assert plans_source() is Plan.__table__
+
+    monkeypatch.setattr(settings, "DB_URL", "postgresql+asyncpg://u:p@db/fever")
+    assert is_enabled()
+    assert set(plans_source().c.keys()) == set(Plan.__table__.c.keys())
+
+
+def test_archive_cutoff_matches_archived_months(monkeypatch):
+    monkeypatch.setattr(settings, "PLANS_PARTITIONED", True)
+    monkeypatch.setattr(settings, "DB_URL", "postgresql+asyncpg://u:p@db/fever")
+    assert archive_cutoff(date(2025, 3, 17)) is None
+
+    monkeypatch.setattr(settings, "PLANS_ARCHIVE_AFTER_MONTHS", 12)
+    assert archive_cutoff(date(2025, 3, 17)) == datetime(2024, 3, 1)
+
+
+@pytest.mark.asyncio
+async def test_create_tables_upgrades_older_schemas(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
+    async with engine.begin() as conn:
+        # plans and event_summaries as created before fingerprint and version
+        await conn.exec_driver_sql(
+            "CREATE TABLE plans (id VARCHAR PRIMARY KEY, base_plan_id VARCHAR "
+            "NOT NULL, title VARCHAR NOT NULL, start_datetime DATETIME NOT NULL, "
+            "end_datetime DATETIME NOT NULL, last_seen DATETIME NOT NULL, "
+            "min_price FLOAT NOT NULL, max_price FLOAT NOT NULL)"
+        )
+        await conn.exec_driver_sql(
+            "INSERT INTO plans VALUES ('1', 'bp1', 'Event', '2025-01-01 10:00:00', "
+            "'2025-01-01 12:00:00', '2025-01-01 00:00:00', 10, 20)"
+        )
+        await conn.exec_driver_sql(
+            "CREATE TABLE event_summaries (base_plan_id VARCHAR, title VARCHAR, "
+            "min_start_datetime DATETIME NOT NULL, max_start_datetime DATETIME "
+            "NOT NULL, min_end_datetime DATETIME NOT NULL, max_end_datetime "
+            "DATETIME NOT NULL, min_price FLOAT NOT NULL, max_price FLOAT NOT NULL, "
+            "PRIMARY KEY (base_plan_id, title))"
+        )
+
+    try:
+        # Twice: the second run finds nothing to add
+        await create_tables(engine)
+        await create_tables(engine)
+        async with engine.connect() as conn:
+            columns = await conn.run_sync(
+                lambda sync: {
+                    table: {c["name"] for c in inspect(sync).get_columns(table)}
+                    for table in ("plans", "event_summaries")
+                }
+            )
+            indexes = await conn.run_sync(
+                lambda sync: {
+                    i["name"] for i in inspect(sync).get_indexes("event_summaries")
+                }
+            )
+            fingerprint = await conn.scalar(
+                Plan.__table__.select().with_only_columns(Plan.fingerprint)
+            )
+    finally:
+        await engine.dispose()
+    assert "fingerprint" in columns["plans"]
+    assert "version" in columns["event_summaries"]
+    assert "ix_event_summaries_version" in indexes
+    # Existing rows are kept, without a fingerprint until the next sync
+    assert fingerprint is None
@@ -0,0 +1,191 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from fever_integration import ProviderSources, sync
+from fever_integration.providers import settings
+
+
+def feed(base_plan_id, plan_id):
+    return f"""
+<planList><output>
+  <base_plan base_plan_id="{base_plan_id}" sell_mode="online"
+      title="Feed {base_plan_id}">
+    <plan plan_start_date="2025-01-01T10:00:00" plan_end_date="2025-01-01T12:00:00"
+        plan_id="{plan_id}" sell_from="2024-01-01T00:00:00"
+        sell_to="2025-01-01T09:00:00" sold_out="false">
+      <zone zone_id="1" capacity="100" price="10.0" name="Zone 1" numbered="true" />
+    </plan>
+  </base_plan>
+</output></planList>
+"""
+
+
+def provider(delays):
+    """Feeds named by path that answer after the given delay, 500 if None"""
+
+    async def handler(request):
+        name = request.url.path.strip("/")
+        delay = delays[name]
+        if delay is None:
+            return httpx.Response(500)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, text=feed(f"bp_{name}", name))
+
+    urls = [f"http://provider.test/{name}" for name in delays]
+    return urls, httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.fixture
+def streaming(request, monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_STREAMING", request.param)
+    return request.param
+
+
+async def collect(sources, streaming):
+    if not streaming:
+        return await sources.fetch_events()
+    return [plan async for _, batch in sources.stream_events() for plan in batch]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("streaming", [False, True], indirect=True)
+async def test_feeds_are_fetched_concurrently_and_failures_isolated(streaming):
+    urls, http_client = provider({"a": 0.2, "b": 0.2, "c": 0.2, "broken": None})
+    sources = ProviderSources(urls, http_client)
+
+    started = time.perf_counter()
+    plans = await collect(sources, streaming)
+    elapsed = time.perf_counter() - started
+    await sources.aclose()
+
+    assert sorted(plan.id for plan in plans) == ["bp_a-a", "bp_b-b", "bp_c-c"]
+    # The slowest feed, not the sum of all of them
+    assert elapsed < 0.5
+    assert [result.url for result in sources.failed] == [urls[3]]
+    assert [result.plans for result in sources.results] == [1, 1, 1, 0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("streaming", [False, True], indirect=True)
+async def test_slow_feed_is_skipped_after_its_timeout(streaming, monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_SOURCE_TIMEOUT", 0.1)
+    urls, http_client = provider({"fast": 0, "slow": 5})
+    sources = ProviderSources(urls, http_client)
+
+    started = time.perf_counter()
+    plans = await collect(sources, streaming)
+    assert time.perf_counter() - started < 1
+    await sources.aclose()
+
+    assert [plan.id for plan in plans] == ["bp_fast-fast"]
+    assert isinstance(sources.failed[0].error, asyncio.TimeoutError)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_bounds_fetches_in_flight(monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_CONCURRENCY", 2)
+    urls, http_client = provider({name: 0.1 for name in "abcd"})
+    sources = ProviderSources(urls, http_client)
+
+    started = time.perf_counter()
+    plans = await sources.fetch_events()
+    elapsed = time.perf_counter() - started
+    await sources.aclose()
+
+    assert len(plans) == 4 and 0.2 <= elapsed < 0.4
+
+
+@pytest.mark.asyncio
+async def test_sync_ingests_healthy_feeds_and_fails_only_if_all_fail(monkeypatch):
+    from fever_integration import AsyncSessionLocal, EventSummary, Plan
+    from fever_integration.session import engine
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+
+    urls, http_client = provider({"ok": 0, "broken": None})
+    monkeypatch.setattr(sync, "sources", ProviderSources(urls, http_client))
+    result = await sync.sync_events()
+
+    assert (result.status, result.written, result.failed_sources) == ("ok", 1, 1)
+    async with AsyncSessionLocal() as session:
+        assert await session.get(Plan, "bp_ok-ok") is not None
+
+    urls, http_client = provider({"broken": None, "down": None})
+    monkeypatch.setattr(sync, "sources", ProviderSources(urls, http_client))
+    result = await sync.sync_events()
+
+    assert result.status == "failed"
+    assert isinstance(result.error, httpx.HTTPStatusError)
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+        await conn.execute(EventSummary.__table__.delete())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("pipeline", [False, True])
+async def test_feed_failing_partway_is_rolled_back_alone(pipeline, monkeypatch):
+    from fever_integration import AsyncSessionLocal, EventSummary, Plan
+    from fever_integration.session import engine
+
+    monkeypatch.setattr(settings, "PROVIDER_STREAMING", not pipeline)
+    monkeypatch.setattr(settings, "STREAM_BATCH_SIZE", 1)
+    monkeypatch.setattr(settings, "PARSE_CHUNK_SIZE", 1)
+
+    async def body(name):
+        valid, _, end = feed(f"bp_{name}", name).partition("</output>")
+        yield valid.encode()
+        if name == "broken":
+            # Its first base plan is handed out before the feed turns out malformed
+            yield b'<base_plan base_plan_id="x">'
+        yield f"</output>{end}".encode()
+
+    async def handler(request):
+        return httpx.Response(200, content=body(request.url.path.strip("/")))
+
+    urls = ["http://provider.test/ok", "http://provider.test/broken"]
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(sync, "sources", ProviderSources(urls, http_client))
+    result = await sync.sync_events(pipeline=pipeline, refresh_caches=False)
+
+    assert (result.status, result.parsed, result.written) == ("ok", 1, 1)
+    assert result.failed_sources == 1
+    async with AsyncSessionLocal() as session:
+        assert await session.get(Plan, "bp_ok-ok") is not None
+        assert await session.get(Plan, "bp_broken-broken") is None
+        assert await session.get(EventSummary, ("bp_broken", "Feed bp_broken")) is None
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+        await conn.execute(EventSummary.__table__.delete())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["fetch", "stream", "pipeline"])
+async def test_malformed_feed_fails_and_is_downloaded_again(mode):
+    conditional = []
+
+    async def handler(request):
+        conditional.append(request.headers.get("If-None-Match"))
+        broken = feed("bp_a", "a").replace("</planList>", "")
+        return httpx.Response(200, text=broken, headers={"ETag": '"v1"'})
+
+    sources = ProviderSources(
+        ["http://provider.test/a"],
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    for _ in range(2):
+        if mode == "fetch":
+            await sources.fetch_events()
+        else:
+            batches = getattr(sources, f"{mode}_events")()
+            [plan async for _, batch in batches for plan in batch]
+        assert isinstance(sources.failed[0].error, SyntaxError)
+    await sources.aclose()
+
+    # The ETag of a feed that could not be parsed is not sent back
+    assert conditional == [None, None]
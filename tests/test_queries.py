@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from fever_integration import AsyncSessionLocal, Plan, settings
+from fever_integration.queries import load_events
+from fever_integration.session import engine
+from fever_integration.sync import _upsert_plans, refresh_event_summaries
+
+BASE = datetime(2025, 1, 1, 10, 0)
+
+
+# Plan id, base plan id, day, min price and title of the test plans
+PLANS = [
+    ("p1", "bp1", 1, 10.0, None),
+    ("p2", "bp1", 5, 5.0, None),
+    ("p3", "bp2", 2, 20.0, None),
+    ("p4", "bp2", 3, 30.0, None),
+    ("p5", "bp3", 10, 7.0, None),
+    ("p6", "bp4", 1, 8.0, "Old title"),
+    ("p7", "bp4", 2, 9.0, "New title"),
+]
+
+RANGES = [
+    (BASE, BASE + timedelta(days=4)),
+    (BASE + timedelta(days=2), BASE + timedelta(days=6)),
+    (BASE, BASE + timedelta(days=30)),
+    (BASE + timedelta(days=20), BASE + timedelta(days=30)),
+    (BASE + timedelta(days=1), BASE + timedelta(days=1, hours=2)),
+]
+
+
+async def populate(make_plan):
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+    async with AsyncSessionLocal() as session:
+        touched = set()
+        plans = [
+            make_plan(
+                plan_id,
+                BASE + timedelta(days=day),
+                price,
+                base_plan_id=base_plan_id,
+                title=title,
+                max_price=price * 2,
+            )
+            for plan_id, base_plan_id, day, price, title in PLANS
+        ]
+        await _upsert_plans(session, plans, touched=touched)
+        await refresh_event_summaries(session, touched)
+        await session.commit()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("starts_at,ends_at", RANGES)
+async def test_summary_matches_plans_aggregation(
+    monkeypatch, make_plan, starts_at, ends_at
+):
+    await populate(make_plan)
+
+    async with AsyncSessionLocal() as session:
+        monkeypatch.setattr(settings, "EVENTS_FROM_SUMMARY", False)
+        from_plans = await load_events(session, starts_at, ends_at)
+        monkeypatch.setattr(settings, "EVENTS_FROM_SUMMARY", True)
+        from_summary = await load_events(session, starts_at, ends_at)
+
+    assert sorted(from_summary) == sorted(from_plans)
+
+
+@pytest.mark.asyncio
+async def test_refresh_event_summaries_only_touches_given_base_plans(make_plan):
+    from sqlalchemy import select
+
+    from fever_integration import EventSummary
+
+    await populate(make_plan)
+    async with AsyncSessionLocal() as session:
+        cheaper = make_plan("p3", BASE + timedelta(days=2), 1.0, base_plan_id="bp2")
+        await _upsert_plans(session, [cheaper])
+        await refresh_event_summaries(session, ["bp1"])
+        await session.commit()
+        stale = await session.scalar(
+            select(EventSummary.min_price).where(EventSummary.base_plan_id == "bp2")
+        )
+        await refresh_event_summaries(session, ["bp2"])
+        await session.commit()
+        fresh = await session.scalar(
+            select(EventSummary.min_price).where(EventSummary.base_plan_id == "bp2")
+        )
+
+    assert stale == 20.0
+    assert fresh == 1.0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("source", ["plans", "summary", "snapshot"])
+@pytest.mark.parametrize("starts_at,ends_at", RANGES)
+@pytest.mark.parametrize("limit", [1, 2, 3])
+async def test_pages_cover_full_result_in_order(
+    monkeypatch, make_plan, source, starts_at, ends_at, limit
+):
+    from fever_integration.queries import decode_cursor, encode_cursor
+    from fever_integration.snapshot import build_snapshot
+
+    await populate(make_plan)
+
+    async with AsyncSessionLocal() as session:
+        expected = await load_events(session, starts_at, ends_at)
+        monkeypatch.setattr(settings, "EVENTS_FROM_SUMMARY", source == "summary")
+        monkeypatch.setattr(settings, "EVENTS_SNAPSHOT", source == "snapshot")
+        snapshot = await build_snapshot(session)
+        monkeypatch.setattr(
+            "fever_integration.queries.current_snapshot", lambda: snapshot
+        )
+
+        pages, cursor = [], None
+        while True:
+            page = await load_events(session, starts_at, ends_at, cursor, limit)
+            if not page:
+                break
+            pages.extend(page)
+            cursor = decode_cursor(encode_cursor(page[-1]))
+
+    assert pages == expected
+    assert [event.start_datetime for event in pages] == sorted(
+        event.start_datetime for event in pages
+    )
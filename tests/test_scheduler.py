@@ -0,0 +1,102 @@
+import asyncio
+
+import httpx
+import pytest
+
+from fever_integration import scheduler as scheduler_module
+from fever_integration.scheduler import SyncScheduler
+from fever_integration.sync import SyncResult
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(scheduler_module.settings, "SYNC_JITTER", 0.0)
+
+
+def test_transient_failures_retry_sooner_and_provider_errors_back_off(no_jitter):
+    scheduler = SyncScheduler(300)
+    timeout = SyncResult("failed", error=httpx.ConnectTimeout("slow"))
+    assert scheduler.next_delay(timeout) == 15.0
+    assert scheduler.next_delay(timeout) == 30.0
+    assert scheduler.next_delay(SyncResult("ok")) == 300.0
+    assert scheduler.failures == 0
+
+    provider_error = SyncResult("failed", error=ValueError("bad feed"))
+    assert scheduler.next_delay(provider_error) == 600.0
+    assert scheduler.next_delay(provider_error) == 1200.0
+    for _ in range(100):
+        delay = scheduler.next_delay(provider_error)
+    assert delay == 3600.0
+
+    # Not the leader, or skipped: no change to the failure count
+    assert scheduler.next_delay(None) == 300.0
+    assert scheduler.failures == 102
+
+
+def test_adaptive_interval_follows_provider_changes(no_jitter, monkeypatch):
+    monkeypatch.setattr(scheduler_module.settings, "SYNC_ADAPTIVE", True)
+    scheduler = SyncScheduler(300)
+
+    assert scheduler.next_delay(SyncResult("ok", written=5)) == 150.0
+    assert scheduler.next_delay(SyncResult("ok", written=5)) == 75.0
+    assert scheduler.next_delay(SyncResult("ok", written=5)) == 60.0
+    assert scheduler.next_delay(SyncResult("not_modified")) == 90.0
+    for _ in range(20):
+        scheduler.next_delay(SyncResult("ok", unchanged=10))
+    assert scheduler.interval == 1800.0
+
+
+def test_jitter_spreads_delays(monkeypatch):
+    monkeypatch.setattr(scheduler_module.settings, "SYNC_JITTER", 0.1)
+    scheduler = SyncScheduler(100)
+    delays = {scheduler.next_delay(SyncResult("ok")) for _ in range(20)}
+    assert len(delays) > 1 and all(90 <= delay <= 110 for delay in delays)
+
+
+@pytest.mark.asyncio
+async def test_runs_never_overlap_and_respect_the_deadline(monkeypatch):
+    monkeypatch.setattr(scheduler_module.settings, "SYNC_DEADLINE", 0.05)
+    cancelled = asyncio.Event()
+
+    async def hanging_sync():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    monkeypatch.setattr(scheduler_module, "sync_if_leader", hanging_sync)
+    scheduler = SyncScheduler(300)
+
+    first = asyncio.ensure_future(scheduler.run_once())
+    await asyncio.sleep(0)
+    assert scheduler.running
+    assert await scheduler.run_once() is None
+
+    result = await first
+    assert result.status == "failed" and cancelled.is_set()
+    assert scheduler.next_delay(result) < 300  # timeouts are transient
+
+
+@pytest.mark.asyncio
+async def test_trigger_runs_a_sync_now_and_cancel_stops_the_loop(monkeypatch):
+    runs = 0
+
+    async def sync():
+        nonlocal runs
+        runs += 1
+        return SyncResult("ok")
+
+    monkeypatch.setattr(scheduler_module, "sync_if_leader", sync)
+    scheduler = SyncScheduler(300)
+    task = asyncio.ensure_future(scheduler.run())
+    await asyncio.sleep(0.01)
+    assert runs == 0
+
+    assert scheduler.trigger()
+    await asyncio.sleep(0.01)
+    assert runs == 1 and scheduler.last_result.status == "ok"
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy import text
+
+from fever_integration import session
+
+
+@pytest.mark.asyncio
+async def test_in_memory_sqlite_reads_go_through_the_write_engine():
+    write = session._create_engine("sqlite+aiosqlite://", 1, 0)
+    read_engines = session._create_read_engines(["sqlite+aiosqlite://"], write)
+    assert read_engines == [write]
+
+    try:
+        async with write.begin() as conn:
+            await conn.execute(text("CREATE TABLE seen (id INTEGER)"))
+            await conn.execute(text("INSERT INTO seen VALUES (1)"))
+        factories = session._round_robin(read_engines)
+        async with next(factories)() as db:
+            assert await db.scalar(text("SELECT id FROM seen")) == 1
+    finally:
+        await write.dispose()
+
+
+@pytest.mark.asyncio
+async def test_reads_are_spread_round_robin_across_replicas(tmp_path):
+    write = session._create_engine(f"sqlite+aiosqlite:///{tmp_path}/primary.db", 1, 0)
+    urls = [f"sqlite+aiosqlite:///{tmp_path}/replica{i}.db" for i in range(2)]
+    replicas = session._create_read_engines(urls, write)
+    assert len(replicas) == 2 and write not in replicas
+
+    try:
+        for i, replica in enumerate(replicas):
+            async with replica.begin() as conn:
+                await conn.execute(text("CREATE TABLE replica (id INTEGER)"))
+                await conn.execute(text(f"INSERT INTO replica VALUES ({i})"))
+        factories = session._round_robin(replicas)
+        served = []
+        for _ in range(4):
+            async with next(factories)() as db:
+                served.append(await db.scalar(text("SELECT id FROM replica")))
+        assert served == [0, 1, 0, 1]
+    finally:
+        for target in (write, *replicas):
+            await target.dispose()
+
+
+def test_writes_and_reads_use_separate_engines():
+    if session._in_memory_sqlite(session.settings.DB_URL):
+        assert session.read_engines == [session.engine]
+    else:
+        assert session.engine not in session.read_engines
+    assert session.AsyncSessionLocal().bind is session.engine
+    assert session.ReadSessionLocal().bind in session.read_engines
+
+
+def test_pool_settings_apply_to_server_databases_only(monkeypatch):
+    monkeypatch.setattr(session.settings, "DB_POOL_RECYCLE", 60)
+    options = session._engine_options("postgresql+psycopg2://u:p@db/fever", 7, 3)
+    assert options["pool_size"] == 7 and options["max_overflow"] == 3
+    assert options["pool_recycle"] == 60
+
+    options = session._engine_options("sqlite+aiosqlite:///fever.db", 7, 3)
+    assert "pool_size" not in options and "max_overflow" not in options
+
+
+@pytest.mark.parametrize(
+    "url,in_memory",
+    [
+        ("sqlite+aiosqlite://", True),
+        ("sqlite+aiosqlite:///:memory:", True),
+        ("sqlite+aiosqlite:///fever.db", False),
+        ("postgresql+psycopg2://u:p@db/fever", False),
+    ],
+)
+def test_in_memory_sqlite_detection(url, in_memory):
+    assert session._in_memory_sqlite(url) is in_memory
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from fever_integration import AsyncSessionLocal, Plan, settings
+from fever_integration.queries import load_events
+from fever_integration.session import engine
+from fever_integration.snapshot import EventSnapshot, build_snapshot
+from fever_integration.sync import _upsert_plans
+
+BASE = datetime(2025, 1, 1, 10, 0)
+
+
+# Plan id, base plan id, start and end days and min price of the test plans
+PLANS = [
+    ("s1", "bp1", 1, 1.5, 10.0),
+    ("s2", "bp1", 5, 5.5, 5.0),
+    ("s3", "bp2", 2, 3, 20.0),
+    ("s4", "bp2", 3, 4, 30.0),
+    ("s5", "bp3", 10, 12, 7.0),
+    # Inverted dates must not be lost by the start time bound
+    ("s6", "bp4", 3, 2, 1.0),
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "starts_at,ends_at",
+    [
+        (BASE, BASE + timedelta(days=4)),
+        (BASE + timedelta(days=2), BASE + timedelta(days=2, hours=1)),
+        (BASE + timedelta(days=2), BASE + timedelta(days=6)),
+        (BASE - timedelta(days=10), BASE + timedelta(days=30)),
+        (BASE + timedelta(days=20), BASE + timedelta(days=30)),
+    ],
+)
+async def test_snapshot_matches_database(monkeypatch, make_plan, starts_at, ends_at):
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+
+    plans = [
+        make_plan(
+            plan_id,
+            BASE + timedelta(days=start_day),
+            price,
+            base_plan_id=base_plan_id,
+            end=BASE + timedelta(days=end_day),
+            max_price=price * 2,
+        )
+        for plan_id, base_plan_id, start_day, end_day, price in PLANS
+    ]
+    async with AsyncSessionLocal() as session:
+        await _upsert_plans(session, plans)
+        await session.commit()
+        snapshot = await build_snapshot(session)
+        monkeypatch.setattr(settings, "EVENTS_SNAPSHOT", False)
+        expected = await load_events(session, starts_at, ends_at)
+
+    assert len(snapshot) == len(PLANS)
+    assert sorted(snapshot.query(starts_at, ends_at)) == sorted(expected)
+
+
+def test_snapshot_requires_sorted_plans():
+    snapshot = EventSnapshot()
+    snapshot.append("bp1", "Event", BASE + timedelta(days=1), BASE, 1.0, 2.0)
+    with pytest.raises(ValueError):
+        snapshot.append("bp1", "Event", BASE, BASE, 1.0, 2.0)
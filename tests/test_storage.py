@@ -0,0 +1,108 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects import sqlite
+
+from fever_integration import AsyncSessionLocal, EventSummary, Plan, storage
+from fever_integration.config import settings
+from fever_integration.queries import plans_aggregate_stmt
+from fever_integration.session import engine
+
+
+async def _reset(plans):
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+    async with AsyncSessionLocal() as session:
+        session.add_all(plans)
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_connections_are_tuned():
+    async with engine.connect() as conn:
+        journal_mode = await conn.scalar(text("PRAGMA journal_mode"))
+        mmap_size = await conn.scalar(text("PRAGMA mmap_size"))
+        busy_timeout = await conn.scalar(text("PRAGMA busy_timeout"))
+
+    assert journal_mode == "wal"
+    assert mmap_size == settings.SQLITE_MMAP_SIZE
+    assert busy_timeout == settings.SQLITE_BUSY_TIMEOUT_MS
+
+
+def test_upsert_uses_the_database_dialect():
+    stmt = storage.upsert(Plan).on_conflict_do_nothing()
+    assert "ON CONFLICT DO NOTHING" in str(stmt.compile(dialect=sqlite.dialect()))
+    assert stmt.__module__.startswith("sqlalchemy.dialects.sqlite")
+
+
+@pytest.mark.asyncio
+async def test_events_query_reads_only_the_covering_index(make_plan):
+    start = datetime(2024, 1, 1)
+    await _reset(
+        [make_plan(f"cover{i}", start + timedelta(hours=i), 1.0) for i in range(2000)]
+    )
+    await storage.refresh_statistics()
+    stmt = plans_aggregate_stmt(datetime(2025, 1, 1), datetime(2025, 2, 1))
+    query = str(
+        stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    )
+    async with engine.connect() as conn:
+        plan = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {query}")
+        details = " ".join(row[-1] for row in plan.all())
+
+    assert "COVERING INDEX ix_plans_events_covering" in details
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("copy", [False, True], ids=["vacuum_into", "row_copy"])
+async def test_export_snapshot_writes_a_standalone_database(
+    tmp_path, monkeypatch, make_plan, copy
+):
+    await _reset([make_plan("snap1", datetime(2025, 1, 1, 10), 5.0)])
+    if copy:
+        # The row by row copy used for PostgreSQL primaries
+        monkeypatch.setattr(storage, "is_sqlite", lambda: False)
+    path = str(tmp_path / "events.db")
+
+    await storage.export_snapshot(path)
+    await storage.export_snapshot(path)  # replaces the previous one
+
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        rows = conn.execute("SELECT id, min_price FROM plans").fetchall()
+        tables = {
+            row[0]
+            for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        }
+    finally:
+        conn.close()
+    assert rows == [("snap1", 5.0)]
+    assert {Plan.__tablename__, EventSummary.__tablename__} <= tables
+    assert os.listdir(tmp_path) == ["events.db"]
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+
+
+@pytest.mark.asyncio
+async def test_read_only_node_reopens_a_replaced_snapshot(tmp_path, monkeypatch):
+    path = tmp_path / "events.db"
+    sqlite3.connect(path).close()
+    monkeypatch.setattr(settings, "DB_URL", f"sqlite+aiosqlite:///{path}")
+    monkeypatch.setattr(settings, "SQLITE_READ_ONLY", True)
+    monkeypatch.setattr(storage, "_snapshot_file", None)
+
+    assert await storage.reopen_if_replaced() is False
+    assert await storage.reopen_if_replaced() is False
+
+    shipped = tmp_path / "shipped.db"
+    sqlite3.connect(shipped).close()
+    os.replace(shipped, path)
+    assert await storage.reopen_if_replaced() is True
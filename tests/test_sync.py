@@ -1,7 +1,10 @@
-import pytest
 from datetime import datetime, timezone
+
+import pytest
+
 from fever_integration import FeverClient, Plan, sync_events
 
+
 @pytest.mark.asyncio
 async def test_sync_updates_plan_price(monkeypatch, db_session):
     session = await anext(db_session)
@@ -91,4 +94,179 @@ async def test_sync_events_inserts_and_updates(monkeypatch, db_session):
 
     result = await session.get(Plan, "sync1")
     assert result.min_price == 15.0
-    assert result.max_price == 25.0
\ No newline at end of file
+    assert result.max_price == 25.0
+
+
+@pytest.mark.asyncio
+async def test_upsert_plans_in_batches_keeps_last_duplicate(make_plan):
+    from sqlalchemy import func, select
+
+    from fever_integration import AsyncSessionLocal
+    from fever_integration.session import engine
+    from fever_integration.sync import _upsert_plans
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+
+    start = datetime(2025, 1, 1, 10, 0)
+    plans = [
+        make_plan(f"batch{i}", start, 10.0, base_plan_id="bp_batch") for i in range(5)
+    ]
+    plans.append(make_plan("batch0", start, 99.0, base_plan_id="bp_batch"))
+    async with AsyncSessionLocal() as session:
+        await _upsert_plans(session, plans, batch_size=2)
+        await session.commit()
+
+        count = await session.scalar(select(func.count()).select_from(Plan))
+        price = await session.scalar(select(Plan.min_price).where(Plan.id == "batch0"))
+
+    assert count == 5
+    assert price == 99.0
+
+
+@pytest.mark.asyncio
+async def test_sync_skips_unchanged_plans(monkeypatch, make_plan):
+    from fever_integration import AsyncSessionLocal
+    from fever_integration.session import engine
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+
+    def unchanged_plan(price):
+        return make_plan(
+            "unchanged1",
+            datetime(2025, 1, 1, 10, 0),
+            price,
+            last_seen=datetime(2024, 1, 1),
+        )
+
+    plans = [unchanged_plan(10.0)]
+
+    async def mock_fetch_events(self):
+        return plans
+
+    monkeypatch.setattr(FeverClient, "fetch_events", mock_fetch_events)
+
+    first = await sync_events()
+    second = await sync_events()
+
+    assert (first.written, first.unchanged) == (1, 0)
+    assert (second.written, second.unchanged) == (0, 1)
+    async with AsyncSessionLocal() as session:
+        stored = await session.get(Plan, "unchanged1")
+    assert stored.last_seen > datetime.fromisoformat("2024-01-01T00:00:00")
+
+    plans[:] = [unchanged_plan(11.0)]
+    third = await sync_events()
+
+    assert (third.written, third.unchanged) == (1, 0)
+    async with AsyncSessionLocal() as session:
+        stored = await session.get(Plan, "unchanged1")
+    assert stored.min_price == 11.0
+
+
+@pytest.mark.asyncio
+async def test_sync_bumps_generation_and_refreshes_snapshot(monkeypatch, make_plan):
+    from fever_integration import AsyncSessionLocal, generation, settings, snapshot
+    from fever_integration.session import engine
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+
+    monkeypatch.setattr(settings, "EVENTS_SNAPSHOT", True)
+    monkeypatch.setattr(snapshot, "_current", None)
+    plans = [make_plan("gen1", datetime(2025, 1, 1, 10, 0), 10.0, max_price=20.0)]
+
+    async def mock_fetch_events(self):
+        return plans
+
+    monkeypatch.setattr(FeverClient, "fetch_events", mock_fetch_events)
+
+    async with AsyncSessionLocal() as session:
+        before = await generation.read_generation(session)
+    await sync_events()
+    async with AsyncSessionLocal() as session:
+        after_first = await generation.read_generation(session)
+    await sync_events()  # unchanged data does not produce a new generation
+    async with AsyncSessionLocal() as session:
+        after_second = await generation.read_generation(session)
+
+    assert after_first == before + 1
+    assert after_second == after_first
+    assert generation.current_generation() == after_first
+    assert len(snapshot.current_snapshot()) == 1
+
+
+@pytest.mark.asyncio
+async def test_leader_lock_without_advisory_locks_always_leads():
+    from fever_integration.leader import leader
+
+    assert await leader.acquire()
+    await leader.release()
+
+
+@pytest.mark.asyncio
+async def test_sync_reports_provider_failures(monkeypatch):
+    error = ValueError("provider down")
+
+    async def failing_fetch_events(self):
+        self.stats.failures += 1
+        self.last_error = error
+        return []
+
+    monkeypatch.setattr(FeverClient, "fetch_events", failing_fetch_events)
+
+    result = await sync_events()
+
+    assert result.status == "failed" and result.error is error
+
+
+@pytest.mark.asyncio
+async def test_upsert_plans_only_updates_archived_months_in_place(
+    monkeypatch, make_plan
+):
+    from sqlalchemy import select
+
+    from fever_integration import AsyncSessionLocal, sync
+    from fever_integration.partitions import archive_table
+    from fever_integration.session import engine
+    from fever_integration.sync import _upsert_plans
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+        await conn.run_sync(archive_table.metadata.create_all)
+    monkeypatch.setattr(sync, "archive_cutoff", lambda: datetime(2021, 1, 1))
+    try:
+        async with AsyncSessionLocal() as session:
+            # As detaching their partition into the archive would leave them
+            for plan in (
+                make_plan("kept", datetime(2020, 1, 5, 10), 10.0),
+                make_plan("moved", datetime(2020, 1, 6, 10), 10.0),
+            ):
+                await session.execute(
+                    archive_table.insert().values(sync._plan_values(plan))
+                )
+
+            written, _ = await _upsert_plans(
+                session,
+                [
+                    make_plan("kept", datetime(2020, 1, 5, 10), 12.0),
+                    # New in an archived month: no partition to put it in
+                    make_plan("new", datetime(2020, 2, 1, 10), 10.0),
+                    make_plan("moved", datetime(2030, 1, 6, 10), 10.0),
+                ],
+            )
+            await session.commit()
+            result = await session.execute(
+                select(archive_table.c.id, archive_table.c.min_price)
+            )
+            archived = dict(result.all())
+            current = set((await session.scalars(select(Plan.id))).all())
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(Plan.__table__.delete())
+            await conn.run_sync(archive_table.metadata.drop_all)
+
+    assert written == 2
+    assert archived == {"kept": 12.0}
+    assert current == {"moved"}
@@ -0,0 +1,159 @@
+import asyncio
+
+import httpx
+import pytest
+
+from fever_integration import ProviderSources
+from fever_integration import client as client_module
+from fever_integration import sync
+from fever_integration.config import settings
+
+
+def feed(count):
+    base_plans = "".join(
+        f'<base_plan base_plan_id="bp{i}" sell_mode="online" title="Event {i}">'
+        f'<plan plan_start_date="2025-01-01T10:00:00" '
+        f'plan_end_date="2025-01-01T12:00:00" plan_id="{i}" '
+        f'sell_from="2024-01-01T00:00:00" sell_to="2025-01-01T09:00:00" '
+        f'sold_out="false"><zone zone_id="1" capacity="10" price="{i}.0" '
+        f'name="Zone" numbered="true" /></plan></base_plan>'
+        for i in range(count)
+    )
+    return f"<planList><output>{base_plans}</output></planList>"
+
+
+def provider(xml):
+    def handler(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=xml, headers={"ETag": '"v1"'})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.fixture
+def chunked(monkeypatch):
+    monkeypatch.setattr(settings, "PARSE_EXECUTOR", "thread")
+    monkeypatch.setattr(settings, "PARSE_CHUNK_SIZE", 2)
+
+
+@pytest.mark.asyncio
+async def test_pipeline_yields_the_plans_of_fetch_events_chunk_by_chunk(chunked):
+    sources = ProviderSources(["http://provider.test/a"], provider(feed(7)))
+    expected = await sources.clients[0].parse_plans(feed(7))
+
+    batches = [batch async for _, batch in sources.pipeline_events()]
+    await sources.aclose()
+
+    assert [len(batch) for batch in batches] == [2, 2, 2, 1]
+    plans = [plan for batch in batches for plan in batch]
+    assert [plan._replace(last_seen=None) for plan in plans] == [
+        plan._replace(last_seen=None) for plan in expected
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_parsing_waits_for_the_writer(chunked, monkeypatch):
+    monkeypatch.setattr(settings, "INGESTION_QUEUE_SIZE", 1)
+    monkeypatch.setattr(settings, "PARSE_WORKERS", 1)
+    parsed = 0
+    parse_chunk = client_module._parse_chunk
+
+    def counting_parse_chunk(xml_data):
+        nonlocal parsed
+        parsed += 1
+        return parse_chunk(xml_data)
+
+    monkeypatch.setattr(client_module, "_parse_chunk", counting_parse_chunk)
+    sources = ProviderSources(["http://provider.test/a"], provider(feed(40)))
+
+    batches = sources.pipeline_events()
+    await batches.__anext__()
+    await asyncio.sleep(0.1)
+    # One batch taken, one queued, one waiting to be queued, one parse ahead
+    assert parsed <= 4
+    await batches.aclose()
+    await sources.aclose()
+
+
+@pytest.mark.asyncio
+async def test_pipelined_sync_writes_and_remembers_validators(chunked, monkeypatch):
+    from fever_integration import AsyncSessionLocal, EventSummary, Plan
+    from fever_integration.session import engine
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+
+    sources = ProviderSources(["http://provider.test/a"], provider(feed(5)))
+    monkeypatch.setattr(sync, "sources", sources)
+
+    result = await sync.sync_events(pipeline=True, refresh_caches=False)
+    assert (result.status, result.parsed, result.written) == ("ok", 5, 5)
+    async with AsyncSessionLocal() as session:
+        assert (await session.get(Plan, "bp4-4")).min_price == 4.0
+
+    result = await sync.sync_events(pipeline=True, refresh_caches=False)
+    assert result.status == "not_modified"
+    await sources.aclose()
+
+    async with engine.begin() as conn:
+        await conn.execute(Plan.__table__.delete())
+        await conn.execute(EventSummary.__table__.delete())
+
+
+@pytest.mark.asyncio
+async def test_read_only_api_does_not_ingest(monkeypatch):
+    from fever_integration import app, main
+
+    monkeypatch.setattr(settings, "INGESTION_ENABLED", False)
+    monkeypatch.delattr(app.state, "sync_scheduler", raising=False)
+
+    async def forbidden(*args, **kwargs):
+        raise AssertionError("read-only API must not ingest")
+
+    async def noop(*args):
+        pass
+
+    monkeypatch.setattr(main, "create_tables", forbidden)
+    monkeypatch.setattr(main.SyncScheduler, "run", forbidden)
+    monkeypatch.setattr(main.provider_sources, "start", forbidden)
+    monkeypatch.setattr(main, "check_generation", noop)
+    monkeypatch.setattr(main, "watch_generation", noop)
+
+    async with main.lifespan(app):
+        await asyncio.sleep(0.01)
+        assert getattr(app.state, "sync_scheduler", None) is None
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_the_pipelined_scheduler_until_cancelled(monkeypatch):
+    from fever_integration import worker
+
+    started = asyncio.Event()
+    closed = asyncio.Event()
+    options = {}
+
+    async def run(self, run_first=False):
+        options.update(self.sync_options)
+        started.set()
+        await asyncio.sleep(30)
+
+    async def noop(*args):
+        pass
+
+    async def aclose():
+        closed.set()
+
+    monkeypatch.setattr(worker.SyncScheduler, "run", run)
+    monkeypatch.setattr(worker, "create_tables", noop)
+    monkeypatch.setattr(worker.sources, "start", noop)
+    monkeypatch.setattr(worker.sources, "aclose", aclose)
+
+    task = asyncio.ensure_future(worker.run_worker())
+    await asyncio.wait_for(started.wait(), 5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert options == {"pipeline": True, "refresh_caches": False}
+    assert closed.is_set()